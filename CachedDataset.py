@@ -53,13 +53,27 @@ class CachedDataset(Dataset):
     Initialize lists:
       self.seq_index  # sorted seq idx
     """
-    old_index_map = self._index_map[:]
-    self._index_map = range(self.num_seqs)
-    super(CachedDataset, self).init_seq_order(epoch=epoch, seq_list=seq_list)
     if seq_list:
-      seq_index = [self.tag_idx[tag] for tag in seq_list]
+      seq_index = [self._get_real_seq_idx_by_tag(tag) for tag in seq_list]
     else:
-      seq_index = self.get_seq_order_for_epoch(epoch, self.num_seqs, lambda s: self._seq_lengths[s][0])
+      seq_index = None
+    return self.init_seq_order_by_real_seq_idxs(epoch=epoch, seq_index=seq_index)
+
+  def init_seq_order_by_real_seq_idxs(self, epoch=None, seq_index=None):
+    """
+    Like :func:`init_seq_order` with a seq_list, but the seq order is given by the real seq idxs,
+    i.e. what :func:`_get_real_seq_idx_by_tag` would return for the tags.
+    This is used e.g. by MetaDataset, which resolves the tags only once.
+
+    :type epoch: int|None
+    :param list[int]|None seq_index: real seq idxs. if None, the seq order is via get_seq_order_for_epoch
+    :rtype: bool
+    """
+    old_index_map = self._index_map[:]
+    self._index_map = range(self.num_seqs)
+    super(CachedDataset, self).init_seq_order(epoch=epoch)
+    if seq_index is None:
+      seq_index = self.get_seq_order_for_epoch(epoch, self.num_seqs, numpy.asarray(self._seq_lengths)[:, 0])
 
     if self._seq_index == seq_index and self.num_seqs_cached_at_start == len(seq_index):
       return False
@@ -80,6 +94,13 @@ class CachedDataset(Dataset):
         return False
     return True
 
+  def _get_real_seq_idx_by_tag(self, tag):
+    """
+    :param str tag:
+    :rtype: int
+    """
+    return self.tag_idx[tag]
+
   def batch_set_generator_cache_whole_epoch(self):
     return True
 
@@ -135,13 +156,14 @@ class CachedDataset(Dataset):
     """
     assert start >= 0
     assert start <= end
-    if self.is_cached(start, end): return
+    with self.lock:
+      if self.is_cached(start, end): return
 
-    if self.cache_byte_size_total_limit > 0 and with_cache:  # If the cache is enabled.
-      self._load_seqs_with_cache(start, end)
-      return
+      if self.cache_byte_size_total_limit > 0 and with_cache:  # If the cache is enabled.
+        self._load_seqs_with_cache(start, end)
+        return
 
-    super(CachedDataset, self).load_seqs(start, end)
+      super(CachedDataset, self).load_seqs(start, end)
 
   def _load_seqs(self, start, end):
     raise NotImplementedError
@@ -482,3 +504,6 @@ class CachedDataset(Dataset):
   def get_tag(self, sorted_seq_idx):
     raise NotImplementedError
 
+  def supports_seq_list(self):
+    return True
+
@@ -1,7 +1,12 @@
 
 
+from __future__ import print_function
+
 from Dataset import Dataset, DatasetSeq
+from Log import log
 import math
+import os
+import sys
 
 
 class CachedDataset2(Dataset):
@@ -16,12 +21,21 @@ class CachedDataset2(Dataset):
   - handle seq ordering by overriding `init_seq_order`
   - you can set `_estimated_num_seqs`
   - you can set `_num_seqs` or `_num_timesteps` if you know them in advance
+
+  With `num_workers` > 0, `_collect_single_seq` is executed ahead of time in forked worker processes.
+  See :class:`SeqCollectorWorkerPool`.
+  This only works if `_collect_single_seq` depends on nothing else than what `init_seq_order` sets up.
   """
 
-  def __init__(self, **kwargs):
+  def __init__(self, num_workers=0, **kwargs):
+    """
+    :param int num_workers: if > 0, collects the seqs in that many worker processes, ahead of time
+    """
     super(CachedDataset2, self).__init__(**kwargs)
     self._num_timesteps = None
     self.epoch = None
+    self.num_workers = num_workers
+    self._seq_collector = None; " :type: SeqCollectorWorkerPool|None "
 
   def init_seq_order(self, epoch=None, seq_list=None):
     """
@@ -42,8 +56,31 @@ class CachedDataset2(Dataset):
     self._num_timesteps_accumulated = 0
     self._num_seqs = None
     self.epoch = epoch
+    if self._seq_collector and self._seq_collector.num_workers != self.num_workers:
+      self._terminate_seq_collector()
+    if self._seq_collector:
+      self._seq_collector.init_seq_order(epoch=epoch, seq_list=seq_list)
     return True
 
+  def finish_epoch(self):
+    """
+    Terminates the worker processes, if there are any. They will be recreated on demand.
+    Note that this means that they are forked again in every epoch, with a copy of the dataset in its current state,
+    and that the shared memory segments of the workers are allocated again in every epoch.
+    """
+    super(CachedDataset2, self).finish_epoch()
+    self._terminate_seq_collector()
+
+  def _terminate_seq_collector(self):
+    if self._seq_collector:
+      self._seq_collector.terminate()
+      self._seq_collector = None
+
+  def __del__(self):
+    # The pool does not reference us (see SeqCollectorWorkerPool), thus this does not create a ref cycle.
+    if getattr(self, "_seq_collector", None):
+      self._seq_collector.terminate()
+
   def _cleanup_old_seqs(self, seq_idx_end):
     i = 0
     while i < len(self.added_data):
@@ -85,7 +122,12 @@ class CachedDataset2(Dataset):
       self.expected_load_seq_start = start
     if self.added_data:
       start = max(self.added_data[-1].seq_idx + 1, start)
-    seqs = [self._collect_single_seq(seq_idx=seq_idx) for seq_idx in range(start, end)]
+    if self.num_workers > 0:
+      if not self._seq_collector:
+        self._seq_collector = SeqCollectorWorkerPool(dataset=self, num_workers=self.num_workers)
+      seqs = [self._seq_collector.get_seq(seq_idx=seq_idx) for seq_idx in range(start, end)]
+    else:
+      seqs = [self._collect_single_seq(seq_idx=seq_idx) for seq_idx in range(start, end)]
     seqs = list(filter(None, seqs))  # We might not know the num seqs in advance.
     self._num_timesteps_accumulated += sum([seq.num_frames for seq in seqs])
     self.added_data += seqs
@@ -190,3 +232,160 @@ class CachedDataset2(Dataset):
   def get_data_dtype(self, key):
     self._load_something()
     return self.added_data[0].get_data(key).dtype
+
+
+class SeqCollectorWorkerPool(object):
+  """
+  Calls dataset._collect_single_seq(seq_idx) ahead of time in forked worker processes.
+  Seq idx i is always handled by worker i % num_workers, and every worker handles its seqs in order,
+  thus we get the seqs back in order, and the result is the same as without workers.
+  Big arrays (see shared_mem_min_size) are passed back via shared memory (:class:`TaskSystem.SharedNumpyArray`),
+  if available. Every worker removes its shared memory segments when it exits.
+  """
+
+  lookahead_per_worker = 4
+  shared_mem_min_size = 1024 * 1024  # bytes. smaller arrays are pickled
+
+  def __init__(self, dataset, num_workers):
+    """
+    :param CachedDataset2 dataset: will be forked into the worker processes, in its current state
+    :param int num_workers:
+    """
+    from TaskSystem import AsyncTask
+    assert num_workers > 0
+    self.dataset = dataset
+    self.dataset_name = dataset.name
+    self.num_workers = num_workers
+    self.parent_pid = os.getpid()
+    self.workers = [
+      AsyncTask(func=self._worker_proc, name="%s seq collector %i" % (dataset.name, i), mustExec=False)
+      for i in range(num_workers)]
+    # The workers have their own copy of the dataset. We don't need it anymore in the parent,
+    # and we avoid a ref cycle dataset <-> pool, such that the dataset can terminate us in its __del__.
+    self.dataset = None
+    self.next_seq_idx_to_request = 0
+    self.next_seq_idx_to_receive = 0
+    self.end_seq_idx = None  # type: int|None  # first seq idx for which we got None
+
+  def _worker_proc(self, async_task):
+    """
+    :param TaskSystem.AsyncTask async_task:
+    """
+    import TaskSystem
+    dataset = self.dataset
+    dataset.num_workers = 0  # we are the worker
+    dataset._seq_collector = None
+    if sys.platform != "win32" and TaskSystem.SharedMem.is_shmget_functioning():
+      TaskSystem.SharedMemNumpyConfig["enabled"] = True
+      TaskSystem.SharedMemNumpyConfig["auto_pickling_min_size"] = self.shared_mem_min_size
+      TaskSystem.SharedMemNumpyConfig["min_shared_mem_size"] = 4 * self.shared_mem_min_size
+    # Instances which we inherited via fork belong to the parent. We must not remove them.
+    inherited_shared_mem = set(TaskSystem.SharedNumpyArray.ServerInstances)
+    try:
+      while True:
+        msg = async_task.conn.recv()
+        if msg[0] == "exit":
+          break
+        elif msg[0] == "init_seq_order":
+          _, epoch, seq_list = msg
+          dataset.init_seq_order(epoch=epoch, seq_list=seq_list)
+        elif msg[0] == "collect":
+          _, seq_idx = msg
+          try:
+            seq = dataset._collect_single_seq(seq_idx=seq_idx)
+          except Exception as exc:
+            sys.excepthook(*sys.exc_info())
+            async_task.conn.send(("exception", seq_idx, "%s: %s" % (type(exc).__name__, exc)))
+          else:
+            async_task.conn.send(("result", seq_idx, seq))
+        else:
+          assert False, "%s: unknown msg %r" % (self, msg)
+    finally:
+      # We exit via os._exit(), thus the atexit handlers of SharedMem would not run.
+      with TaskSystem.SharedNumpyArray.ServerLock:
+        for inst in TaskSystem.SharedNumpyArray.ServerInstances - inherited_shared_mem:
+          inst.mem.remove()
+
+  def _request_more(self, seq_idx):
+    """
+    :param int seq_idx: we want to have requested at least up to this seq idx (inclusive)
+    """
+    end = max(seq_idx + 1, self.next_seq_idx_to_receive + self.num_workers * self.lookahead_per_worker)
+    if self.end_seq_idx is not None:
+      end = min(end, self.end_seq_idx)
+    while self.next_seq_idx_to_request < end:
+      worker = self.workers[self.next_seq_idx_to_request % self.num_workers]
+      worker.conn.send(("collect", self.next_seq_idx_to_request))
+      self.next_seq_idx_to_request += 1
+
+  def _receive_next(self):
+    """
+    :return: the seq for self.next_seq_idx_to_receive
+    :rtype: DatasetSeq|None
+    """
+    from TaskSystem import numpy_copy_and_set_unused
+    seq_idx = self.next_seq_idx_to_receive
+    assert seq_idx < self.next_seq_idx_to_request
+    msg_type, msg_seq_idx, value = self.workers[seq_idx % self.num_workers].conn.recv()
+    assert msg_seq_idx == seq_idx, "%s: expected seq %i, got %i" % (self, seq_idx, msg_seq_idx)
+    self.next_seq_idx_to_receive += 1
+    if msg_type == "exception":
+      raise Exception("%s: exception in worker for seq %i: %s" % (self, seq_idx, value))
+    assert msg_type == "result"
+    if value is None:
+      if self.end_seq_idx is None or seq_idx < self.end_seq_idx:
+        self.end_seq_idx = seq_idx
+      return None
+    assert isinstance(value, DatasetSeq)
+    # Copy out of the shared memory, so that the worker can reuse it.
+    value.features = numpy_copy_and_set_unused(value.features)
+    value.ctc_targets = numpy_copy_and_set_unused(value.ctc_targets)
+    return value
+
+  def get_seq(self, seq_idx):
+    """
+    :param int seq_idx: must be increasing over the calls, until the next init_seq_order()
+    :rtype: DatasetSeq|None
+    :return: like dataset._collect_single_seq(seq_idx)
+    """
+    assert seq_idx >= self.next_seq_idx_to_receive, "%s: seq %i requested again" % (self, seq_idx)
+    if self.end_seq_idx is not None and seq_idx >= self.end_seq_idx:
+      return None
+    self._request_more(seq_idx)
+    while True:
+      seq = self._receive_next()
+      if self.next_seq_idx_to_receive > seq_idx:
+        return seq
+
+  def init_seq_order(self, epoch, seq_list):
+    """
+    Discards all outstanding seqs and lets the workers reinit their seq order.
+
+    :param int epoch:
+    :param list[str]|None seq_list:
+    """
+    while self.next_seq_idx_to_receive < self.next_seq_idx_to_request:
+      self._receive_next()
+    for worker in self.workers:
+      worker.conn.send(("init_seq_order", epoch, seq_list))
+    self.next_seq_idx_to_request = 0
+    self.next_seq_idx_to_receive = 0
+    self.end_seq_idx = None
+
+  def terminate(self):
+    """
+    Lets the workers exit and waits for them. Can be called multiple times.
+    """
+    if not self.workers or os.getpid() != self.parent_pid:  # e.g. a forked copy
+      return
+    for worker in self.workers:
+      try:
+        worker.conn.send(("exit",))
+      except (IOError, OSError, EOFError):
+        pass  # the worker is already gone
+      worker.join()
+    print("%s: terminated %i workers" % (self, self.num_workers), file=log.v5)
+    self.workers = []
+
+  def __repr__(self):
+    return "<%s for %s>" % (self.__class__.__name__, self.dataset_name)
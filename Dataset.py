@@ -15,6 +15,7 @@ from random import Random, random
 
 import sys
 import os
+import itertools
 import numpy
 import theano
 
@@ -42,6 +43,10 @@ class Dataset(object):
     set_or_remove("seq_ordering", config.value("batching", None))
     set_or_remove("shuffle_frames_of_nseqs", config.int('shuffle_frames_of_nseqs', 0) or None)
     set_or_remove("min_chunk_size", config.int('min_chunk_size', 0) or None)
+    set_or_remove("bucket_boundaries", config.opt_typed_value("bucket_boundaries", None))
+    set_or_remove("bucket_max_padded_frames", config.int("bucket_max_padded_frames", 0) or None)
+    set_or_remove("batch_prefetch_num_batches", config.int("batch_prefetch_num_batches", 0) or None)
+    set_or_remove("seq_lens_cache_dir", config.value("seq_lens_cache_dir", None))
 
   @classmethod
   def from_config(cls, config, **kwargs):
@@ -53,10 +58,24 @@ class Dataset(object):
     cls.kwargs_update_from_config(config, kwargs)
     return cls(**kwargs)
 
+  # Options which do not influence the seq lens, thus ignored for the seq lens cache hash.
+  _seq_lens_cache_ignored_kwargs = (
+    "name", "seq_ordering", "estimated_num_seqs",
+    "bucket_boundaries", "bucket_max_padded_frames", "bucket_max_pending_seqs",
+    "batch_prefetch_num_batches", "seq_lens_cache_dir", "num_workers")
+
+  def __new__(cls, *args, **kwargs):
+    obj = super(Dataset, cls).__new__(cls)
+    # Remember the dataset config, to identify the dataset for the seq lens cache. See _get_seq_lens_cache_filename.
+    obj._init_kwargs = kwargs
+    return obj
+
   def __init__(self, name="dataset",
                window=1, context_window=None, chunking="0",
                seq_ordering='default', shuffle_frames_of_nseqs=0, min_chunk_size=0,
-               estimated_num_seqs=None,):
+               estimated_num_seqs=None,
+               bucket_boundaries=None, bucket_max_padded_frames=None, bucket_max_pending_seqs=1000,
+               batch_prefetch_num_batches=0, seq_lens_cache_dir=None):
     """
     :param str name: e.g. "train" or "eval"
     :param int window: features will be of dimension window * feature_dim, as we add a context-window around.
@@ -67,6 +86,21 @@ class Dataset(object):
       See self.get_seq_order_for_epoch() for more details.
     :param int shuffle_frames_of_nseqs: shuffles the frames. not always supported
     :param None|int estimated_num_seqs: for progress reporting in case the real num_seqs is unknown
+    :param list[int]|int|str|None bucket_boundaries: enables bucketed batching for recurrent nets.
+      Seqs with len <= bucket_boundaries[i] (and > bucket_boundaries[i-1]) go into bucket i,
+      all longer seqs into the last bucket.
+      If int (or "auto:<int>"), that many buckets, with the boundaries from the quantiles of the seq lens.
+      See self._generate_batches_bucketed().
+    :param int|None bucket_max_padded_frames: max num of frames incl. padding (num seqs * max len) per batch
+    :param int bucket_max_pending_seqs: when the dataset does not support random access,
+      this limits how far a partially filled bucket can lag behind, and the num of seqs used to estimate the
+      seq len quantiles
+    :param int batch_prefetch_num_batches: if > 0, the batches are generated in a background thread,
+      up to this number of batches ahead. See :func:`generate_batches`
+    :param str|None seq_lens_cache_dir: if given, the seq lens which we collect for the seq ordering
+      (see :func:`get_seq_order_for_epoch`) and for the bucket boundaries are stored as NumPy files in this dir,
+      and reused in later runs. The files are identified by a hash over the dataset options
+      and the mtime and size of all input files.
     """
     self.name = name
     self.lock = RLock()  # Used when manipulating our data potentially from multiple threads.
@@ -99,7 +133,20 @@ class Dataset(object):
     assert isinstance(context_window, NumbersDict)
     self.context_window = context_window
     self.shuffle_frames_of_nseqs = shuffle_frames_of_nseqs
+    if isinstance(bucket_boundaries, str):
+      if bucket_boundaries.startswith("auto"):
+        bucket_boundaries = int(bucket_boundaries.split(":")[1]) if ":" in bucket_boundaries else 2
+      else:
+        bucket_boundaries = [int(x) for x in bucket_boundaries.split(",")]
+    if isinstance(bucket_boundaries, (list, tuple)):
+      bucket_boundaries = sorted(bucket_boundaries)
+    self.bucket_boundaries = bucket_boundaries
+    self.bucket_max_padded_frames = bucket_max_padded_frames
+    self.bucket_max_pending_seqs = bucket_max_pending_seqs
+    self.batch_prefetch_num_batches = batch_prefetch_num_batches
+    self.seq_lens_cache_dir = seq_lens_cache_dir
     self.epoch = None
+    self._seq_order_seq_lens_cache = {}  # type: dict[(object,int),numpy.ndarray]  # see get_seq_order_for_epoch
 
   def __repr__(self):
     return "<%s %r>" % (self.__class__.__name__, getattr(self, "name", "<unknown>"))
@@ -178,17 +225,19 @@ class Dataset(object):
     """
     assert start >= 0
     assert start <= end
-    if self.is_cached(start, end): return
-
-    if self.shuffle_frames_of_nseqs > 0:
-      # We always load N seqs at once and shuffle all their frames.
-      start, end = self._get_load_seqs_superset(start, end)
-      self._load_seqs(start, end)
-      while start < end:
-        self._shuffle_frames_in_seqs(start, start + self.shuffle_frames_of_nseqs)
-        start += self.shuffle_frames_of_nseqs
-    else:
-      self._load_seqs(start, end)
+    # The lock, as the batches might be generated in another thread. See BatchPrefetchThread.
+    with self.lock:
+      if self.is_cached(start, end): return
+
+      if self.shuffle_frames_of_nseqs > 0:
+        # We always load N seqs at once and shuffle all their frames.
+        start, end = self._get_load_seqs_superset(start, end)
+        self._load_seqs(start, end)
+        while start < end:
+          self._shuffle_frames_in_seqs(start, start + self.shuffle_frames_of_nseqs)
+          start += self.shuffle_frames_of_nseqs
+      else:
+        self._load_seqs(start, end)
 
   def _get_load_seqs_superset(self, start, end):
     """
@@ -219,7 +268,7 @@ class Dataset(object):
     """
     raise NotImplementedError
 
-  def get_seq_order_for_epoch(self, epoch, num_seqs, get_seq_len=None):
+  def get_seq_order_for_epoch(self, epoch, num_seqs, get_seq_len=None, seq_lens_cache_key=None):
     """
     Returns the order of the given epoch.
     This is mostly a static method, except that is depends on the configured type of ordering,
@@ -227,47 +276,178 @@ class Dataset(object):
 
     :param int epoch: for 'random', this determines the random seed
     :param int num_seqs:
-    :param ((int) -> int)|None get_seq_len: function (originalSeqIdx: int) -> int
+    :param ((int) -> int)|numpy.ndarray|None get_seq_len: function (originalSeqIdx: int) -> int,
+      or directly the seq lens, array of shape (num_seqs,)
+    :param object|None seq_lens_cache_key: if given, the seq lens we get via get_seq_len are cached
+      under this key (and num_seqs), such that we call get_seq_len only once per seq, over all epochs.
+      Only use this if the seq lens are always the same for the same key.
     :return: the order for the given epoch. such that seq_idx -> underlying idx
     :rtype: list[int]
     """
     assert num_seqs > 0
-    seq_index = list(range(num_seqs)); """ :type: list[int]. the real seq idx after sorting """
     if self.seq_ordering == 'default':
-      pass  # Keep order as-is.
+      return list(range(num_seqs))  # Keep order as-is.
+    elif self.seq_ordering.startswith('random'):
+      seq_index = list(range(num_seqs)); """ :type: list[int]. the real seq idx after shuffling """
+      tmp = self.seq_ordering.split(':')
+      nth = int(tmp[1]) if len(tmp) > 1 else 1
+      # Keep this deterministic! Use fixed seed.
+      rnd_seed = ((epoch-1) / nth + 1) if epoch else 1
+      rnd = Random(rnd_seed)
+      rnd.shuffle(seq_index)
+      return seq_index
     elif self.seq_ordering == 'sorted':
-      assert get_seq_len
-      seq_index.sort(key=get_seq_len)  # sort by length, starting with shortest
+      seq_lens = self._get_seq_lens_for_seq_order(num_seqs, get_seq_len, seq_lens_cache_key)
+      # Stable sort, thus the same as list.sort(). Sort by length, starting with shortest.
+      seq_index = numpy.argsort(seq_lens, kind="mergesort")
     elif self.seq_ordering == "sorted_reverse":
-      assert get_seq_len
-      seq_index.sort(key=get_seq_len, reverse=True)  # sort by length, in reverse, starting with longest
+      seq_lens = self._get_seq_lens_for_seq_order(num_seqs, get_seq_len, seq_lens_cache_key)
+      seq_index = numpy.argsort(-seq_lens, kind="mergesort")  # sort by length, in reverse, starting with longest
     elif self.seq_ordering.startswith('laplace'):
-      assert get_seq_len
+      seq_lens = self._get_seq_lens_for_seq_order(num_seqs, get_seq_len, seq_lens_cache_key)
       tmp = self.seq_ordering.split(':')
       bins = int(tmp[1]) if len(tmp) > 1 else 2
       nth = int(tmp[2]) if len(tmp) > 2 else 1
       rnd_seed = ((epoch - 1) // nth + 1) if epoch else 1
       rnd = Random(rnd_seed)
+      seq_index = list(range(num_seqs))
       rnd.shuffle(seq_index)
+      seq_index = numpy.array(seq_index, dtype="int64")
       out_index = []
       for i in range(bins):
-        if i == bins - 1:
-          part = seq_index[i * len(seq_index) // bins:][:]
-        else:
-          part = seq_index[i * len(seq_index) // bins:(i + 1) * len(seq_index) // bins][:]
-        part.sort(key=get_seq_len, reverse=(i%2 == 1))
-        out_index += part
-      seq_index = out_index
-    elif self.seq_ordering.startswith('random'):
-      tmp = self.seq_ordering.split(':')
-      nth = int(tmp[1]) if len(tmp) > 1 else 1
-      # Keep this deterministic! Use fixed seed.
-      rnd_seed = ((epoch-1) / nth + 1) if epoch else 1
-      rnd = Random(rnd_seed)
-      rnd.shuffle(seq_index)
+        part = seq_index[i * num_seqs // bins:(i + 1) * num_seqs // bins]
+        part_lens = seq_lens[part]
+        out_index.append(part[numpy.argsort(-part_lens if i % 2 == 1 else part_lens, kind="mergesort")])
+      seq_index = numpy.concatenate(out_index)
     else:
       assert False, "invalid batching specified: " + self.seq_ordering
-    return seq_index
+    return seq_index.tolist()
+
+  def _get_seq_lens_for_seq_order(self, num_seqs, get_seq_len, cache_key=None):
+    """
+    :param int num_seqs:
+    :param ((int) -> int)|numpy.ndarray get_seq_len: see :func:`get_seq_order_for_epoch`
+    :param object|None cache_key: see :func:`get_seq_order_for_epoch`
+    :return: seq lens, shape (num_seqs,)
+    :rtype: numpy.ndarray
+    """
+    assert get_seq_len is not None
+    if isinstance(get_seq_len, numpy.ndarray):
+      assert get_seq_len.shape == (num_seqs,)
+      return get_seq_len.astype("int64", copy=False)
+    if cache_key is not None:
+      if (cache_key, num_seqs) not in self._seq_order_seq_lens_cache:
+        seq_lens = self._load_seq_lens_cache_file(cache_key, num_seqs)
+        if seq_lens is None:
+          seq_lens = self._get_seq_lens_for_seq_order(num_seqs, get_seq_len)
+          self._save_seq_lens_cache_file(cache_key, num_seqs, seq_lens)
+        self._seq_order_seq_lens_cache[(cache_key, num_seqs)] = seq_lens
+      return self._seq_order_seq_lens_cache[(cache_key, num_seqs)]
+    return numpy.fromiter((get_seq_len(i) for i in range(num_seqs)), dtype="int64", count=num_seqs)
+
+  def _get_seq_lens_cache_input_files(self):
+    """
+    :return: the input files of this dataset. when any of them changes, the seq lens cache becomes invalid.
+      By default, we take all existing files which are referred to by the dataset options.
+      Datasets which get their files from elsewhere (e.g. via add_file) should extend this.
+    :rtype: list[str]
+    """
+    files = []
+
+    def collect(value):
+      if isinstance(value, (str, unicode)):
+        if os.path.isfile(value):
+          files.append(value)
+      elif isinstance(value, (list, tuple)):
+        for v in value:
+          collect(v)
+      elif isinstance(value, dict):
+        for k in sorted(value.keys()):
+          collect(value[k])
+
+    collect(getattr(self, "_init_kwargs", {}))
+    return files
+
+  def _get_seq_lens_cache_filename(self, cache_key, num_seqs, postfix="seq_lens"):
+    """
+    :param object cache_key: see :func:`get_seq_order_for_epoch`
+    :param int|None num_seqs:
+    :param str postfix: also other per-dataset information can be cached in the same dir, e.g. a tag index
+    :return: filename in self.seq_lens_cache_dir, or None if the seq lens cache is disabled
+    :rtype: str|None
+    """
+    if not self.seq_lens_cache_dir:
+      return None
+    import hashlib
+    h = hashlib.md5()
+
+    def update_hash(value):
+      if isinstance(value, numpy.ndarray):
+        # The repr would be abbreviated for big arrays.
+        h.update(repr((value.dtype, value.shape)).encode("utf8"))
+        h.update(numpy.ascontiguousarray(value).tobytes())
+      elif isinstance(value, (list, tuple)):
+        h.update(("%s(%i)" % (type(value).__name__, len(value))).encode("utf8"))
+        for v in value:
+          update_hash(v)
+      elif isinstance(value, dict):
+        h.update(("dict(%i)" % len(value)).encode("utf8"))
+        for k in sorted(value.keys(), key=str):
+          update_hash(k)
+          update_hash(value[k])
+      else:
+        h.update(repr(value).encode("utf8"))
+
+    init_kwargs = getattr(self, "_init_kwargs", {})
+    files = []
+    for fn in self._get_seq_lens_cache_input_files():
+      st = os.stat(fn)
+      files.append((os.path.abspath(fn), st.st_mtime, st.st_size))
+    update_hash(self.__class__.__name__)
+    update_hash({k: v for (k, v) in init_kwargs.items() if k not in self._seq_lens_cache_ignored_kwargs})
+    update_hash((files, cache_key, num_seqs))
+    return os.path.join(self.seq_lens_cache_dir, "%s.%s.%s.npy" % (self.__class__.__name__, h.hexdigest(), postfix))
+
+  def _load_seq_lens_cache_file(self, cache_key, num_seqs):
+    """
+    :param object cache_key:
+    :param int|None num_seqs:
+    :return: the seq lens, or None if not cached
+    :rtype: numpy.ndarray|None
+    """
+    fn = self._get_seq_lens_cache_filename(cache_key, num_seqs)
+    if not fn or not os.path.exists(fn):
+      return None
+    try:
+      seq_lens = numpy.load(fn)
+    except (IOError, OSError, ValueError) as exc:
+      print("%s: cannot read seq lens cache file %s: %s" % (self, fn, exc), file=log.v3)
+      return None
+    if num_seqs is not None and seq_lens.shape != (num_seqs,):
+      print("%s: seq lens cache file %s has unexpected shape %s" % (self, fn, seq_lens.shape), file=log.v3)
+      return None
+    print("%s: use seq lens cache file %s" % (self, fn), file=log.v4)
+    return seq_lens
+
+  def _save_seq_lens_cache_file(self, cache_key, num_seqs, seq_lens):
+    """
+    :param object cache_key:
+    :param int|None num_seqs:
+    :param numpy.ndarray seq_lens:
+    """
+    fn = self._get_seq_lens_cache_filename(cache_key, num_seqs)
+    if not fn:
+      return
+    try:
+      if not os.path.exists(self.seq_lens_cache_dir):
+        os.makedirs(self.seq_lens_cache_dir)
+      # Write to a tmp file first, such that other processes never see a partially written file.
+      tmp_fn = "%s.tmp.%i" % (fn, os.getpid())
+      with open(tmp_fn, "wb") as f:
+        numpy.save(f, numpy.asarray(seq_lens, dtype="int64"))
+      os.rename(tmp_fn, fn)
+    except (IOError, OSError) as exc:
+      print("%s: cannot write seq lens cache file %s: %s" % (self, fn, exc), file=log.v3)
 
   def init_seq_order(self, epoch=None, seq_list=None):
     """
@@ -283,6 +463,14 @@ class Dataset(object):
     self.rnd_seq_drop = Random(epoch or 1)
     return False
 
+  def finish_epoch(self):
+    """
+    This gets called at the end of the epoch.
+    After this, further calls to get_data() or load_seqs() are invalid, until init_seq_order() is called again.
+    Datasets can release resources here, e.g. worker processes or threads.
+    """
+    pass
+
   def _base_init(self):
     self.nbytes = 0
     self.zpad = None
@@ -375,6 +563,29 @@ class Dataset(object):
     """
     return "seq-%i" % sorted_seq_idx
 
+  def get_all_tags(self):
+    """
+    By default, this loads every seq, i.e. it is a full pass over the data.
+    Datasets which know their tags without loading the seqs should override this.
+
+    :return: the tags of all seqs in the current seq order. init_seq_order() must have been called before.
+    :rtype: list[str]
+    """
+    tags = []
+    seq_idx = 0
+    while self.is_less_than_num_seqs(seq_idx):
+      self.load_seqs(seq_idx, seq_idx + 1)
+      tags.append(self.get_tag(seq_idx))
+      seq_idx += 1
+    return tags
+
+  def supports_seq_list(self):
+    """
+    :rtype: bool
+    :return: whether init_seq_order() supports a predefined order via seq_list (list of seq tags)
+    """
+    return False
+
   def have_corpus_seq_idx(self):
     """
     :rtype: bool
@@ -660,6 +871,14 @@ class Dataset(object):
       if chunk_size != 0:
         print("Non-recurrent network, chunk size %i:%i ignored" % (chunk_size, chunk_step), file=log.v4)
         chunk_size = 0
+      if self.bucket_boundaries:
+        print("Non-recurrent network, bucketing ignored", file=log.v4)
+    elif self.bucket_boundaries:
+      for batch in self._generate_batches_bucketed(
+            batch_size=batch_size, max_seqs=max_seqs, max_seq_length=max_seq_length, seq_drop=seq_drop,
+            chunk_size=chunk_size, chunk_step=chunk_step, used_data_keys=used_data_keys):
+        yield batch
+      return
     batch = Batch()
     ctx_lr = self._get_context_window_left_right()
     for seq_idx, t_start, t_end in self.iterate_seqs(
@@ -694,6 +913,128 @@ class Dataset(object):
     if batch.get_all_slices_num_frames() > 0:
       yield batch
 
+  def _generate_batches_bucketed(self, batch_size, max_seqs, max_seq_length, seq_drop,
+                                 chunk_size, chunk_step, used_data_keys):
+    """
+    Bucketed batching for recurrent nets. See self.bucket_boundaries.
+    Every bucket collects its own batch, which is finished when it exceeds batch_size, max_seqs
+    or self.bucket_max_padded_frames. That way, the seqs in one batch have similar lengths,
+    and we need less padding.
+
+    If the dataset supports random access (self.batch_set_generator_cache_whole_epoch()),
+    we go through the whole epoch and shuffle the batches of all buckets, deterministic per epoch.
+    Otherwise, we must yield the batches with increasing start seq idx (e.g. CachedDataset2 removes older seqs),
+    thus a batch is only yielded when no older seq is still pending in some other bucket,
+    and partially filled buckets are flushed when they lag more than self.bucket_max_pending_seqs behind.
+
+    The padding efficiency (real frames / frames incl. padding) is reported at the end of the epoch.
+
+    :param int batch_size:
+    :param int|float max_seqs:
+    :param NumbersDict max_seq_length:
+    :param float seq_drop:
+    :param int chunk_size:
+    :param int chunk_step:
+    :param set(str)|None used_data_keys:
+    :return: generator of batches
+    """
+    random_access = self.batch_set_generator_cache_whole_epoch()
+    max_padded_frames = self.bucket_max_padded_frames or batch_size
+    ctx_lr = self._get_context_window_left_right()
+
+    def seq_iterator():
+      for seq_idx_, t_start_, t_end_ in self.iterate_seqs(
+            chunk_size=chunk_size, chunk_step=chunk_step, used_data_keys=used_data_keys):
+        if ctx_lr:
+          t_start_ -= ctx_lr[0]
+          t_end_ += ctx_lr[1]
+        length_ = t_end_ - t_start_
+        if length_.any_compare(max_seq_length, (lambda a, b: a > b)):
+          continue
+        if length_.max_value() > batch_size:
+          print("warning: sequence length (%i) larger than limit (%i)" % (length_.max_value(), batch_size),
+                file=log.v4)
+        if self.rnd_seq_drop.random() < seq_drop:
+          continue
+        yield seq_idx_, t_start_, length_
+
+    seqs = seq_iterator()
+    boundaries = self.bucket_boundaries
+    # If the seq lens cache is enabled, we take the quantiles from all seq lens which we have seen in an earlier run.
+    seq_lens_cache_key = ("bucket_seq_lens", chunk_size, chunk_step, sorted(used_data_keys or []))
+    collected_seq_lens = None  # type: list[int]|None  # to be stored in the seq lens cache
+    if isinstance(boundaries, int):  # automatic, via quantiles of the seq lens
+      num_buckets = boundaries
+      quantiles = [100. * (i + 1) / num_buckets for i in range(num_buckets - 1)]
+      cached_seq_lens = self._load_seq_lens_cache_file(seq_lens_cache_key, None)
+      if cached_seq_lens is not None and len(cached_seq_lens) > 0:
+        boundaries = numpy.percentile(cached_seq_lens, quantiles).astype("int64").tolist()
+      else:
+        if self.seq_lens_cache_dir:
+          collected_seq_lens = []
+        first_seqs = []
+        for seq in seqs:
+          first_seqs.append(seq)
+          if not random_access and len(first_seqs) >= self.bucket_max_pending_seqs:
+            break
+        if first_seqs:
+          boundaries = numpy.percentile(
+            [length.max_value() for (_, _, length) in first_seqs], quantiles).astype("int64").tolist()
+        seqs = itertools.chain(first_seqs, seqs)
+    boundaries = numpy.array(boundaries, dtype="int64")
+
+    bucket_batches = [Batch() for _ in range(len(boundaries) + 1)]
+    finished_batches = []  # type: list[Batch]
+    stats = {"num_batches": 0, "num_frames": 0, "num_padded_frames": 0}
+
+    def finish(batch_):
+      """
+      :param Batch batch_:
+      :rtype: Batch
+      """
+      stats["num_batches"] += 1
+      stats["num_frames"] += sum([seq_.frame_length.max_value() for seq_ in batch_.seqs])
+      stats["num_padded_frames"] += batch_.get_all_slices_num_frames()
+      return batch_
+
+    for seq_idx, t_start, length in seqs:
+      if collected_seq_lens is not None:
+        collected_seq_lens.append(length.max_value())
+      bucket_idx = int(numpy.searchsorted(boundaries, length.max_value(), side="left"))
+      batch = bucket_batches[bucket_idx]
+      dt, ds = batch.try_sequence_as_slice(length)
+      if ds > 1 and (
+            (dt * ds).max_value() > batch_size or ds > max_seqs or (dt * ds).max_value() > max_padded_frames):
+        finished_batches.append(batch)
+        batch = bucket_batches[bucket_idx] = Batch()
+      batch.add_sequence_as_slice(seq_idx=seq_idx, seq_start_frame=t_start, length=length)
+      if random_access:
+        continue
+      # Flush buckets which lag behind too much.
+      for i, batch in enumerate(bucket_batches):
+        if batch.seqs and batch.start_seq + self.bucket_max_pending_seqs <= seq_idx:
+          finished_batches.append(batch)
+          bucket_batches[i] = Batch()
+      # Yield all finished batches which do not start after any pending seq.
+      pending_start = min([batch.start_seq for batch in bucket_batches if batch.seqs] or [seq_idx + 1])
+      finished_batches.sort(key=lambda b: b.start_seq)
+      while finished_batches and finished_batches[0].start_seq <= pending_start:
+        yield finish(finished_batches.pop(0))
+
+    finished_batches.extend([batch for batch in bucket_batches if batch.seqs])
+    if random_access:
+      Random(self.epoch or 1).shuffle(finished_batches)
+    else:
+      finished_batches.sort(key=lambda b: b.start_seq)
+    for batch in finished_batches:
+      yield finish(batch)
+
+    if collected_seq_lens:
+      self._save_seq_lens_cache_file(seq_lens_cache_key, None, numpy.array(collected_seq_lens, dtype="int64"))
+    print("%s, epoch %s, bucketed batching with boundaries %s: %i batches, padding efficiency %.1f%%" % (
+      self, self.epoch, boundaries.tolist(), stats["num_batches"],
+      100. * stats["num_frames"] / max(stats["num_padded_frames"], 1)), file=log.v4)
+
   def batch_set_generator_cache_whole_epoch(self):
     """
     The BatchSetGenerator can cache the list of batches which we generated across epochs.
@@ -709,17 +1050,22 @@ class Dataset(object):
     """
     return False
 
-  def generate_batches(self, shuffle_batches=False, **kwargs):
+  def generate_batches(self, shuffle_batches=False, prefetch_num_batches=None, **kwargs):
     """
     :param bool shuffle_batches:
+    :param int|None prefetch_num_batches: if > 0, generate the batches in a background thread.
+      by default self.batch_prefetch_num_batches. See :class:`EngineBatch.BatchPrefetchThread`.
     :param kwargs: will be passed to :func:`_generate_batches`
     :rtype: BatchSetGenerator
     """
+    if prefetch_num_batches is None:
+      prefetch_num_batches = self.batch_prefetch_num_batches
     return BatchSetGenerator(
       dataset=self,
       generator=self._generate_batches(**kwargs),
       shuffle_batches=shuffle_batches,
-      cache_whole_epoch=self.batch_set_generator_cache_whole_epoch())
+      cache_whole_epoch=self.batch_set_generator_cache_whole_epoch(),
+      prefetch_num_batches=prefetch_num_batches)
 
   @classmethod
   def index_shape_for_batches(cls, batches, data_key="data"):
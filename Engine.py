@@ -384,6 +384,11 @@ class Engine:
 
       self.init_train_epoch()
       self.train_epoch()
+      for batches in self.dataset_batches.values():
+        batches.stop()  # the prefetch thread must not run while the datasets are reinitialized
+      self.train_data.finish_epoch()
+      for dataset in self.get_eval_datasets().values():
+        dataset.finish_epoch()
 
       rebatch = False
 
@@ -1,5 +1,11 @@
 
+from __future__ import print_function
+
 import random
+import sys
+import threading
+import numpy
+from Log import log
 from Util import NumbersDict
 
 
@@ -124,6 +130,29 @@ class Batch:
   def get_total_num_frames(self):
     return sum([s.frame_length for s in self.seqs])
 
+  def get_seq_idxs_and_batch_slices(self):
+    """
+    :return: seq idx and batch slice per part
+    :rtype: (list[int], list[int])
+    """
+    return [s.seq_idx for s in self.seqs], [s.batch_slice for s in self.seqs]
+
+  def get_key_frame_infos(self, key):
+    """
+    :param str key:
+    :return: per part: (seq start frame, frame length, batch frame offset) for this key,
+      or None if the part has no data (or only empty data) for this key
+    :rtype: list[(int,int,int)|None]
+    """
+    res = []
+    for s in self.seqs:
+      start, end = s.seq_start_frame.get(key), s.seq_end_frame.get(key)
+      if start is None or end is None or end == start:
+        res.append(None)
+      else:
+        res.append((start, end - start, s.batch_frame_offset[key]))
+    return res
+
   @property
   def start_seq(self):
     if not self.seqs:
@@ -142,6 +171,217 @@ class Batch:
     return self.end_seq - self.start_seq
 
 
+class NumbersDictArray(object):
+  """
+  Struct-of-arrays representation of a list of NumbersDict (with int values).
+  For every key, we store the values of all entries in one numpy array,
+  and a mask whether the entry has a value for this key.
+  """
+
+  __slots__ = ("keys", "values", "has_value", "broadcast_values", "has_broadcast_value")
+
+  def __init__(self, numbers_dicts):
+    """
+    :param list[NumbersDict] numbers_dicts:
+    """
+    keys = set()
+    for d in numbers_dicts:
+      keys.update(d.dict.keys())
+    self.keys = tuple(sorted(keys))  # type: tuple[str]
+    n = len(numbers_dicts)
+    self.values = numpy.zeros((n, len(self.keys)), dtype="int64")
+    self.has_value = numpy.zeros((n, len(self.keys)), dtype="bool")
+    self.broadcast_values = numpy.zeros((n,), dtype="int64")
+    self.has_broadcast_value = numpy.zeros((n,), dtype="bool")
+    for i, d in enumerate(numbers_dicts):
+      if d.value is not None:
+        self.broadcast_values[i] = d.value
+        self.has_broadcast_value[i] = True
+      for j, key in enumerate(self.keys):
+        if key in d.dict:
+          self.values[i, j] = d.dict[key]
+          self.has_value[i, j] = True
+
+  def __len__(self):
+    return self.values.shape[0]
+
+  def __getitem__(self, i):
+    """
+    :param int i:
+    :rtype: NumbersDict
+    """
+    return NumbersDict(
+      numbers_dict={key: int(self.values[i, j]) for (j, key) in enumerate(self.keys) if self.has_value[i, j]},
+      broadcast_value=int(self.broadcast_values[i]) if self.has_broadcast_value[i] else None)
+
+  def get_column(self, key):
+    """
+    Like [d.get(key) for d in numbers_dicts].
+
+    :param str key:
+    :return: (values, valid), both of shape (n,). values are 0 where not valid (where d.get(key) is None)
+    :rtype: (numpy.ndarray, numpy.ndarray)
+    """
+    if key in self.keys:
+      j = self.keys.index(key)
+      values = numpy.where(self.has_value[:, j], self.values[:, j], self.broadcast_values)
+      valid = self.has_value[:, j] | self.has_broadcast_value
+    else:
+      values = self.broadcast_values
+      valid = self.has_broadcast_value
+    return numpy.where(valid, values, 0), valid
+
+
+class CompactBatchSeqCopyPart(object):
+  """
+  View on one part of a :class:`CompactBatch`. Provides the same interface as :class:`BatchSeqCopyPart`.
+  """
+
+  __slots__ = ("batch", "idx")
+
+  def __init__(self, batch, idx):
+    """
+    :param CompactBatch batch:
+    :param int idx:
+    """
+    self.batch = batch
+    self.idx = idx
+
+  @property
+  def seq_idx(self):
+    return int(self.batch.seq_idxs[self.idx])
+
+  @property
+  def seq_start_frame(self):
+    return self.batch.seq_start_frames[self.idx]
+
+  @property
+  def seq_end_frame(self):
+    return self.batch.seq_end_frames[self.idx]
+
+  @property
+  def batch_slice(self):
+    return int(self.batch.batch_slices[self.idx])
+
+  @property
+  def batch_frame_offset(self):
+    return self.batch.batch_frame_offsets[self.idx]
+
+  @property
+  def frame_length(self):
+    return self.seq_end_frame - self.seq_start_frame
+
+  def __repr__(self):
+    keys = ("seq_idx", "seq_start_frame", "seq_end_frame", "batch_slice", "batch_frame_offset")
+    return "<CompactBatchSeqCopyPart %s>" % " ".join(["%s=%r" % (k, getattr(self, k)) for k in keys])
+
+
+class CompactBatch(object):
+  """
+  Struct-of-arrays representation of a :class:`Batch`, which cannot be extended anymore.
+  This needs much less memory and less Python objects than a Batch with its list of BatchSeqCopyPart,
+  e.g. when the BatchSetGenerator caches the whole epoch.
+  The per-part values are available as numpy arrays, e.g. for vectorized batch assembly,
+  and via `seqs`, which returns views with the same interface as BatchSeqCopyPart.
+  """
+
+  __slots__ = (
+    "seq_idxs", "seq_start_frames", "seq_end_frames", "batch_slices", "batch_frame_offsets",
+    "num_slices", "max_num_frames_per_slice")
+
+  def __init__(self, batch):
+    """
+    :param Batch|CompactBatch batch:
+    """
+    self.seq_idxs = numpy.array([s.seq_idx for s in batch.seqs], dtype="int64")
+    self.seq_start_frames = NumbersDictArray([s.seq_start_frame for s in batch.seqs])
+    self.seq_end_frames = NumbersDictArray([s.seq_end_frame for s in batch.seqs])
+    self.batch_slices = numpy.array([s.batch_slice for s in batch.seqs], dtype="int64")
+    self.batch_frame_offsets = NumbersDictArray([s.batch_frame_offset for s in batch.seqs])
+    self.num_slices = batch.num_slices
+    self.max_num_frames_per_slice = NumbersDict(batch.max_num_frames_per_slice)
+
+  @classmethod
+  def from_batch(cls, batch):
+    """
+    :param Batch|CompactBatch batch:
+    :rtype: CompactBatch
+    """
+    if isinstance(batch, CompactBatch):
+      return batch
+    return cls(batch)
+
+  def __repr__(self):
+    return "<CompactBatch start_seq:%r, #seqs:%i>" % (self.start_seq, len(self.seq_idxs))
+
+  @property
+  def seqs(self):
+    """
+    :rtype: list[CompactBatchSeqCopyPart]
+    """
+    return [CompactBatchSeqCopyPart(self, i) for i in range(len(self.seq_idxs))]
+
+  def get_frame_lengths(self, key):
+    """
+    :param str key:
+    :return: (lengths, valid) of shape (num_parts,), like [s.frame_length.get(key) for s in seqs].
+      lengths are 0 where not valid.
+    :rtype: (numpy.ndarray, numpy.ndarray)
+    """
+    start, start_valid = self.seq_start_frames.get_column(key)
+    end, end_valid = self.seq_end_frames.get_column(key)
+    valid = start_valid & end_valid
+    return numpy.where(valid, end - start, 0), valid
+
+  def get_seq_idxs_and_batch_slices(self):
+    """
+    See :func:`Batch.get_seq_idxs_and_batch_slices`.
+    :rtype: (list[int], list[int])
+    """
+    return self.seq_idxs.tolist(), self.batch_slices.tolist()
+
+  def get_key_frame_infos(self, key):
+    """
+    See :func:`Batch.get_key_frame_infos`. Vectorized over the parts.
+    :param str key:
+    :rtype: list[(int,int,int)|None]
+    """
+    lens, valid = self.get_frame_lengths(key)
+    valid &= (lens != 0)
+    starts, _ = self.seq_start_frames.get_column(key)
+    offsets, _ = self.batch_frame_offsets.get_column(key)
+    return [
+      (start, l, o) if v else None
+      for (start, l, o, v) in zip(starts.tolist(), lens.tolist(), offsets.tolist(), valid.tolist())]
+
+  def get_all_slices_num_frames(self):
+    """
+    See :func:`Batch.get_all_slices_num_frames`.
+    :rtype: int
+    """
+    return self.max_num_frames_per_slice.max_value() * self.num_slices
+
+  def get_total_num_frames(self):
+    return sum([s.frame_length for s in self.seqs])
+
+  @property
+  def start_seq(self):
+    if not len(self.seq_idxs):
+      return None
+    return int(numpy.min(self.seq_idxs))
+
+  @property
+  def end_seq(self):
+    if not len(self.seq_idxs):
+      return None
+    return int(numpy.max(self.seq_idxs)) + 1
+
+  def get_num_seqs(self):
+    if not len(self.seq_idxs):
+      return 0
+    return self.end_seq - self.start_seq
+
+
 class BatchSetGenerator:
   """
   This will give you the next batches (list[Batch]) such that you can use them for assign_dev_data().
@@ -151,28 +391,52 @@ class BatchSetGenerator:
   you call self.advance() explicitly to go forward to next batches.
   """
 
-  def __init__(self, dataset, generator, shuffle_batches=True, cache_whole_epoch=True):
+  def __init__(self, dataset, generator, shuffle_batches=True, cache_whole_epoch=True, prefetch_num_batches=0):
     """
     :type dataset: Dataset.Dataset
     :type generator: iter[Batch]
+    :param bool shuffle_batches:
+    :param bool cache_whole_epoch:
+    :param int prefetch_num_batches: if > 0, the generator runs in a background thread,
+      which generates up to this number of batches ahead of time
     """
     self.dataset = dataset
     self.generator = generator
     self.shuffle_batches = shuffle_batches
     # In some cases, it might be faster to cache the list of batches.
     self.cache_whole_epoch = cache_whole_epoch
-    self.cache = []  # type: list[Batch]
+    self.cache = []  # type: list[CompactBatch]
     self.reached_end = False
+    self.num_batches_read = 0
+    self.total_num_batches = None  # type: int|None  # known once we reached the end
+    self.prefetch_thread = None  # type: BatchPrefetchThread|None
+    if prefetch_num_batches > 0:
+      self.prefetch_thread = BatchPrefetchThread(
+        dataset=dataset, generator=generator, max_num_batches=prefetch_num_batches)
     random.seed(1234)
     self._reset()
 
+  def __del__(self):
+    if self.prefetch_thread:
+      self.prefetch_thread.stop(join=False)
+
+  def stop(self):
+    """
+    Stops and joins the prefetch thread, if there is one.
+    Call this when you are done with this generator, at the latest before the dataset gets reinitialized,
+    because the thread might still call load_seqs() on the dataset.
+    Afterwards, you can still use the batches which were already read, or the cache (see reset()).
+    """
+    if self.prefetch_thread:
+      self.prefetch_thread.stop()
+
   def _reset(self):
     self.buffer = self.cache[:]
     if self.shuffle_batches:
       random.shuffle(self.buffer)
     self.cache_active = self.reached_end
     self.reached_end = False
-    self.last_batch = None  # type: Batch
+    self.last_batch = None  # type: Batch|CompactBatch
     self.current_batch_idx = 0
 
   def reset(self):
@@ -186,11 +450,21 @@ class BatchSetGenerator:
     if self.reached_end:
       return False
     try:
-      batch = next(self.generator)
+      if self.prefetch_thread:
+        batch = self.prefetch_thread.get()
+      else:
+        batch = next(self.generator)
     except StopIteration:
       self.reached_end = True
+      if not self.cache_active:
+        self.total_num_batches = self.num_batches_read
+      if self.prefetch_thread:
+        self.prefetch_thread.stop()  # it has finished anyway. this just joins it
       return False
     else:
+      self.num_batches_read += 1
+      if self.cache_whole_epoch:
+        batch = CompactBatch.from_batch(batch)  # we might keep many of them in the cache
       self.buffer += [batch]
       if self.cache_whole_epoch and not self.cache_active:
         self.cache += [batch]
@@ -205,7 +479,7 @@ class BatchSetGenerator:
 
   def peek_next_n(self, n):
     """
-    :rtype: list[Batch]
+    :rtype: list[Batch|CompactBatch]
     :returns it might return less. There is no way to know in advance.
     If self.has_more() is True, it will at least return one.
     """
@@ -230,6 +504,9 @@ class BatchSetGenerator:
     """
     if self.cache_active:
       return self.dataset.generic_complete_frac(self.current_batch_idx, len(self.cache))
+    if self.total_num_batches is not None:
+      # E.g. with prefetching, we might know the number of batches already.
+      return self.dataset.generic_complete_frac(self.current_batch_idx, self.total_num_batches)
     if not self.last_batch:
       return self.dataset.generic_complete_frac(0, None)
     # We cannot use the batch idx because we don't know the number
@@ -250,3 +527,103 @@ class BatchSetGenerator:
     :rtype: int
     """
     return self.current_batch_idx
+
+
+class BatchPrefetchThread:
+  """
+  Runs the batch generator (e.g. Dataset._generate_batches()) in a background thread
+  and keeps up to `max_num_batches` generated batches in a queue.
+  Thus, the batch planning (which might need get_seq_length() or load_seqs())
+  overlaps with the computation (e.g. the train step) in the main thread.
+  The generator is executed while holding dataset.lock.
+  This does not hold a reference to the BatchSetGenerator, such that it can be garbage collected,
+  which will stop this thread.
+  """
+
+  def __init__(self, dataset, generator, max_num_batches):
+    """
+    :param Dataset.Dataset dataset:
+    :param iter[Batch] generator:
+    :param int max_num_batches:
+    """
+    try:
+      # noinspection PyCompatibility
+      from Queue import Queue
+    except ImportError:
+      # noinspection PyCompatibility
+      from queue import Queue
+    assert max_num_batches > 0
+    self.queue = Queue(maxsize=max_num_batches)
+    self.stop_event = threading.Event()
+    self.thread = threading.Thread(
+      target=self._thread_main, name="BatchPrefetchThread %s" % dataset,
+      kwargs=dict(dataset=dataset, generator=generator, queue=self.queue, stop_event=self.stop_event))
+    self.thread.daemon = True
+    self.thread.start()
+
+  @staticmethod
+  def _thread_main(dataset, generator, queue, stop_event):
+    """
+    :param Dataset.Dataset dataset:
+    :param iter[Batch] generator:
+    :param Queue.Queue queue: we put tuples (type, value) into it, type in "batch", "end", "exception"
+    :param threading.Event stop_event:
+    """
+    try:
+      from Queue import Full
+    except ImportError:
+      from queue import Full
+    while not stop_event.is_set():
+      try:
+        with dataset.lock:
+          item = ("batch", next(generator))
+      except StopIteration:
+        item = ("end", None)
+      except Exception:
+        item = ("exception", sys.exc_info())
+      while not stop_event.is_set():
+        try:
+          queue.put(item, timeout=1.)
+          break
+        except Full:
+          continue
+      if item[0] != "batch":
+        break
+
+  def get(self):
+    """
+    :return: the next batch
+    :rtype: Batch
+    :raises StopIteration: when the generator has finished
+    """
+    try:
+      from Queue import Empty
+    except ImportError:
+      from queue import Empty
+    while True:
+      try:
+        item_type, value = self.queue.get(timeout=1.)
+        break
+      except Empty:
+        if not self.thread.is_alive():
+          raise Exception("%s was stopped" % self.thread.name)
+    if item_type == "end":
+      self.queue.put(("end", None))  # such that we raise StopIteration again on the next call
+      raise StopIteration
+    if item_type == "exception":
+      self.queue.put(("exception", value))
+      exc_type, exc_value, exc_tb = value
+      print("Exception in %s:" % self.thread.name, file=log.v1)
+      sys.excepthook(exc_type, exc_value, exc_tb)
+      import six
+      six.reraise(exc_type, exc_value, exc_tb)
+    assert item_type == "batch"
+    return value
+
+  def stop(self, join=True):
+    """
+    :param bool join: wait until the thread has finished. it finishes its current generator step first
+    """
+    self.stop_event.set()
+    if join and self.thread is not threading.current_thread():
+      self.thread.join()
@@ -740,8 +740,8 @@ class HDFForwardTaskThread(TaskThread):
       assert len(results[0]) == 1
       features = results[0][0]
       batch = batchess[0][0]
-      from EngineBatch import Batch
-      assert isinstance(batch, Batch)
+      from EngineBatch import Batch, CompactBatch
+      assert isinstance(batch, (Batch, CompactBatch))
       if "inputs" not in self.cache:
         self.inputs = self.cache.create_dataset("inputs", (self.cache.attrs['numSeqs'], features.shape[-1]), dtype='f', maxshape=(None, None), compression=self.compression)
       if features.shape[-1] > self.inputs.shape[1]:
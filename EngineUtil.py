@@ -10,7 +10,7 @@ def assign_dev_data(device, dataset, batches, load_seqs=True):
   """
   :type device: Device.Device
   :type dataset: Dataset.Dataset
-  :type batches: list[EngineBatch.Batch]
+  :type batches: list[EngineBatch.Batch|EngineBatch.CompactBatch]
   :returns successful and how much batch idx to advance.
   :rtype: (bool,int)
   """
@@ -24,37 +24,39 @@ def assign_dev_data(device, dataset, batches, load_seqs=True):
   for batch in batches:
     if load_seqs: dataset.load_seqs(batch.start_seq, batch.end_seq)
     device.num_frames += batch.get_total_num_frames()
+    seq_idxs, batch_slices = batch.get_seq_idxs_and_batch_slices()
+    batch_slices = [q + offset_slice for q in batch_slices]
+    # input-data, input-index will also be set in this loop. That is data-key "data".
+    # targets are usually data-key "classes".
+    # device.used_data_keys are set by the train-net, but we will also get here during forward-only,
+    # e.g. via SprintInterface, where we don't have e.g. the "classes" data.
+    # In that case, the frame length for k is not valid. In some earlier code, it could also be 0 in that case.
+    key_infos = {k: batch.get_key_frame_infos(k) for k in device.used_data_keys}
     with dataset.lock:
-      for seq in batch.seqs:
-        o = seq.batch_frame_offset
-        q = seq.batch_slice + offset_slice
-        l = seq.frame_length
-        # input-data, input-index will also be set in this loop. That is data-key "data".
-        # targets are usually data-key "classes".
+      for i, (seq_idx, q) in enumerate(zip(seq_idxs, batch_slices)):
         for k in device.used_data_keys:
-          # device.used_data_keys are set by the train-net, but we will also get here during forward-only,
-          # e.g. via SprintInterface, where we don't have e.g. the "classes" data.
-          # In that case, l.get(k) should be None. In some earlier code, l.get(k) could also be 0 in that case.
-          if l.get(k) in [0, None]:
+          if key_infos[k][i] is None:
             continue
-          data = dataset.get_data_slice(seq.seq_idx, k, seq.seq_start_frame[k], seq.seq_end_frame[k])
+          start, l, o = key_infos[k][i]
+          data = dataset.get_data_slice(seq_idx, k, start, start + l)
           ls = data.shape[0]
           if "[sparse:" in k:
-            assert o[k] == 0, "sparse non-recurrent batching + chunking not implemented"
+            assert o == 0, "sparse non-recurrent batching + chunking not implemented"
             _device_maybe_enlarge_data(device, k, ls)
           else:
-            if ls != l[k]:
+            if ls != l:
+              seq = batch.seqs[i]
               raise Exception("got shape[0]: %i, expected: %i, start/end: %r/%r, seq_idx: %i, seq len: %r" % (
-                ls, l[k], seq.seq_start_frame, seq.seq_end_frame, seq.seq_idx, dataset.get_seq_length(seq.seq_idx)))
-          device.output_index[k][o[k]:o[k] + ls, q] = numpy.ones((ls,), dtype='int8')
-          device.targets[k][o[k]:o[k] + ls, q] = data
+                ls, l, seq.seq_start_frame, seq.seq_end_frame, seq_idx, dataset.get_seq_length(seq_idx)))
+          device.output_index[k][o:o + ls, q] = 1
+          device.targets[k][o:o + ls, q] = data
         # Only copy ctc targets if chunking is inactive to avoid out of range access.
         # CTC is not compatible with chunking anyway.
         chunking_active = dataset.chunk_size > 0
         if dataset.has_ctc_targets() and not chunking_active:
-          device.ctc_targets[q] = dataset.get_ctc_targets(seq.seq_idx)
+          device.ctc_targets[q] = dataset.get_ctc_targets(seq_idx)
 
-        device.tags[q] = dataset.get_tag(seq.seq_idx)
+        device.tags[q] = dataset.get_tag(seq_idx)
     # Note on multiple batches for the non-recurrent case:
     # We could either concatenate all into a single slice, or do multiple slices.
     # We do multiple slices here.
@@ -3,10 +3,12 @@ from __future__ import print_function
 
 from Dataset import Dataset, DatasetSeq, convert_data_dims
 from CachedDataset2 import CachedDataset2
-from Util import class_idx_seq_to_1_of_k, CollectionReadCheckCovered
+from Util import class_idx_seq_to_1_of_k, CollectionReadCheckCovered, PY3
 from Log import log
 import numpy
+import os
 import re
+import io
 
 
 class GeneratingDataset(Dataset):
@@ -665,12 +667,15 @@ class ExtractAudioFeatures:
   Currently uses librosa to extract MFCC features.
   (Alternatives: python_speech_features, talkbox.features.mfcc, librosa)
   We could also add support e.g. to directly extract log-filterbanks or so.
+  With backend="numpy", we use our own implementation (of the same features as librosa would compute),
+  which precomputes the window and the mel filterbank once, and which can process multiple utterances at once.
   """
 
   def __init__(self,
                window_len=0.025, step_len=0.010,
                num_feature_filters=40, with_delta=False, norm_mean=None, norm_std_dev=None,
-               features="mfcc", random_permute=None, random_state=None):
+               features="mfcc", random_permute=None, random_state=None, feature_cache_dir=None,
+               backend="librosa"):
     """
     :param float window_len: in seconds
     :param float step_len: in seconds
@@ -681,6 +686,10 @@ class ExtractAudioFeatures:
     :param str features: "mfcc", "log_mel_filterbank", "log_log_mel_filterbank"
     :param CollectionReadCheckCovered|dict[str]|bool|None random_permute:
     :param numpy.random.RandomState|None random_state:
+    :param str|None feature_cache_dir: if given, the features (before normalization) are stored in this dir,
+      one NumPy file per seq, and reused. See :func:`get_audio_features_cached`.
+    :param str backend: "librosa" or "numpy". see :func:`_get_audio_features_numpy`.
+      random_permute always needs librosa.
     :return: (audio_len // int(step_len * sample_rate), (with_delta + 1) * num_feature_filters), float32
     :rtype: numpy.ndarray
     """
@@ -702,6 +711,10 @@ class ExtractAudioFeatures:
     self.random_permute_opts = random_permute
     self.random_state = random_state
     self.features = features
+    self.feature_cache_dir = feature_cache_dir
+    assert backend in ("librosa", "numpy")
+    self.backend = backend
+    self._numpy_consts = {}  # sample_rate -> consts. see _get_numpy_consts
 
   def _load_feature_vec(self, value):
     """
@@ -723,22 +736,135 @@ class ExtractAudioFeatures:
     :param int sample_rate: e.g. 22050
     :rtype: numpy.ndarray
     """
-    kwargs = {
-      "sample_rate": sample_rate,
-      "window_len": self.window_len,
-      "step_len": self.step_len,
-      "num_feature_filters": self.num_feature_filters,
-    }
+    feature_data = self._get_audio_features_unnormalized(audio=audio, sample_rate=sample_rate)
+    return self._normalize_features(feature_data)
+
+  def _is_random_permute_enabled(self):
+    """
+    :rtype: bool
+    """
+    return bool(self.random_permute_opts and self.random_permute_opts.truth_value)
+
+  def _get_feature_cache_filename(self, seq_tag, namespace):
+    """
+    :param str seq_tag:
+    :param str namespace: e.g. the corpus name
+    :return: filename in self.feature_cache_dir. all the feature options are encoded in the dir name
+    :rtype: str
+    """
+    import hashlib
+    opts = (
+      namespace, self.features, self.window_len, self.step_len, self.num_feature_filters, self.with_delta,
+      self.backend)
+    opts_hash = hashlib.md5(repr(opts).encode("utf8")).hexdigest()[:16]
+    tag_hash = hashlib.md5(seq_tag.encode("utf8")).hexdigest()
+    return "%s/%s-%s/%s/%s.npy" % (
+      self.feature_cache_dir, self.features, opts_hash, tag_hash[:2], seq_tag.replace("/", "_"))
+
+  def get_audio_features_cached(self, seq_tag, load_audio, namespace=""):
+    """
+    Like :func:`get_audio_features`, but uses the feature cache (self.feature_cache_dir), if enabled.
+    The cache is filled on the first access of some seq, and reused afterwards,
+    i.e. the audio is not loaded again.
+    The normalization (norm_mean, norm_std_dev) is applied on top, i.e. it is not part of the cache.
+    If random_permute is enabled, the features depend on the randomly permuted audio,
+    thus in that case, we do not use the cache, and the features are computed as usual.
+
+    :param str seq_tag: unique in the namespace
+    :param (()->(numpy.ndarray,int)) load_audio: returns the raw audio samples and the sample rate
+    :param str namespace: e.g. the corpus name, and anything else which determines the audio
+    :return: features, like :func:`get_audio_features`
+    :rtype: numpy.ndarray
+    """
+    import os
+    if not self.feature_cache_dir or self._is_random_permute_enabled():
+      audio, sample_rate = load_audio()
+      return self.get_audio_features(audio=audio, sample_rate=sample_rate)
+    filename = self._get_feature_cache_filename(seq_tag=seq_tag, namespace=namespace)
+    feature_data = None
+    if os.path.exists(filename):
+      try:
+        feature_data = numpy.load(filename)
+      except (IOError, OSError, ValueError) as exc:
+        print("ExtractAudioFeatures: cannot read feature cache file %s: %s" % (filename, exc), file=log.v3)
+      else:
+        assert feature_data.shape[1:] == (self.get_feature_dimension(),)
+    if feature_data is None:
+      audio, sample_rate = load_audio()
+      feature_data = self._get_audio_features_unnormalized(audio=audio, sample_rate=sample_rate)
+      try:
+        if not os.path.exists(os.path.dirname(filename)):
+          os.makedirs(os.path.dirname(filename))
+        # Write to a tmp file first, such that other processes never see a partially written file.
+        tmp_filename = "%s.tmp.%i" % (filename, os.getpid())
+        with open(tmp_filename, "wb") as f:
+          numpy.save(f, feature_data)
+        os.rename(tmp_filename, filename)
+      except (IOError, OSError) as exc:
+        print("ExtractAudioFeatures: cannot write feature cache file %s: %s" % (filename, exc), file=log.v3)
+    return self._normalize_features(feature_data)
+
+  def get_audio_features_batch(self, audios, sample_rate):
+    """
+    Like :func:`get_audio_features`, but for multiple utterances at once.
+    With backend="numpy", the STFT and the mel filterbank are computed over all frames of all utterances at once.
+
+    :param list[numpy.ndarray] audios: raw audio samples, each shape (audio_len,)
+    :param int sample_rate: e.g. 22050
+    :return: features for each utterance
+    :rtype: list[numpy.ndarray]
+    """
+    audios = [self._prepare_audio(audio=audio, sample_rate=sample_rate) for audio in audios]
+    if self.backend == "numpy":
+      return self._get_audio_features_numpy(audios=audios, sample_rate=sample_rate, normalize=True)
+    return [
+      self._normalize_features(self._get_audio_features_librosa(audio=audio, sample_rate=sample_rate))
+      for audio in audios]
+
+  def _prepare_audio(self, audio, sample_rate):
+    """
+    :param numpy.ndarray audio: raw audio samples, shape (audio_len,). will be modified inplace
+    :param int sample_rate: e.g. 22050
+    :return: audio normalized to peak 1, and randomly permuted, if enabled
+    :rtype: numpy.ndarray
+    """
     peak = numpy.max(numpy.abs(audio))
     audio /= peak
 
-    if self.random_permute_opts and self.random_permute_opts.truth_value:
+    if self._is_random_permute_enabled():
       audio = _get_random_permuted_audio(
         audio=audio,
         sample_rate=sample_rate,
         opts=self.random_permute_opts,
         random_state=self.random_state)
-    kwargs["audio"] = audio
+    return audio
+
+  def _get_audio_features_unnormalized(self, audio, sample_rate):
+    """
+    :param numpy.ndarray audio: raw audio samples, shape (audio_len,)
+    :param int sample_rate: e.g. 22050
+    :return: features incl. deltas, without normalization
+    :rtype: numpy.ndarray
+    """
+    audio = self._prepare_audio(audio=audio, sample_rate=sample_rate)
+    if self.backend == "numpy":
+      return self._get_audio_features_numpy(audios=[audio], sample_rate=sample_rate, normalize=False)[0]
+    return self._get_audio_features_librosa(audio=audio, sample_rate=sample_rate)
+
+  def _get_audio_features_librosa(self, audio, sample_rate):
+    """
+    :param numpy.ndarray audio: prepared audio samples, shape (audio_len,)
+    :param int sample_rate: e.g. 22050
+    :return: features incl. deltas, without normalization
+    :rtype: numpy.ndarray
+    """
+    kwargs = {
+      "audio": audio,
+      "sample_rate": sample_rate,
+      "window_len": self.window_len,
+      "step_len": self.step_len,
+      "num_feature_filters": self.num_feature_filters,
+    }
 
     if self.features == "mfcc":
       feature_data = _get_audio_features_mfcc(**kwargs)
@@ -757,7 +883,99 @@ class ExtractAudioFeatures:
                 for i in range(1, self.with_delta + 1)]
       feature_data = numpy.concatenate([feature_data] + deltas, axis=1)
       assert feature_data.shape[1] == self.get_feature_dimension()
+    return feature_data
 
+  def _get_numpy_consts(self, sample_rate):
+    """
+    :param int sample_rate:
+    :return: FFT len, hop len, window (n_fft,), mel filterbank (n_fft // 2 + 1, num_mels),
+      DCT matrix (num_mels, num_feature_filters) for MFCC or None. computed only once per sample rate
+    :rtype: (int, int, numpy.ndarray, numpy.ndarray, numpy.ndarray|None)
+    """
+    if sample_rate not in self._numpy_consts:
+      n_fft = int(self.window_len * sample_rate)
+      hop_len = int(self.step_len * sample_rate)
+      window = 0.5 - 0.5 * numpy.cos(2. * numpy.pi * numpy.arange(n_fft) / n_fft)  # periodic Hann, like librosa
+      dct_matrix = None
+      if self.features == "mfcc":
+        num_mels = 128  # default of librosa.feature.mfcc
+        dct_matrix = _get_dct_matrix(num_input=num_mels, num_output=self.num_feature_filters).transpose()
+      else:
+        num_mels = self.num_feature_filters
+      mel_matrix = _get_mel_filterbank_matrix(sample_rate=sample_rate, n_fft=n_fft, num_mels=num_mels).transpose()
+      self._numpy_consts[sample_rate] = (n_fft, hop_len, window, mel_matrix, dct_matrix)
+    return self._numpy_consts[sample_rate]
+
+  def _get_audio_features_numpy(self, audios, sample_rate, normalize):
+    """
+    Computes the same features as the librosa backend, but only with NumPy (and SciPy for the deltas).
+    The frames of all utterances are created via stride tricks, and then concatenated,
+    such that the FFT, the mel filterbank and the DCT are each a single op over all utterances.
+    The deltas and the normalization are written directly into the final output array.
+
+    :param list[numpy.ndarray] audios: prepared audio samples, each shape (audio_len,)
+    :param int sample_rate: e.g. 22050
+    :param bool normalize: whether to apply norm_mean and norm_std_dev
+    :return: features for each utterance, each (time, self.get_feature_dimension()), float32
+    :rtype: list[numpy.ndarray]
+    """
+    from numpy.lib.stride_tricks import as_strided
+    n_fft, hop_len, window, mel_matrix, dct_matrix = self._get_numpy_consts(sample_rate)
+    frames = []
+    for audio in audios:
+      audio = numpy.pad(numpy.asarray(audio, dtype="float64"), n_fft // 2, mode="reflect")  # centered frames
+      num_frames = 1 + (audio.shape[0] - n_fft) // hop_len
+      frames.append(as_strided(
+        audio, shape=(num_frames, n_fft), strides=(audio.strides[0] * hop_len, audio.strides[0]), writeable=False))
+    lens = numpy.array([f.shape[0] for f in frames], dtype="int64")
+    ends = numpy.cumsum(lens)
+    starts = ends - lens
+    frames = numpy.concatenate(frames, axis=0)  # (total time, n_fft)
+    power_spec = numpy.abs(numpy.fft.rfft(frames * window[None, :], axis=1)) ** 2
+    mel = numpy.dot(power_spec, mel_matrix)  # (total time, num_mels)
+
+    def db_with_top_db(x, top_db=80.):
+      """
+      Like librosa.power_to_db, where the top_db threshold is relative to the max of every utterance.
+      """
+      x = 10. * numpy.log10(numpy.maximum(1e-10, x))
+      max_per_utt = numpy.maximum.reduceat(numpy.max(x, axis=1), starts)
+      return numpy.maximum(x, numpy.repeat(max_per_utt - top_db, lens)[:, None])
+
+    if self.features == "mfcc":
+      feature_data = numpy.dot(db_with_top_db(mel), dct_matrix)
+      # Replace first MFCC with energy, per convention. Like librosa.feature.rmse, on the same frames.
+      feature_data[:, 0] = numpy.sqrt(numpy.mean(frames ** 2, axis=1))
+    elif self.features == "log_mel_filterbank":
+      feature_data = numpy.log(numpy.maximum(1e-3, mel))
+    elif self.features == "log_log_mel_filterbank":
+      feature_data = db_with_top_db(numpy.log(numpy.maximum(1e-3, mel)) ** 2)  # librosa.amplitude_to_db
+    else:
+      assert False, "non-supported feature type %s" % self.features
+    assert feature_data.shape == (frames.shape[0], self.num_feature_filters)
+
+    dim = self.num_feature_filters
+    res = []
+    for start, end in zip(starts, ends):
+      out = numpy.empty((end - start, self.get_feature_dimension()), dtype="float32")
+      out[:, :dim] = feature_data[start:end]
+      if self.with_delta:
+        import scipy.signal
+        for i in range(1, self.with_delta + 1):
+          # Like librosa.feature.delta. The "interp" mode needs at least width frames.
+          out[:, i * dim:(i + 1) * dim] = scipy.signal.savgol_filter(
+            out[:, :dim], window_length=9, polyorder=i, deriv=i, axis=0,
+            mode="interp" if end - start >= 9 else "nearest")
+      if normalize:
+        self._normalize_features(out)
+      res.append(out)
+    return res
+
+  def _normalize_features(self, feature_data):
+    """
+    :param numpy.ndarray feature_data: (time, dim). might be modified inplace
+    :rtype: numpy.ndarray
+    """
     if self.norm_mean is not None:
       feature_data -= self.norm_mean[None, :]
     if self.norm_std_dev is not None:
@@ -768,6 +986,75 @@ class ExtractAudioFeatures:
     return (self.with_delta + 1) * self.num_feature_filters
 
 
+def _hz_to_mel(frequencies):
+  """
+  Slaney-style mel scale, like librosa.hz_to_mel(htk=False).
+
+  :param numpy.ndarray frequencies: in Hz
+  :rtype: numpy.ndarray
+  """
+  frequencies = numpy.asarray(frequencies, dtype="float64")
+  f_sp = 200.0 / 3  # linear part
+  min_log_hz = 1000.0
+  min_log_mel = min_log_hz / f_sp
+  log_step = numpy.log(6.4) / 27.0
+  return numpy.where(
+    frequencies >= min_log_hz,
+    min_log_mel + numpy.log(numpy.maximum(frequencies, min_log_hz) / min_log_hz) / log_step,
+    frequencies / f_sp)
+
+
+def _mel_to_hz(mels):
+  """
+  Inverse of :func:`_hz_to_mel`.
+
+  :param numpy.ndarray mels:
+  :rtype: numpy.ndarray
+  """
+  mels = numpy.asarray(mels, dtype="float64")
+  f_sp = 200.0 / 3
+  min_log_hz = 1000.0
+  min_log_mel = min_log_hz / f_sp
+  log_step = numpy.log(6.4) / 27.0
+  return numpy.where(mels >= min_log_mel, min_log_hz * numpy.exp(log_step * (mels - min_log_mel)), f_sp * mels)
+
+
+def _get_mel_filterbank_matrix(sample_rate, n_fft, num_mels):
+  """
+  Like librosa.filters.mel (with defaults fmin=0, fmax=sample_rate/2, htk=False, area normalization).
+
+  :param int sample_rate:
+  :param int n_fft:
+  :param int num_mels:
+  :return: (num_mels, n_fft // 2 + 1)
+  :rtype: numpy.ndarray
+  """
+  fft_freqs = numpy.linspace(0, sample_rate / 2.0, n_fft // 2 + 1)
+  mel_freqs = _mel_to_hz(numpy.linspace(_hz_to_mel(0.0), _hz_to_mel(sample_rate / 2.0), num_mels + 2))
+  freq_diffs = numpy.diff(mel_freqs)
+  ramps = mel_freqs[:, None] - fft_freqs[None, :]
+  lower = -ramps[:-2] / freq_diffs[:-1, None]
+  upper = ramps[2:] / freq_diffs[1:, None]
+  weights = numpy.maximum(0, numpy.minimum(lower, upper))
+  weights *= (2.0 / (mel_freqs[2:] - mel_freqs[:-2]))[:, None]
+  return weights
+
+
+def _get_dct_matrix(num_input, num_output):
+  """
+  Orthonormal DCT-II, like librosa.filters.dct / scipy.fftpack.dct(type=2, norm="ortho").
+
+  :param int num_input:
+  :param int num_output:
+  :return: (num_output, num_input)
+  :rtype: numpy.ndarray
+  """
+  samples = numpy.arange(1, 2 * num_input, 2) * numpy.pi / (2.0 * num_input)
+  basis = numpy.cos(numpy.arange(num_output)[:, None] * samples[None, :]) * numpy.sqrt(2.0 / num_input)
+  basis[0, :] = 1.0 / numpy.sqrt(num_input)
+  return basis
+
+
 def _get_audio_features_mfcc(audio, sample_rate, window_len=0.025, step_len=0.010, num_feature_filters=40):
   """
   :param numpy.ndarray audio: raw audio samples, shape (audio_len,)
@@ -1193,7 +1480,8 @@ class TimitDataset(CachedDataset2):
     super(TimitDataset, self).init_seq_order(epoch=epoch, seq_list=seq_list)
     self._num_seqs = len(self._seq_tags)
     self._seq_order = self.get_seq_order_for_epoch(
-      epoch=epoch, num_seqs=self._num_seqs, get_seq_len=lambda i: len(self._seq_tags[i][1]))
+      epoch=epoch, num_seqs=self._num_seqs, get_seq_len=lambda i: len(self._seq_tags[i][1]),
+      seq_lens_cache_key="data")
     self._random.seed(self._fixed_random_seed or epoch or 1)
     return True
 
@@ -1428,14 +1716,21 @@ class BytePairEncoding(Vocabulary):
   Reference:
   Rico Sennrich, Barry Haddow and Alexandra Birch (2016). Neural Machine Translation of Rare Words with Subword Units.
   Proceedings of the 54th Annual Meeting of the Association for Computational Linguistics (ACL 2016). Berlin, Germany.
+
+  The merge operations are applied via a priority queue (see :func:`_merge_word`),
+  and the encoded words are kept in a LRU cache, which is shared by all instances with the same files
+  (and thus also by forked dataset workers).
   """
 
-  def __init__(self, vocab_file, bpe_file, seq_postfix=None, unknown_label="UNK"):
+  _encode_caches = {}  # (bpe_file, vocab_file) -> OrderedDict word -> encoded word, in LRU order
+
+  def __init__(self, vocab_file, bpe_file, seq_postfix=None, unknown_label="UNK", encode_cache_size=100000):
     """
     :param str vocab_file:
     :param str bpe_file:
     :param list[int]|None seq_postfix: labels will be added to the seq in self.get_seq
     :param str unknown_label:
+    :param int encode_cache_size: max num of words in the (shared) LRU cache of encoded words
     """
     super(BytePairEncoding, self).__init__(vocab_file=vocab_file, unknown_label=unknown_label)
     # check version information
@@ -1449,7 +1744,10 @@ class BytePairEncoding(Vocabulary):
     # some hacking to deal with duplicates (only consider first instance)
     self._bpe_codes = dict([(code, i) for (i, code) in reversed(list(enumerate(self._bpe_codes)))])
     self._bpe_codes_reverse = dict([(pair[0] + pair[1], pair) for pair,i in self._bpe_codes.items()])
-    self._bpe_encode_cache = {}
+    from collections import OrderedDict
+    self._bpe_encode_cache = self._encode_caches.setdefault((bpe_file, vocab_file), OrderedDict())
+    self._bpe_encode_cache_size = encode_cache_size
+    self._labels_set = set(self.labels)
     self._bpe_separator = '@@'
     self.seq_postfix = seq_postfix or []
 
@@ -1467,15 +1765,66 @@ class BytePairEncoding(Vocabulary):
       prev_char = char
     return pairs
 
+  def _merge_word(self, word):
+    """
+    Applies the BPE merge operations. Like in subword-nmt, in every step, all (non-overlapping, from left to right)
+    occurrences of the pair with the lowest merge idx are merged.
+    Instead of searching for that pair over and over again, we keep all pairs in a priority queue,
+    and the symbols in a linked list.
+
+    :param tuple[str] word: represented as tuple of symbols (symbols being variable-length strings)
+    :return: merged symbols
+    :rtype: tuple[str]
+    """
+    import heapq
+    codes = self._bpe_codes
+    symbols = list(word)  # type: list[str|None]  # None if merged into the previous symbol
+    num_symbols = len(symbols)
+    next_idx = list(range(1, num_symbols + 1))  # num_symbols means end
+    prev_idx = list(range(-1, num_symbols - 1))  # -1 means begin
+    # Entries are (merge idx, pos of first symbol, first symbol, second symbol).
+    # Entries are outdated if the symbols at that pos do not match anymore. We just skip them.
+    queue = [
+      (codes[pair], i, pair[0], pair[1])
+      for (i, pair) in enumerate(zip(symbols[:-1], symbols[1:])) if pair in codes]
+    heapq.heapify(queue)
+    while queue:
+      merge_idx = queue[0][0]
+      merged = []
+      while queue and queue[0][0] == merge_idx:  # all occurrences of this pair, from left to right
+        _, i, first, second = heapq.heappop(queue)
+        j = next_idx[i]
+        if symbols[i] != first or j >= num_symbols or symbols[j] != second:
+          continue  # outdated
+        symbols[i] = first + second
+        symbols[j] = None
+        next_idx[i] = next_idx[j]
+        if next_idx[j] < num_symbols:
+          prev_idx[next_idx[j]] = i
+        merged.append(i)
+      # Only now add the new pairs, as we must first finish all occurrences of the current pair.
+      for i in merged:
+        if symbols[i] is None:
+          continue
+        for a, b in [(prev_idx[i], i), (i, next_idx[i])]:
+          if a < 0 or b >= num_symbols:
+            continue
+          pair = (symbols[a], symbols[b])
+          if pair in codes:
+            heapq.heappush(queue, (codes[pair], a, pair[0], pair[1]))
+    return tuple([symbol for symbol in symbols if symbol is not None])
+
   def _encode_word(self, orig):
     """
     Encode word based on list of BPE merge operations, which are applied consecutively.
     :param str orig:
     :rtype: tuple[str]
     """
-
-    if orig in self._bpe_encode_cache:
-      return self._bpe_encode_cache[orig]
+    cache = self._bpe_encode_cache
+    word = cache.pop(orig, None)
+    if word is not None:
+      cache[orig] = word  # (re)insert as most recently used
+      return word
 
     if self._bpe_file_version == (0, 1):
       word = tuple(orig) + ('</w>',)
@@ -1484,38 +1833,10 @@ class BytePairEncoding(Vocabulary):
     else:
       raise NotImplementedError
 
-    pairs = self._get_pairs(word)
-    if not pairs:
+    if len(word) < 2:
       return orig
 
-    while True:
-      bigram = min(pairs, key=lambda pair: self._bpe_codes.get(pair, float('inf')))
-      if bigram not in self._bpe_codes:
-        break
-      first, second = bigram
-      new_word = []
-      i = 0
-      while i < len(word):
-        try:
-          j = word.index(first, i)
-          new_word.extend(word[i:j])
-          i = j
-        except ValueError:
-          new_word.extend(word[i:])
-          break
-
-        if word[i] == first and i < len(word) - 1 and word[i + 1] == second:
-          new_word.append(first + second)
-          i += 2
-        else:
-          new_word.append(word[i])
-          i += 1
-      new_word = tuple(new_word)
-      word = new_word
-      if len(word) == 1:
-        break
-      else:
-        pairs = self._get_pairs(word)
+    word = self._merge_word(word)
 
     # don't print end-of-word symbols
     if word[-1] == '</w>':
@@ -1524,9 +1845,14 @@ class BytePairEncoding(Vocabulary):
       word = word[:-1] + (word[-1].replace('</w>', ''),)
 
     if self.labels:
-      word = self.check_vocab_and_split(word, self._bpe_codes_reverse, self.labels, self._bpe_separator)
+      word = self.check_vocab_and_split(word, self._bpe_codes_reverse, self._labels_set, self._bpe_separator)
 
-    self._bpe_encode_cache[orig] = word
+    cache[orig] = word
+    while len(cache) > self._bpe_encode_cache_size:
+      try:
+        cache.popitem(last=False)
+      except KeyError:  # some other thread cleaned up in the meantime
+        break
     return word
 
   def check_vocab_and_split(self, orig, bpe_codes, vocab, separator):
@@ -1580,11 +1906,12 @@ class BytePairEncoding(Vocabulary):
       for item in self.recursive_split(right, bpe_codes, vocab, separator, final):
         yield item
 
-  def _segment_sentence(self, sentence):
+  @staticmethod
+  def _split_sentence(sentence):
     """
-    Segment single sentence (whitespace-tokenized string) with BPE encoding.
-    :param str sentence:
-    :rtype: list[str]
+    :param str sentence: whitespace-tokenized string
+    :return: list of (word, whether to BPE-encode it). categories ("$cat {...}") are not encoded
+    :rtype: list[(str,bool)]
     """
 
     output = []
@@ -1595,21 +1922,40 @@ class BytePairEncoding(Vocabulary):
     for word in sentence.split():
       if word[0] == '$' and len(word) > 1:
         found_category = True
-        output.append(word)
+        output.append((word, False))
       elif found_category is True and word[0] == '{':
         skip_category = True
-        output.append(word)
+        output.append((word, False))
       elif skip_category is True and word[0] != '}':
-        output.append(word)
+        output.append((word, False))
       else:
         found_category = False
         skip_category = False
-        new_word = self._encode_word(word)
+        output.append((word, True))
 
-        for item in new_word[:-1]:
-          output.append(item + self._bpe_separator)
-        output.append(new_word[-1])
+    return output
 
+  def _segment_word(self, word):
+    """
+    :param str word:
+    :return: BPE segments, all except the last with separator
+    :rtype: list[str]
+    """
+    new_word = self._encode_word(word)
+    return [item + self._bpe_separator for item in new_word[:-1]] + [new_word[-1]]
+
+  def _segment_sentence(self, sentence):
+    """
+    Segment single sentence (whitespace-tokenized string) with BPE encoding.
+    :param str sentence:
+    :rtype: list[str]
+    """
+    output = []
+    for word, encode in self._split_sentence(sentence):
+      if encode:
+        output.extend(self._segment_word(word))
+      else:
+        output.append(word)
     return output
 
   def get_seq(self, sentence):
@@ -1621,6 +1967,28 @@ class BytePairEncoding(Vocabulary):
     seq = self.get_seq_indices(segments)
     return seq + self.seq_postfix
 
+  def get_seqs(self, sentences):
+    """
+    Like :func:`get_seq`, but for many sentences at once.
+    Every distinct word is only encoded and looked up in the vocab once.
+
+    :param list[str] sentences:
+    :rtype: list[list[int]]
+    """
+    word_seqs = {}  # word -> label idxs
+    seqs = []
+    for sentence in sentences:
+      seq = []
+      for word, encode in self._split_sentence(sentence):
+        word_seq = word_seqs.get(word) if encode else None
+        if word_seq is None:
+          word_seq = self.get_seq_indices(self._segment_word(word) if encode else [word])
+          if encode:
+            word_seqs[word] = word_seq
+        seq.extend(word_seq)
+      seqs.append(seq + self.seq_postfix)
+    return seqs
+
 
 class CharacterTargets(Vocabulary):
   """
@@ -1756,6 +2124,46 @@ class BlissDataset(CachedDataset2):
     raise NotImplementedError  # TODO...
 
 
+class _ZipFilePool(object):
+  """
+  The ZipFiles of one thread (in one process) for :class:`LibriSpeechCorpus`.
+  Everything gets closed when this is deleted, e.g. when the thread ends.
+  """
+
+  def __init__(self):
+    self.pid = os.getpid()
+    self.files = {}  # type: dict[str,(zipfile.ZipFile,mmap.mmap,file)]  # subdir -> (ZipFile, mmap, file)
+
+  def get(self, subdir, filename):
+    """
+    :param str subdir:
+    :param str filename: zip file
+    :return: ZipFile, mmap of the whole file
+    :rtype: (zipfile.ZipFile, mmap.mmap)
+    """
+    import mmap
+    import zipfile
+    if subdir not in self.files:
+      f = open(filename, "rb")
+      zip_mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+      self.files[subdir] = (zipfile.ZipFile(f), zip_mmap, f)
+    zip_file, zip_mmap, _ = self.files[subdir]
+    return zip_file, zip_mmap
+
+  def close(self):
+    for zip_file, zip_mmap, f in self.files.values():
+      zip_file.close()
+      try:
+        zip_mmap.close()
+      except BufferError:
+        pass  # some member is still in use. it will be closed once it is not referenced anymore
+      f.close()
+    self.files.clear()
+
+  def __del__(self):
+    self.close()
+
+
 class LibriSpeechCorpus(CachedDataset2):
   """
   LibriSpeech. http://www.openslr.org/12/
@@ -1805,12 +2213,17 @@ class LibriSpeechCorpus(CachedDataset2):
     import os
     from glob import glob
     import zipfile
+    import threading
+    import weakref
     import Util
     self.path = path
     self.prefix = prefix
     self.use_zip = use_zip
     self.use_ogg = use_ogg
     self._zip_files = None
+    # Per thread _ZipFilePool, see _get_zip_file. Also all of them (weak refs), for close().
+    self._zip_file_pool = threading.local()
+    self._zip_file_pools = weakref.WeakSet()  # type: weakref.WeakSet[_ZipFilePool]
     if use_zip:
       zip_fn_pattern = "%s/%s*.zip" % (self.path, self.prefix)
       zip_fns = sorted(glob(zip_fn_pattern))
@@ -1819,7 +2232,7 @@ class LibriSpeechCorpus(CachedDataset2):
         zip_fns = [Util.cf(fn) for fn in zip_fns]
       self._zip_files = {
         os.path.splitext(os.path.basename(fn))[0]: zipfile.ZipFile(fn)
-        for fn in zip_fns}  # e.g. "train-clean-100" -> ZipFile
+        for fn in zip_fns}  # e.g. "train-clean-100" -> ZipFile. only used by the main thread
     assert prefix.split("-")[0] in ["train", "dev", "test"]
     assert os.path.exists(path + "/train-clean-100" + (".zip" if use_zip else ""))
     self.orth_post_process = None
@@ -1930,7 +2343,8 @@ class LibriSpeechCorpus(CachedDataset2):
     else:
       num_seqs = len(self._reference_seq_order)
       self._seq_order = self.get_seq_order_for_epoch(
-        epoch=real_epoch, num_seqs=num_seqs, get_seq_len=lambda i: len(self.transs[self._reference_seq_order[i]]))
+        epoch=real_epoch, num_seqs=num_seqs, get_seq_len=lambda i: len(self.transs[self._reference_seq_order[i]]),
+        seq_lens_cache_key="classes")
       self._num_seqs = num_seqs
     if self.partition_epoch:
       partition_epoch_num_seqs = [self._num_seqs // self.partition_epoch] * self.partition_epoch
@@ -1991,6 +2405,28 @@ class LibriSpeechCorpus(CachedDataset2):
   def get_corpus_seq_idx(self, seq_idx):
     return self._get_ref_seq_idx(seq_idx)
 
+  def supports_seq_list(self):
+    return True
+
+  def get_all_tags(self):
+    """
+    :rtype: list[str]
+    """
+    return [self._get_tag(ref_seq_idx) for ref_seq_idx in self._seq_order]
+
+  def _get_seq_lens_cache_input_files(self):
+    """
+    :return: also the zip files, or otherwise the transcription files, which are in self.path
+    :rtype: list[str]
+    """
+    from glob import glob
+    files = super(LibriSpeechCorpus, self)._get_seq_lens_cache_input_files()
+    if self.use_zip:
+      files += sorted([zip_file.filename for zip_file in self._zip_files.values()])
+    else:
+      files += sorted(glob("%s/%s*/*/*/*.trans.txt" % (self.path, self.prefix)))
+    return files
+
   def _get_tag(self, ref_seq_idx):
     """
     :param int ref_seq_idx:
@@ -2017,6 +2453,39 @@ class LibriSpeechCorpus(CachedDataset2):
     targets_txt = self.transs[seq_key]
     return self.targets.get_seq(targets_txt), targets_txt
 
+  def _get_zip_file(self, subdir):
+    """
+    ZipFile objects are not safe to be used from multiple threads (or forked processes) at the same time,
+    thus every worker gets its own ZipFile, and also its own mmap of the file (for :func:`open_zip_member`).
+    They are closed when the thread ends, or via :func:`close`.
+
+    :param str subdir: e.g. "train-clean-100"
+    :return: ZipFile, mmap of the whole file
+    :rtype: (zipfile.ZipFile, mmap.mmap)
+    """
+    pool = getattr(self._zip_file_pool, "pool", None)  # type: _ZipFilePool|None
+    if pool is None or pool.pid != os.getpid():  # the pool might have been inherited via fork
+      pool = _ZipFilePool()
+      self._zip_file_pool.pool = pool
+      self._zip_file_pools.add(pool)
+    return pool.get(subdir=subdir, filename=self._zip_files[subdir].filename)
+
+  def close(self):
+    """
+    Closes all the zip files. If the dataset is used again, they are reopened on demand.
+    """
+    for pool in list(self._zip_file_pools):
+      if pool.pid == os.getpid():
+        pool.close()
+    if self._zip_files:
+      for zip_file in self._zip_files.values():
+        zip_file.close()  # only used for the listing in __init__, we still can use its filename
+
+  def __del__(self):
+    if getattr(self, "_zip_file_pools", None) is not None:
+      self.close()
+    super(LibriSpeechCorpus, self).__del__()
+
   def _open_audio_file(self, seq_idx):
     """
     :param int seq_idx:
@@ -2032,10 +2501,9 @@ class LibriSpeechCorpus(CachedDataset2):
       audio_fn += ".ogg"
     if self.use_zip:
       audio_fn = "LibriSpeech/%s" % (audio_fn,)
-      zip_file = self._zip_files[subdir]
+      zip_file, zip_mmap = self._get_zip_file(subdir)
       assert isinstance(zip_file, zipfile.ZipFile)
-      raw_bytes = zip_file.read(audio_fn)
-      return io.BytesIO(raw_bytes)
+      return open_zip_member(zip_file, audio_fn, zip_mmap=zip_mmap)
     else:
       audio_fn = "%s/%s" % (self.path, audio_fn)
       assert os.path.exists(audio_fn)
@@ -2054,9 +2522,18 @@ class LibriSpeechCorpus(CachedDataset2):
     # https://github.com/beetbox/audioread/issues/64
     # https://github.com/librosa/librosa/issues/681
     import soundfile  # pip install pysoundfile
-    with self._open_audio_file(seq_idx) as audio_file:
-      audio, sample_rate = soundfile.read(audio_file)
-    features = self.feature_extractor.get_audio_features(audio=audio, sample_rate=sample_rate)
+
+    def load_audio():
+      """
+      :return: audio, sample_rate
+      :rtype: (numpy.ndarray, int)
+      """
+      with self._open_audio_file(seq_idx) as audio_file:
+        return soundfile.read(audio_file)
+
+    features = self.feature_extractor.get_audio_features_cached(
+      seq_tag=self.get_tag(seq_idx), load_audio=load_audio,
+      namespace="LibriSpeech" + (".ogg" if self.use_ogg else ""))
     bpe, txt = self._get_transcription(seq_idx)
     targets = numpy.array(bpe, dtype="int32")
     raw = numpy.array(txt, dtype="object")
@@ -2067,6 +2544,77 @@ class LibriSpeechCorpus(CachedDataset2):
       seq_tag=self.get_tag(seq_idx))
 
 
+class _MemoryViewFile(io.RawIOBase):
+  """
+  Read-only file object on a memoryview, without copying the data.
+  """
+
+  def __init__(self, view):
+    """
+    :param memoryview view:
+    """
+    super(_MemoryViewFile, self).__init__()
+    self._view = view
+    self._pos = 0
+
+  def readable(self):
+    return True
+
+  def seekable(self):
+    return True
+
+  def readinto(self, b):
+    """
+    :param bytearray|memoryview b:
+    :return: num bytes read
+    :rtype: int
+    """
+    n = max(min(len(b), len(self._view) - self._pos), 0)
+    b[:n] = self._view[self._pos:self._pos + n]
+    self._pos += n
+    return n
+
+  def seek(self, offset, whence=io.SEEK_SET):
+    if whence == io.SEEK_SET:
+      self._pos = offset
+    elif whence == io.SEEK_CUR:
+      self._pos += offset
+    elif whence == io.SEEK_END:
+      self._pos = len(self._view) + offset
+    else:
+      raise ValueError("invalid whence %r" % whence)
+    return self._pos
+
+  def tell(self):
+    return self._pos
+
+
+def open_zip_member(zip_file, name, zip_mmap=None):
+  """
+  :param zipfile.ZipFile zip_file:
+  :param str name: member name
+  :param mmap.mmap|None zip_mmap: mmap of the whole zip file.
+    if given, for stored (uncompressed, unencrypted) members, we directly read from the mmap.
+    On Python 3, this is a view on the mmap, without a copy.
+    Python 2 cannot make a memoryview of a mmap, so there we copy the member out of the mmap.
+  :return: file object
+  :rtype: io.RawIOBase|io.BytesIO
+  """
+  import struct
+  import zipfile
+  info = zip_file.getinfo(name)
+  if zip_mmap is not None and info.compress_type == zipfile.ZIP_STORED and not info.flag_bits & 0x1:
+    # Local file header: signature, ..., file name len (offset 26), extra field len (offset 28), name, extra, data.
+    header_offset = info.header_offset
+    assert zip_mmap[header_offset:header_offset + 4] == b"PK\x03\x04", "invalid local file header for %r" % name
+    name_len, extra_len = struct.unpack("<HH", zip_mmap[header_offset + 26:header_offset + 30])
+    data_offset = header_offset + 30 + name_len + extra_len
+    if PY3:
+      return _MemoryViewFile(memoryview(zip_mmap)[data_offset:data_offset + info.file_size])
+    return io.BytesIO(zip_mmap[data_offset:data_offset + info.file_size])
+  return io.BytesIO(zip_file.read(info))
+
+
 class Enwik8Corpus(CachedDataset2):
   """
   enwik8
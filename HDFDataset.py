@@ -1,15 +1,16 @@
 from __future__ import print_function
 import collections
 import functools as fun
-import gc
 import h5py
 import numpy
+import os
 import random
 import theano
 from CachedDataset import CachedDataset
 from CachedDataset2 import CachedDataset2
 from Dataset import Dataset, DatasetSeq
 from Log import log
+from Util import binary_search_any
 
 # Common attribute names for HDF dataset, which should be used in order to be proceed with HDFDataset class.
 attr_seqLengths = 'seqLengths'
@@ -18,14 +19,158 @@ attr_numLabels = 'numLabels'
 attr_times = 'times'
 attr_ctcIndexTranscription = 'ctcIndexTranscription'
 
+class HDFSeqIndex(object):
+  """
+  Array-backed index over the seqs of a single HDF file.
+  The seq lengths and the frame offsets are kept as NumPy arrays (seq idx within the file -> per data-key).
+  The seq tags are only read on first access.
+  We keep them together with their sort order, such that we can find a tag via binary search.
+  If use_cache_file is set, the index is stored next to the HDF file
+  and in later runs, it is memory-mapped from there.
+  """
+
+  cache_file_names = ("seq_lengths", "tags", "tags_sort_order")
+
+  def __init__(self, filename, fin, num_keys, use_cache_file=False):
+    """
+    :param str filename: HDF file
+    :param h5py.File fin: opened HDF file
+    :param int num_keys: number of data-keys (inputs + targets), i.e. seq_lengths.shape[1]
+    :param bool use_cache_file: whether we use (read or create) the sidecar cache files
+    """
+    self.filename = filename
+    self.num_keys = num_keys
+    self.use_cache_file = use_cache_file
+    self.seq_lengths = None  # type: numpy.ndarray  # (num_seqs, num_keys)
+    self._tags = None  # type: numpy.ndarray  # (num_seqs,), bytes
+    self._tags_sort_order = None  # type: numpy.ndarray  # (num_seqs,), int
+    if not (use_cache_file and self._load_cache_file()):
+      self.seq_lengths = self._read_seq_lengths(fin)
+      if use_cache_file:
+        self._read_tags(fin)
+        self._save_cache_file()
+    assert self.seq_lengths.shape == (self.num_seqs, num_keys)
+    self.seq_starts = numpy.zeros((self.num_seqs + 1, num_keys), dtype="int64")
+    numpy.cumsum(self.seq_lengths, axis=0, out=self.seq_starts[1:])
+
+  @property
+  def num_seqs(self):
+    """
+    :rtype: int
+    """
+    return self.seq_lengths.shape[0]
+
+  def _read_seq_lengths(self, fin):
+    """
+    :param h5py.File fin:
+    :rtype: numpy.ndarray
+    """
+    seq_lengths = fin[attr_seqLengths][...]
+    if len(seq_lengths.shape) == 1:
+      seq_lengths = numpy.repeat(seq_lengths[:, None], self.num_keys, axis=1)
+    return seq_lengths
+
+  def _read_tags(self, fin):
+    """
+    :param h5py.File fin:
+    """
+    tags = fin["seqTags"][...]
+    if tags.dtype.kind == "S":
+      tags = tags.view(tags.dtype.str)  # drop the h5py dtype metadata
+    else:  # e.g. variable-length strings
+      decode = lambda s: s if isinstance(s, str) else s.decode('utf-8')
+      tags = numpy.array([decode(item).split('\0')[0].encode("utf8") for item in tags.tolist()], dtype="S")
+    self._tags = tags
+    self._tags_sort_order = numpy.argsort(tags, kind="mergesort")
+
+  def _init_tags(self):
+    if self._tags is not None:
+      return
+    fin = h5py.File(self.filename, "r")
+    self._read_tags(fin)
+    fin.close()
+
+  def get_tag(self, seq_idx):
+    """
+    :param int seq_idx: seq idx within this file
+    :rtype: str
+    """
+    self._init_tags()
+    tag = self._tags[seq_idx]
+    return tag if isinstance(tag, str) else tag.decode("utf8")
+
+  def find_tag(self, tag):
+    """
+    :param str tag:
+    :return: seq idx within this file, or None if not found. if the tag is there multiple times, the last one
+    :rtype: int|None
+    """
+    self._init_tags()
+    key = tag.encode("utf8") if not isinstance(tag, bytes) else tag
+
+    def cmp(idx):
+      other = self._tags[self._tags_sort_order[idx]]
+      return (other > key) - (other < key)
+
+    idx = binary_search_any(cmp=cmp, low=0, high=self.num_seqs)
+    if idx is None:
+      return None
+    # The sort is stable, thus equal tags are ordered by seq idx.
+    while idx + 1 < self.num_seqs and cmp(idx + 1) == 0:
+      idx += 1
+    return int(self._tags_sort_order[idx])
+
+  def _get_cache_filename(self, name):
+    """
+    :param str name: e.g. "seq_lengths"
+    :rtype: str
+    """
+    return "%s.seq_index.%s.npy" % (self.filename, name)
+
+  def _load_cache_file(self):
+    """
+    :return: whether we successfully loaded the cache
+    :rtype: bool
+    """
+    filenames = [self._get_cache_filename(name) for name in self.cache_file_names]
+    if not all([os.path.exists(fn) for fn in filenames]):
+      return False
+    if any([os.path.getmtime(fn) < os.path.getmtime(self.filename) for fn in filenames]):
+      print("HDF seq index cache for %s is outdated, recreating it" % self.filename, file=log.v4)
+      return False
+    self.seq_lengths, self._tags, self._tags_sort_order = [
+      numpy.load(fn, mmap_mode="r") for fn in filenames]
+    return True
+
+  def _save_cache_file(self):
+    arrays = {"seq_lengths": self.seq_lengths, "tags": self._tags, "tags_sort_order": self._tags_sort_order}
+    try:
+      for name in self.cache_file_names:
+        fn = self._get_cache_filename(name)
+        with open(fn + ".tmp", "wb") as f:
+          numpy.save(f, arrays[name])
+        os.rename(fn + ".tmp", fn)
+    except (IOError, OSError) as exc:
+      print("Cannot write HDF seq index cache for %s: %s" % (self.filename, exc), file=log.v3)
+
+
 class HDFDataset(CachedDataset):
 
-  def __init__(self, *args, **kwargs):
-    super(HDFDataset, self).__init__(*args, **kwargs)
+  def __init__(self, use_seq_index_cache=False, max_open_files=64, **kwargs):
+    """
+    :param bool use_seq_index_cache: stores the seq index (lengths, tags) of each HDF file
+      next to it, and reuses it (memory-mapped) in later runs. See :class:`HDFSeqIndex`.
+    :param int max_open_files: how much HDF files we keep open across load_seqs() calls
+    """
+    super(HDFDataset, self).__init__(**kwargs)
+    self.use_seq_index_cache = use_seq_index_cache
+    self.max_open_files = max_open_files
+    self._file_handles = collections.OrderedDict(); """ :type: dict[int,h5py.File] """  # file idx -> file, LRU order
     self.files = []; """ :type: list[str] """
     self.file_start = [0]
-    self.file_seq_start = []; """ :type: list[list[int]] """
-    self.file_index = []; """ :type: list[int] """
+    self.file_seq_start = []; """ :type: list[numpy.ndarray] """
+    self.file_seq_index = []; """ :type: list[HDFSeqIndex] """  # has the tags. self.tags/self.tag_idx stay empty
+    self._seq_lengths_buffer = None; """ :type: numpy.ndarray|None """  # see _add_seq_lengths()
     self.data_dtype = {}; ":type: dict[str,str]"
     self.data_sparse = {}; ":type: dict[str,bool]"
 
@@ -33,9 +178,9 @@ class HDFDataset(CachedDataset):
     """
     Setups data:
       self.seq_lengths
-      self.file_index
       self.file_start
       self.file_seq_start
+      self.file_seq_index
     Use load_seqs() to load the actual data.
     :type filename: str
     """
@@ -47,7 +192,6 @@ class HDFDataset(CachedDataset):
       labels = [ item.split('\0')[0] for item in fin["labels"][...].tolist() ]; """ :type: list[str] """
       self.labels = { 'classes' : labels }
       assert len(self.labels['classes']) == len(labels), "expected " + str(len(self.labels['classes'])) + " got " + str(len(labels))
-    tags = [ decode(item).split('\0')[0] for item in fin["seqTags"][...].tolist() ]; """ :type: list[str] """
     self.files.append(filename)
     print("parsing file", filename, file=log.v5)
     if 'times' in fin:
@@ -55,34 +199,28 @@ class HDFDataset(CachedDataset):
         self.timestamps = fin[attr_times][...]
       else:
         self.timestamps = numpy.concatenate([self.timestamps, fin[attr_times][...]],axis=0) #.extend(fin[attr_times][...].tolist())
-    seq_lengths = fin[attr_seqLengths][...]
     if 'targets' in fin:
       self.target_keys = sorted(fin['targets/labels'].keys())
     else:
       self.target_keys = ['classes']
 
-    if len(seq_lengths.shape) == 1:
-      seq_lengths = numpy.array(zip(*[seq_lengths.tolist() for i in range(len(self.target_keys)+1)]))
-
-    seq_start = [numpy.zeros((seq_lengths.shape[1],),'int64')]
+    seq_index = HDFSeqIndex(
+      filename=filename, fin=fin, num_keys=len(self.target_keys) + 1, use_cache_file=self.use_seq_index_cache)
+    seq_lengths = seq_index.seq_lengths
     if not self._seq_start:
       self._seq_start = [numpy.zeros((seq_lengths.shape[1],),'int64')]
-    for l in seq_lengths:
-      self._seq_lengths.append(numpy.array(l))
-      seq_start.append(seq_start[-1] + l)
-    self.tags += tags
-    self.file_seq_start.append(seq_start)
-    nseqs = len(seq_start) - 1
-    for i in range(nseqs):
-      self.tag_idx[tags[i]] = i + self._num_seqs
+    self._add_seq_lengths(seq_lengths)
+    self.file_seq_index.append(seq_index)
+    self.file_seq_start.append(seq_index.seq_starts)
+    nseqs = seq_index.num_seqs
     self._num_seqs += nseqs
-    self.file_index.extend([len(self.files) - 1] * nseqs)
     self.file_start.append(self.file_start[-1] + nseqs)
-    self._num_timesteps += sum([s[0] for s in seq_lengths])
+    num_frames = seq_index.seq_starts[-1]
+    self._num_timesteps += int(num_frames[0])
     if self._num_codesteps is None:
-      self._num_codesteps = [ 0 for i in range(1,len(seq_lengths[0])) ]
-    for i in range(1,len(seq_lengths[0])):
-      self._num_codesteps[i-1] += sum([s[i] for s in seq_lengths])
+      self._num_codesteps = [ 0 for i in range(1,len(num_frames)) ]
+    for i in range(1,len(num_frames)):
+      self._num_codesteps[i-1] += int(num_frames[i])
     if 'maxCTCIndexTranscriptionLength' in fin.attrs:
       self.max_ctc_length = max(self.max_ctc_length, fin.attrs['maxCTCIndexTranscriptionLength'])
     if len(fin['inputs'].shape) == 1:  # sparse
@@ -122,9 +260,45 @@ class HDFDataset(CachedDataset):
       self.targets = { 'classes' : numpy.zeros((self._num_timesteps,), dtype=theano.config.floatX)  }
       self.data_dtype['classes'] = 'int32'
     self.data_dtype["data"] = fin['inputs'].dtype
-    assert len(self.target_keys) == len(self._seq_lengths[0]) - 1
+    assert len(self.target_keys) == self._seq_lengths.shape[1] - 1
     fin.close()
 
+  def _add_seq_lengths(self, seq_lengths):
+    """
+    Appends to self._seq_lengths, which is a view on a buffer which we grow geometrically,
+    to avoid a full copy for every added file.
+
+    :param numpy.ndarray seq_lengths: (num_seqs, num_keys)
+    """
+    num_seqs = len(self._seq_lengths)
+    buf = self._seq_lengths_buffer
+    if buf is None or buf.shape[0] < num_seqs + seq_lengths.shape[0]:
+      new_buf = numpy.zeros((max(2 * num_seqs, num_seqs + seq_lengths.shape[0]), seq_lengths.shape[1]), dtype="int64")
+      if num_seqs:
+        new_buf[:num_seqs] = self._seq_lengths
+      buf = self._seq_lengths_buffer = new_buf
+    buf[num_seqs:num_seqs + seq_lengths.shape[0]] = seq_lengths
+    self._seq_lengths = buf[:num_seqs + seq_lengths.shape[0]]
+
+  def _get_file_index(self, real_seq_idx):
+    """
+    :param int|numpy.ndarray real_seq_idx:
+    :return: idx in self.files
+    :rtype: int|numpy.ndarray
+    """
+    return numpy.searchsorted(self.file_start, real_seq_idx, side="right") - 1
+
+  def _get_real_seq_idx_by_tag(self, tag):
+    """
+    :param str tag: if it is there multiple times, we return the last one, like the tag dict of CachedDataset
+    :rtype: int
+    """
+    for i, seq_index in reversed(list(enumerate(self.file_seq_index))):
+      idx = seq_index.find_tag(tag)
+      if idx is not None:
+        return self.file_start[i] + idx
+    raise KeyError("seq tag %r not found in %s" % (tag, self))
+
   def _load_seqs(self, start, end):
     """
     Load data sequences.
@@ -142,35 +316,92 @@ class HDFDataset(CachedDataset):
     assert len(selection) <= end - start, "DEBUG: more sequences requested (" + str(len(selection)) + ") as required (" + str(end-start) + ")"
     file_info = [ [] for l in range(len(self.files)) ]; """ :type: list[list[int]] """
     # file_info[i] is (sorted seq idx from selection, real seq idx)
-    for idc in selection:
-      ids = self._seq_index[idc]
-      file_info[self.file_index[ids]].append((idc,ids))
+    selection_ids = [self._seq_index[idc] for idc in selection]
+    for idc, ids, file_idx in zip(selection, selection_ids, self._get_file_index(selection_ids)):
+      file_info[file_idx].append((idc,ids))
     for i in range(len(self.files)):
       if len(file_info[i]) == 0:
         continue
       print("loading file %d/%d" % (i+1, len(self.files)), self.files[i], file=log.v4)
-      fin = h5py.File(self.files[i], 'r')
-      for idc, ids in file_info[i]:
-        s = ids - self.file_start[i]
-        p = self.file_seq_start[i][s]
-        l = self._seq_lengths[ids]
-        if 'targets' in fin:
-          for k in fin['targets/data']:
-            if self.targets[k] is None:
-              if self.data_dtype[k] == 'int32':
-                self.targets[k] = numpy.zeros((self._num_codesteps[self.target_keys.index(k)],), dtype=theano.config.floatX) - 1
-              else:
-                self.targets[k] = numpy.zeros((self._num_codesteps[self.target_keys.index(k)],tdim), dtype=theano.config.floatX) - 1
-            ldx = self.target_keys.index(k) + 1
-            self.targets[k][self.get_seq_start(idc)[ldx]:self.get_seq_start(idc)[ldx] + l[ldx]] = fin['targets/data/' + k][p[ldx] : p[ldx] + l[ldx]]
-        self._set_alloc_intervals_data(idc, data=fin['inputs'][p[0] : p[0] + l[0]][...])
-      fin.close()
-    gc.collect()
+      fin = self._get_file_handle(i)
+      target_names = list(fin['targets/data']) if 'targets' in fin else []
+      for k in target_names:
+        if self.targets[k] is None:
+          if self.data_dtype[k] == 'int32':
+            self.targets[k] = numpy.zeros((self._num_codesteps[self.target_keys.index(k)],), dtype=theano.config.floatX) - 1
+          else:
+            tdim = fin['targets/data'][k].shape[1]
+            self.targets[k] = numpy.zeros((self._num_codesteps[self.target_keys.index(k)],tdim), dtype=theano.config.floatX) - 1
+      for run in self._get_contiguous_runs(file_info[i]):
+        # Read all the seqs of this run at once, and then split them up.
+        run_start = self.file_seq_start[i][run[0][1] - self.file_start[i]]
+        run_end = self.file_seq_start[i][run[-1][1] - self.file_start[i] + 1]
+        for k in target_names:
+          ldx = self.target_keys.index(k) + 1
+          targets = fin['targets/data/' + k][run_start[ldx]:run_end[ldx]]
+          for idc, ids in run:
+            p = self.file_seq_start[i][ids - self.file_start[i]] - run_start
+            l = self._seq_lengths[ids]
+            self.targets[k][self.get_seq_start(idc)[ldx]:self.get_seq_start(idc)[ldx] + l[ldx]] = targets[p[ldx]:p[ldx] + l[ldx]]
+        inputs = fin['inputs'][run_start[0]:run_end[0]]
+        for idc, ids in run:
+          p = self.file_seq_start[i][ids - self.file_start[i]] - run_start
+          l = self._seq_lengths[ids]
+          self._set_alloc_intervals_data(idc, data=inputs[p[0]:p[0] + l[0]])
     assert self.is_cached(start, end)
 
+  @staticmethod
+  def _get_contiguous_runs(file_info):
+    """
+    :param list[(int,int)] file_info: list of (sorted seq idx, real seq idx), all for one file
+    :return: runs of consecutive real seq idx, i.e. seqs which are stored one after another in the file
+    :rtype: list[list[(int,int)]]
+    """
+    runs = []
+    for idc, ids in sorted(file_info, key=lambda x: x[1]):
+      if runs and runs[-1][-1][1] + 1 == ids:
+        runs[-1].append((idc, ids))
+      else:
+        runs.append([(idc, ids)])
+    return runs
+
+  def _get_file_handle(self, file_idx):
+    """
+    :param int file_idx: idx in self.files
+    :return: opened HDF file. we keep up to self.max_open_files of them open, least-recently-used first closed
+    :rtype: h5py.File
+    """
+    if file_idx in self._file_handles:
+      fin = self._file_handles.pop(file_idx)
+    else:
+      while len(self._file_handles) >= max(self.max_open_files, 1):
+        _, old_fin = self._file_handles.popitem(last=False)
+        old_fin.close()
+      fin = h5py.File(self.files[file_idx], 'r')
+    self._file_handles[file_idx] = fin  # (re)insert as most recently used
+    return fin
+
+  def close_files(self):
+    """
+    Closes all HDF files which we keep open for _load_seqs().
+    They will be reopened on demand.
+    """
+    for fin in self._file_handles.values():
+      fin.close()
+    self._file_handles.clear()
+
+  def finish_epoch(self):
+    super(HDFDataset, self).finish_epoch()
+    self.close_files()
+
+  def __del__(self):
+    if getattr(self, "_file_handles", None):
+      self.close_files()
+
   def get_tag(self, sorted_seq_idx):
     ids = self._seq_index[self._index_map[sorted_seq_idx]]
-    return self.tags[ids]
+    file_idx = self._get_file_index(ids)
+    return self.file_seq_index[file_idx].get_tag(ids - self.file_start[file_idx])
 
   def is_data_sparse(self, key):
     if key in self.num_outputs:
@@ -377,7 +608,8 @@ class NextGenHDFDataset(CachedDataset2):
       epoch = epoch or 1
       self.current_partition = (epoch - 1) % self.partition_epoch
       partition_size         = self.partitions[self.current_partition + 1] - self.partitions[self.current_partition]
-      self.seq_order         = self.get_seq_order_for_epoch(epoch, partition_size, self._get_seq_length)
+      self.seq_order         = self.get_seq_order_for_epoch(
+        epoch, partition_size, self._get_seq_length, seq_lens_cache_key=self.current_partition)
 
   def _get_seq_length(self, orig_seq_idx):
     """
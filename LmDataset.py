@@ -36,6 +36,8 @@ class LmDataset(CachedDataset2):
                error_on_invalid_seq=True,
                add_delayed_seq_data=False,
                delayed_seq_data_start_symbol="[START]",
+               token_cache_file=None,
+               use_compiled_orth_converter=True,
                **kwargs):
     """
     :param str|()->str corpus_file: Bliss XML or line-based txt. optionally can be gzip.
@@ -57,6 +59,15 @@ class LmDataset(CachedDataset2):
       delayed_seq_data_start_symbol + original_sequence[:-1]
     :param str delayed_seq_data_start_symbol: used for add_delayed_seq_data
     :param int partition_epoch: whether to partition the epochs into multiple parts. like epoch_split
+    :param str|None token_cache_file: if given, we convert the whole corpus once to label seqs,
+      which we store in a binary file (uint16 or uint32 label idxs, via numpy.tofile) at this path,
+      together with the seq offsets in token_cache_file + ".offsets.npy".
+      These files are memory-mapped, thus the corpus is never loaded into memory.
+      They are recreated when they are older than the corpus or the orth symbol files,
+      or when the options which influence the label seqs changed (stored in token_cache_file + ".json").
+      Only supported with orth_symbols_file or orth_symbols_map_file.
+    :param bool use_compiled_orth_converter: if we use orth symbols, use :class:`OrthToLabelConverter`
+      for the orth -> label conversion where possible. Disabled with auto_replace_unknown_symbol.
     """
     super(LmDataset, self).__init__(**kwargs)
 
@@ -137,6 +148,13 @@ class LmDataset(CachedDataset2):
       raise Exception("cannot handle so much labels: %i" % num_labels)
     self.num_outputs = {"data": [len(self.labels["data"]), 1]}
     self.num_inputs = self.num_outputs["data"][0]
+    self._orth_converter = None  # type: OrthToLabelConverter|None
+    self._unknown_label = None  # type: int|None
+    if self.orth_symbols and use_compiled_orth_converter and not auto_replace_unknown_symbol:
+      self._orth_converter = OrthToLabelConverter(
+        orth_symbols_map=self.orth_symbols_map, orth_replace_map=self.orth_replace_map,
+        parse_orth_opts=self.parse_orth_opts, dtype=self.dtype)
+      self._unknown_label = self.orth_symbols_map.get(self.unknown_symbol, None)
     self.seq_order = None
     self.auto_replace_unknown_symbol = auto_replace_unknown_symbol
     self.log_auto_replace_unknown_symbols = log_auto_replace_unknown_symbols
@@ -151,10 +169,137 @@ class LmDataset(CachedDataset2):
     if add_delayed_seq_data:
       self.num_outputs["delayed"] = self.num_outputs["data"]
 
-    self.orths = read_corpus(corpus_file)
+    self.token_cache_file = token_cache_file
+    self._token_data = None  # type: numpy.ndarray|None  # memory-mapped, all label seqs concatenated
+    self._token_offsets = None  # type: numpy.ndarray|None  # memory-mapped, shape (num_seqs + 1,)
+    if token_cache_file:
+      assert self.orth_symbols, "token_cache_file needs orth_symbols_file or orth_symbols_map_file"
+      assert not add_random_phone_seqs
+      self._init_token_cache(
+        corpus_file=corpus_file, dependency_files=[orth_symbols_file, orth_symbols_map_file, orth_replace_map_file])
+      self.orths = None
+      num_seqs = self._token_offsets.shape[0] - 1
+    else:
+      self.orths = read_corpus(corpus_file)
+      num_seqs = len(self.orths)
     # It's only estimated because we might filter some out or so.
-    self._estimated_num_seqs = len(self.orths) // self.partition_epoch
-    print("  done, loaded %i sequences" % len(self.orths), file=log.v4)
+    self._estimated_num_seqs = num_seqs // self.partition_epoch
+    print("  done, loaded %i sequences" % num_seqs, file=log.v4)
+
+  def _get_token_cache_dtype(self):
+    """
+    :return: dtype for the label idxs in the token cache file
+    :rtype: str
+    """
+    if len(self.labels["data"]) <= 2 ** 16:
+      return "uint16"
+    assert len(self.labels["data"]) <= 2 ** 32
+    return "uint32"
+
+  def _get_token_cache_meta(self, corpus_file):
+    """
+    :param str corpus_file:
+    :return: all the options which influence the token cache content. stored as JSON next to the cache
+    :rtype: dict[str]
+    """
+    import hashlib
+    import json
+
+    def get_hash(value):
+      return hashlib.md5(json.dumps(value, sort_keys=True).encode("utf8")).hexdigest()
+
+    meta = {
+      "corpus_file": os.path.abspath(corpus_file),
+      "word_based": self.word_based,
+      "unknown_symbol": self.unknown_symbol,
+      "auto_replace_unknown_symbol": self.auto_replace_unknown_symbol,
+      "error_on_invalid_seq": self.error_on_invalid_seq,
+      "parse_orth_opts": self.parse_orth_opts,
+      "orth_symbols": get_hash(self.orth_symbols),
+      "orth_replace_map": get_hash(self.orth_replace_map),
+      "dtype": self._get_token_cache_dtype()}
+    return json.loads(json.dumps(meta, sort_keys=True))  # normalized, e.g. tuples -> lists, like after loading
+
+  def _init_token_cache(self, corpus_file, dependency_files):
+    """
+    Creates the token cache files (see token_cache_file) if needed, and memory-maps them.
+
+    :param str corpus_file:
+    :param list[str|None] dependency_files: if any of them is newer than the cache, we recreate it
+    """
+    import json
+    offsets_file = self.token_cache_file + ".offsets.npy"
+    meta_file = self.token_cache_file + ".json"
+    meta = self._get_token_cache_meta(corpus_file)
+    valid = all([os.path.exists(fn) for fn in [self.token_cache_file, offsets_file, meta_file]])
+    if valid:
+      with open(meta_file) as f:
+        stored_meta = json.load(f)
+      if stored_meta != meta:
+        print("  token cache file %s was created with other options, recreate" % self.token_cache_file, file=log.v4)
+        valid = False
+    if valid:
+      cache_mtime = min([os.path.getmtime(fn) for fn in [self.token_cache_file, offsets_file, meta_file]])
+      for fn in [corpus_file] + dependency_files:
+        if fn and os.path.getmtime(fn) > cache_mtime:
+          print("  token cache file %s is older than %s, recreate" % (self.token_cache_file, fn), file=log.v4)
+          valid = False
+    if not valid:
+      if os.path.exists(meta_file):
+        os.remove(meta_file)
+      self._create_token_cache(corpus_file=corpus_file, offsets_file=offsets_file)
+      # Write the meta file last, such that it only exists for a complete cache.
+      with open(meta_file + ".tmp", "w") as f:
+        json.dump(meta, f, sort_keys=True)
+      os.rename(meta_file + ".tmp", meta_file)
+    self._token_data = numpy.memmap(self.token_cache_file, dtype=self._get_token_cache_dtype(), mode="r")
+    self._token_offsets = numpy.load(offsets_file, mmap_mode="r")
+    assert self._token_offsets.ndim == 1 and self._token_offsets[-1] == self._token_data.shape[0]
+
+  def _create_token_cache(self, corpus_file, offsets_file):
+    """
+    Goes once through the corpus, and writes all label seqs to the token cache files.
+
+    :param str corpus_file:
+    :param str offsets_file:
+    """
+    import array
+    print("  create token cache file %s" % self.token_cache_file, file=log.v4)
+    start_time = time.time()
+    dtype = self._get_token_cache_dtype()
+    offsets = array.array("l" if array.array("l").itemsize == 8 else "q", [0])
+    self.num_skipped = 0
+    self.num_unknown = 0
+    # Write to tmp files first, such that we never end up with partially written cache files.
+    with open(self.token_cache_file + ".tmp", "wb") as f:
+      orths = []
+
+      def flush():
+        for data in self._orths_to_data(orths):
+          if data is None:
+            continue
+          data.astype(dtype).tofile(f)
+          offsets.append(offsets[-1] + data.shape[0])
+        del orths[:]
+
+      def callback(orth):
+        """
+        :param str orth:
+        """
+        if orth == "</s>":
+          return
+        orths.append(orth)
+        if len(orths) >= 1000:
+          flush()
+
+      iter_corpus(corpus_file, callback)
+      flush()
+    with open(offsets_file + ".tmp", "wb") as f:
+      numpy.save(f, numpy.frombuffer(offsets, dtype="int64"))
+    os.rename(self.token_cache_file + ".tmp", self.token_cache_file)
+    os.rename(offsets_file + ".tmp", offsets_file)
+    print("  done, %i sequences, %i labels, skipped %i sequences, %.1f secs" % (
+      len(offsets) - 1, offsets[-1], self.num_skipped, time.time() - start_time), file=log.v4)
 
   def get_target_list(self):
     return sorted([k for k in self.num_outputs.keys() if k != "data"])
@@ -166,11 +311,22 @@ class LmDataset(CachedDataset2):
     assert seq_list is None
     super(LmDataset, self).init_seq_order(epoch=epoch)
     epoch = epoch or 1
-    self.orths_epoch = self.orths[
-                       len(self.orths) * (epoch % self.partition_epoch) // self.partition_epoch:
-                       len(self.orths) * ((epoch % self.partition_epoch) + 1) // self.partition_epoch]
-    self.seq_order = self.get_seq_order_for_epoch(
-      epoch=epoch, num_seqs=len(self.orths_epoch), get_seq_len=lambda i: len(self.orths_epoch[i]))
+    if self._token_offsets is not None:
+      num_seqs = self._token_offsets.shape[0] - 1
+      start = num_seqs * (epoch % self.partition_epoch) // self.partition_epoch
+      end = num_seqs * ((epoch % self.partition_epoch) + 1) // self.partition_epoch
+      self.orths_epoch = None
+      self._token_offsets_epoch = self._token_offsets[start:end + 1]
+      self.seq_order = self.get_seq_order_for_epoch(
+        epoch=epoch, num_seqs=end - start, get_seq_len=numpy.diff(self._token_offsets_epoch))
+      self._num_seqs = end - start  # exact, as the invalid seqs are already filtered out
+    else:
+      self.orths_epoch = self.orths[
+                         len(self.orths) * (epoch % self.partition_epoch) // self.partition_epoch:
+                         len(self.orths) * ((epoch % self.partition_epoch) + 1) // self.partition_epoch]
+      self.seq_order = self.get_seq_order_for_epoch(
+        epoch=epoch, num_seqs=len(self.orths_epoch), get_seq_len=lambda i: len(self.orths_epoch[i]),
+        seq_lens_cache_key=epoch % self.partition_epoch)
     self.next_orth_idx = 0
     self.next_seq_idx = 0
     self.num_skipped = 0
@@ -197,6 +353,82 @@ class LmDataset(CachedDataset2):
     if not self.log_auto_replace_unknown_symbols:
       print("LmDataset: will stop logging about auto-replace with unknown symbol now", file=log.v4)
 
+  def _orths_to_data(self, orths):
+    """
+    :param list[str] orths:
+    :return: for each orth, the label seq, or None if we should skip this seq
+    :rtype: list[numpy.ndarray|None]
+    """
+    if self._orth_converter:
+      res = self._orth_converter.convert(orths)
+    else:
+      res = [None] * len(orths)
+    for i, data in enumerate(res):
+      if data is None:  # not handled by the converter, or no converter
+        res[i] = self._orth_to_data(orths[i])
+      elif self._unknown_label is not None:
+        self.num_unknown += numpy.count_nonzero(data == self._unknown_label)
+    return res
+
+  def _orth_to_data(self, orth):
+    """
+    :param str orth:
+    :return: label seq, or None if we should skip this seq
+    :rtype: numpy.ndarray|None
+    """
+    if self.seq_gen:
+      try:
+        phones = self.seq_gen.generate_seq(orth)
+      except KeyError as e:
+        if self.log_skipped_seqs:
+          print("LmDataset: skipping sequence %r because of missing lexicon entry: %s" % (orth, e), file=log.v4)
+          self._reduce_log_skipped_seqs()
+        if self.error_on_invalid_seq:
+          raise Exception("LmDataset: invalid seq %r, missing lexicon entry %r" % (orth, e))
+        self.num_skipped += 1
+        return None  # try another seq
+      return self.seq_gen.seq_to_class_idxs(phones, dtype=self.dtype)
+
+    elif self.orth_symbols:
+      orth_syms = parse_orthography(orth, **self.parse_orth_opts)
+      while True:
+        orth_syms = sum([self.orth_replace_map.get(s, [s]) for s in orth_syms], [])
+        i = 0
+        while i < len(orth_syms) - 1:
+          if orth_syms[i:i+2] == [" ", " "]:
+            orth_syms[i:i+2] = [" "]  # collapse two spaces
+          else:
+            i += 1
+        if self.auto_replace_unknown_symbol:
+          try:
+            map(self.orth_symbols_map.__getitem__, orth_syms)
+          except KeyError as e:
+            orth_sym = e.message
+            if self.log_auto_replace_unknown_symbols:
+              print("LmDataset: unknown orth symbol %r, adding to orth_replace_map as %r" % (orth_sym, self.unknown_symbol), file=log.v3)
+              self._reduce_log_auto_replace_unknown_symbols()
+            self.orth_replace_map[orth_sym] = [self.unknown_symbol] if self.unknown_symbol is not None else []
+            continue  # try this seq again with updated orth_replace_map
+        break
+      self.num_unknown += orth_syms.count(self.unknown_symbol)
+      if self.word_based:
+        orth_debug_str = repr(orth_syms)
+      else:
+        orth_debug_str = repr("".join(orth_syms))
+      try:
+        return numpy.array(list(map(self.orth_symbols_map.__getitem__, orth_syms)), dtype=self.dtype)
+      except KeyError as e:
+        if self.log_skipped_seqs:
+          print("LmDataset: skipping sequence %s because of missing orth symbol: %s" % (orth_debug_str, e), file=log.v4)
+          self._reduce_log_skipped_seqs()
+        if self.error_on_invalid_seq:
+          raise Exception("LmDataset: invalid seq %s, missing orth symbol %s" % (orth_debug_str, e))
+        self.num_skipped += 1
+        return None  # try another seq
+
+    else:
+      assert False
+
   def _collect_single_seq(self, seq_idx):
     """
     :type seq_idx: int
@@ -204,68 +436,25 @@ class LmDataset(CachedDataset2):
     :returns DatasetSeq or None if seq_idx >= num_seqs.
     """
     while True:
-      if self.next_orth_idx >= len(self.orths_epoch):
+      num_seqs_epoch = len(self.seq_order)
+      if self.next_orth_idx >= num_seqs_epoch:
         assert self.next_seq_idx <= seq_idx, "We expect that we iterate through all seqs."
         if self.num_skipped > 0:
           print("LmDataset: reached end, skipped %i sequences" % self.num_skipped)
         return None
       assert self.next_seq_idx == seq_idx, "We expect that we iterate through all seqs."
-      orth = self.orths_epoch[self.seq_order[self.next_orth_idx]]
-      self.next_orth_idx += 1
-      if orth == "</s>": continue  # special sentence end symbol. empty seq, ignore.
-
-      if self.seq_gen:
-        try:
-          phones = self.seq_gen.generate_seq(orth)
-        except KeyError as e:
-          if self.log_skipped_seqs:
-            print("LmDataset: skipping sequence %r because of missing lexicon entry: %s" % (orth, e), file=log.v4)
-            self._reduce_log_skipped_seqs()
-          if self.error_on_invalid_seq:
-            raise Exception("LmDataset: invalid seq %r, missing lexicon entry %r" % (orth, e))
-          self.num_skipped += 1
-          continue  # try another seq
-        data = self.seq_gen.seq_to_class_idxs(phones, dtype=self.dtype)
-
-      elif self.orth_symbols:
-        orth_syms = parse_orthography(orth, **self.parse_orth_opts)
-        while True:
-          orth_syms = sum([self.orth_replace_map.get(s, [s]) for s in orth_syms], [])
-          i = 0
-          while i < len(orth_syms) - 1:
-            if orth_syms[i:i+2] == [" ", " "]:
-              orth_syms[i:i+2] = [" "]  # collapse two spaces
-            else:
-              i += 1
-          if self.auto_replace_unknown_symbol:
-            try:
-              map(self.orth_symbols_map.__getitem__, orth_syms)
-            except KeyError as e:
-              orth_sym = e.message
-              if self.log_auto_replace_unknown_symbols:
-                print("LmDataset: unknown orth symbol %r, adding to orth_replace_map as %r" % (orth_sym, self.unknown_symbol), file=log.v3)
-                self._reduce_log_auto_replace_unknown_symbols()
-              self.orth_replace_map[orth_sym] = [self.unknown_symbol] if self.unknown_symbol is not None else []
-              continue  # try this seq again with updated orth_replace_map
-          break
-        self.num_unknown += orth_syms.count(self.unknown_symbol)
-        if self.word_based:
-          orth_debug_str = repr(orth_syms)
-        else:
-          orth_debug_str = repr("".join(orth_syms))
-        try:
-          data = numpy.array(list(map(self.orth_symbols_map.__getitem__, orth_syms)), dtype=self.dtype)
-        except KeyError as e:
-          if self.log_skipped_seqs:
-            print("LmDataset: skipping sequence %s because of missing orth symbol: %s" % (orth_debug_str, e), file=log.v4)
-            self._reduce_log_skipped_seqs()
-          if self.error_on_invalid_seq:
-            raise Exception("LmDataset: invalid seq %s, missing orth symbol %s" % (orth_debug_str, e))
-          self.num_skipped += 1
-          continue  # try another seq
-
+      if self._token_offsets is not None:
+        # Invalid seqs were already skipped when we created the token cache file.
+        i = self.seq_order[self.next_orth_idx]
+        self.next_orth_idx += 1
+        data = self._token_data[self._token_offsets_epoch[i]:self._token_offsets_epoch[i + 1]].astype(self.dtype)
       else:
-        assert False
+        orth = self.orths_epoch[self.seq_order[self.next_orth_idx]]
+        self.next_orth_idx += 1
+        if orth == "</s>": continue  # special sentence end symbol. empty seq, ignore.
+        data, = self._orths_to_data([orth])
+        if data is None:
+          continue  # try another seq
 
       targets = {}
       for i in range(self.add_random_phone_seqs):
@@ -366,6 +555,142 @@ def read_corpus(filename):
   return out_list
 
 
+class OrthToLabelConverter(object):
+  """
+  Converts orthographies to label seqs, in the same way as LmDataset does it
+  via parse_orthography(), the orth replace map and the orth symbols map,
+  but with lookup tables which are precomputed once, and for a whole batch of orthographies at once.
+  For char-based symbols, the lookup is a single NumPy table lookup over the code points of all orthographies.
+
+  It does not handle all cases (e.g. special symbols in []-brackets, replacements by multiple symbols,
+  unknown symbols). For those orthographies, it returns None, and the caller must use the generic code path,
+  which also takes care about the logging and error handling.
+  """
+
+  def __init__(self, orth_symbols_map, orth_replace_map=None, parse_orth_opts=None, dtype="int32"):
+    """
+    :param dict[str,int] orth_symbols_map: symbol -> label idx
+    :param dict[str,list[str]]|None orth_replace_map: symbol -> list of symbols
+    :param dict[str]|None parse_orth_opts: kwargs for parse_orthography()
+    :param str dtype: of the returned label seqs
+    """
+    opts = {
+      "prefix": (), "postfix": ("[END]",), "remove_chars": "(){}", "collapse_spaces": True, "final_strip": True,
+      "word_based": False, "square_brackets_for_specials": True}
+    opts.update(parse_orth_opts or {})
+    self.dtype = dtype
+    self.word_based = opts["word_based"]
+    self.remove_chars = opts["remove_chars"]
+    self.final_strip = opts["final_strip"]
+    self.check_square_brackets = opts["square_brackets_for_specials"]
+    orth_replace_map = orth_replace_map or {}
+    # Whether we can handle the parse_orth_opts at all. Otherwise, we will just return None for every orth.
+    self.supported = opts["collapse_spaces"] and (opts["final_strip"] or not self.word_based)
+
+    def get_label(sym):
+      """
+      :param str sym:
+      :return: label idx, or None if we cannot handle it
+      :rtype: int|None
+      """
+      syms = orth_replace_map.get(sym, [sym])
+      if len(syms) != 1 or (syms[0] == " " and sym != " "):  # replaced by multiple or no or space symbols
+        return None
+      return orth_symbols_map.get(syms[0], None)
+
+    prefix_postfix = []
+    for syms in [opts["prefix"], opts["postfix"]]:
+      labels = [get_label(sym) for sym in syms]
+      if None in labels:
+        self.supported = False
+      prefix_postfix.append(numpy.array([label for label in labels if label is not None], dtype=dtype))
+    self.prefix_labels, self.postfix_labels = prefix_postfix
+
+    if self.word_based:
+      self.word_map = {}  # type: dict[str,int]
+      for sym in list(orth_symbols_map.keys()) + list(orth_replace_map.keys()):
+        label = get_label(sym)
+        if label is not None:
+          self.word_map[sym] = label
+    else:
+      chars = [sym for sym in list(orth_symbols_map.keys()) + list(orth_replace_map.keys()) if len(sym) == 1]
+      # Code point -> label idx, or -1 if we cannot handle it.
+      self.char_table = numpy.full((max([ord(c) for c in chars] + [0]) + 1,), -1, dtype="int64")
+      for c in chars:
+        label = get_label(c)
+        if label is not None:
+          self.char_table[ord(c)] = label
+
+  def _prepare(self, orth):
+    """
+    Like parse_orthography() does it, but without the split into symbols.
+
+    :param str orth:
+    :return: prepared orth, or None if we cannot handle it
+    :rtype: str|None
+    """
+    for c in self.remove_chars:
+      orth = orth.replace(c, "")
+    orth = " ".join(orth.split())
+    if self.final_strip:
+      orth = orth.strip()
+    if self.check_square_brackets and "[" in orth:
+      return None  # special symbols
+    return orth
+
+  def _wrap(self, labels):
+    """
+    :param numpy.ndarray|list[int] labels:
+    :return: labels with prefix and postfix
+    :rtype: numpy.ndarray
+    """
+    return numpy.concatenate([self.prefix_labels, numpy.asarray(labels, dtype=self.dtype), self.postfix_labels])
+
+  def convert(self, orths):
+    """
+    :param list[str] orths:
+    :return: for each orth, the label seq, or None if we cannot handle it
+    :rtype: list[numpy.ndarray|None]
+    """
+    res = [None] * len(orths)  # type: list[numpy.ndarray|None]
+    if not self.supported:
+      return res
+    idxs = []
+    prepared = []
+    for i, orth in enumerate(orths):
+      orth = self._prepare(orth)
+      if orth is not None:
+        idxs.append(i)
+        prepared.append(orth)
+    if not prepared:
+      return res
+
+    if self.word_based:
+      word_map = self.word_map
+      for i, orth in zip(idxs, prepared):
+        try:
+          res[i] = self._wrap([word_map[w] for w in orth.split(" ")] if orth else [])
+        except KeyError:
+          pass  # cannot handle
+      return res
+
+    lens = numpy.array([len(orth) for orth in prepared], dtype="int64")
+    codes = numpy.frombuffer(unicode("").join(prepared).encode("utf-32-le"), dtype="uint32").astype("int64")
+    assert codes.shape == (numpy.sum(lens),)
+    labels = self.char_table[numpy.minimum(codes, self.char_table.shape[0] - 1)]
+    labels[codes >= self.char_table.shape[0]] = -1
+    ends = numpy.cumsum(lens)
+    starts = ends - lens
+    # Num of chars per orth which we cannot handle, via the cumsum over the invalid mask.
+    num_invalid = numpy.concatenate([[0], numpy.cumsum(labels < 0)])
+    num_invalid = num_invalid[ends] - num_invalid[starts]
+    labels = labels.astype(self.dtype)
+    for j, i in enumerate(idxs):
+      if num_invalid[j] == 0:
+        res[i] = self._wrap(labels[starts[j]:ends[j]])
+    return res
+
+
 class AllophoneState:
   # In Sprint, see AllophoneStateAlphabet::index().
   id = None  # u16 in Sprint. here just str
@@ -887,7 +1212,9 @@ class TranslationDataset(CachedDataset2):
 
   def __init__(self, path, file_postfix, partition_epoch=None, source_postfix="", target_postfix="",
                source_only=False,
-               unknown_label=None, **kwargs):
+               unknown_label=None,
+               use_packed_data=False, packed_data_dir=None,
+               **kwargs):
     """
     :param str path: the directory containing the files
     :param str file_postfix: e.g. "train" or "dev". it will then search for "source." + postfix and "target." + postfix.
@@ -898,6 +1225,10 @@ class TranslationDataset(CachedDataset2):
       You might want to add some sentence-end symbol.
     :param bool source_only: if targets are not available
     :param str|None unknown_label: "UNK" or so. if not given, then will not replace unknowns but throw an error
+    :param bool use_packed_data: if True, we convert the text files once to packed binary files
+      (see :func:`create_packed_data`), which are then memory-mapped, and there is no parsing anymore.
+      Otherwise, we read the text files in a background thread and keep all seqs in memory.
+    :param str|None packed_data_dir: where to store the packed data files. by default the same as path
     """
     super(TranslationDataset, self).__init__(**kwargs)
     self.path = path
@@ -923,9 +1254,24 @@ class TranslationDataset(CachedDataset2):
     self.labels = {k: self._get_label_list(k) for k in self._vocabs.keys()}
     self._unknown_label = unknown_label
     self._seq_order = None  # type: None|list[int]  # seq_idx -> line_nr
-    self._thread = Thread(name="%r reader" % self, target=self._thread_main)
-    self._thread.daemon = True
-    self._thread.start()
+    self.packed_data_dir = packed_data_dir or path
+    # data_key -> (tokens, offsets), both memory-mapped. see create_packed_data()
+    self._packed_data = None  # type: dict[str,(numpy.ndarray,numpy.ndarray)]|None
+    if use_packed_data:
+      for f in self._data_files.values():
+        f.close()
+      self._data_files = None
+      self._packed_data = {}
+      for prefix, data_key in self.MapToDataKeys.items():
+        self._packed_data[data_key] = self._load_packed_data(prefix)
+      self._data = None
+      self._data_len = self._packed_data["data"][1].shape[0] - 1
+      assert all([offsets.shape[0] - 1 == self._data_len for (_, offsets) in self._packed_data.values()])
+      self._thread = None
+    else:
+      self._thread = Thread(name="%r reader" % self, target=self._thread_main)
+      self._thread.daemon = True
+      self._thread.start()
 
   def _thread_main(self):
     from Util import interrupt_main
@@ -971,6 +1317,106 @@ class TranslationDataset(CachedDataset2):
       sys.excepthook(*sys.exc_info())
       interrupt_main()
 
+  def _get_packed_data_filename(self, prefix):
+    """
+    :param str prefix: e.g. "source" or "target"
+    :return: filename of the packed tokens. the offsets are in filename + ".offsets.npy",
+      and some meta info in filename + ".json"
+    :rtype: str
+    """
+    return "%s/%s.%s.packed" % (self.packed_data_dir, prefix, self.file_postfix)
+
+  def _get_packed_data_meta(self, prefix):
+    """
+    :param str prefix: e.g. "source" or "target"
+    :return: all the options which influence the packed data
+    :rtype: dict[str]
+    """
+    data_key = self.MapToDataKeys[prefix]
+    return {
+      "postfix": self._add_postfix[data_key],
+      "unknown_label": self._unknown_label,
+      "dtype": "uint16" if self.num_outputs[data_key][0] <= 2 ** 16 else "int32"}
+
+  def _load_packed_data(self, prefix):
+    """
+    Creates the packed data files if they do not exist or are outdated, and memory-maps them.
+
+    :param str prefix: e.g. "source" or "target"
+    :return: tokens, offsets
+    :rtype: (numpy.ndarray, numpy.ndarray)
+    """
+    import json
+    filename = self._get_packed_data_filename(prefix)
+    meta = self._get_packed_data_meta(prefix)
+    valid = os.path.exists(filename + ".json")
+    if valid:
+      with open(filename + ".json") as f:
+        stored_meta = json.load(f)
+      packed_mtime = os.path.getmtime(filename + ".json")
+      src_files = [fn for fn in [
+        self._get_data_filename(prefix), self._get_data_filename(prefix) + ".gz",
+        "%s/%s.vocab.pkl" % (self.path, prefix)] if os.path.exists(fn)]
+      if stored_meta != meta or any([os.path.getmtime(fn) > packed_mtime for fn in src_files]):
+        print("%r: packed data %s is outdated, recreate" % (self, filename), file=log.v4)
+        valid = False
+    if not valid:
+      self.create_packed_data(prefix)
+    tokens = numpy.memmap(filename, dtype=meta["dtype"], mode="r")
+    offsets = numpy.load(filename + ".offsets.npy", mmap_mode="r")
+    assert offsets[-1] == tokens.shape[0]
+    return tokens, offsets
+
+  def create_packed_data(self, prefix):
+    """
+    Reads the text file once and writes the label idxs of all lines into a single binary file
+    (all concatenated, uint16 or int32), the offsets per line (int64, num lines + 1) into another file,
+    and the options (postfix, unknown label, dtype) into a JSON file, which is written last.
+    This can also be called explicitly as a preprocessing step.
+
+    :param str prefix: e.g. "source" or "target"
+    """
+    import json
+    import array
+    import time
+    filename = self._get_packed_data_filename(prefix)
+    meta = self._get_packed_data_meta(prefix)
+    data_key = self.MapToDataKeys[prefix]
+    vocab = self._vocabs[data_key]
+    print("%r: create packed data %s" % (self, filename), file=log.v4)
+    start_time = time.time()
+    offsets = array.array("l" if array.array("l").itemsize == 8 else "q", [0])
+    data_file = self._get_data_file(prefix)
+    with open(filename + ".tmp", "wb") as f:
+      while True:
+        data_strs = data_file.readlines(10 ** 6)
+        if not data_strs:
+          break
+        data = [
+          self._data_str_to_numpy(vocab, s.decode("utf8").strip() + self._add_postfix[data_key])
+          for s in data_strs]
+        for d in data:
+          offsets.append(offsets[-1] + d.shape[0])
+        numpy.concatenate(data).astype(meta["dtype"]).tofile(f)
+    data_file.close()
+    with open(filename + ".offsets.npy.tmp", "wb") as f:
+      numpy.save(f, numpy.frombuffer(offsets, dtype="int64"))
+    with open(filename + ".json.tmp", "w") as f:
+      json.dump(meta, f)
+    os.rename(filename + ".tmp", filename)
+    os.rename(filename + ".offsets.npy.tmp", filename + ".offsets.npy")
+    os.rename(filename + ".json.tmp", filename + ".json")
+    print("%r: done, %i lines, %i labels, %.1f secs" % (
+      self, len(offsets) - 1, offsets[-1], time.time() - start_time), file=log.v4)
+
+  def _get_data_filename(self, prefix):
+    """
+    :param str prefix: e.g. "source" or "target"
+    :return: filename without the optional ".gz"
+    :rtype: str
+    """
+    return "%s/%s.%s" % (self.path, prefix, self.file_postfix)
+
   def _get_data_file(self, prefix):
     """
     :param str prefix: e.g. "source" or "target"
@@ -978,7 +1424,7 @@ class TranslationDataset(CachedDataset2):
     :rtype: io.FileIO
     """
     import os
-    filename = "%s/%s.%s" % (self.path, prefix, self.file_postfix)
+    filename = self._get_data_filename(prefix)
     if os.path.exists(filename):
       return open(filename, "rb")
     if os.path.exists(filename + ".gz"):
@@ -1000,6 +1446,20 @@ class TranslationDataset(CachedDataset2):
     assert isinstance(vocab, dict)
     return vocab
 
+  def _get_seq_lens_cache_input_files(self):
+    """
+    :return: also the data and vocab files, which are in self.path
+    :rtype: list[str]
+    """
+    import os
+    files = super(TranslationDataset, self)._get_seq_lens_cache_input_files()
+    for prefix in sorted(self.MapToDataKeys.keys()):
+      filename = self._get_data_filename(prefix)
+      for fn in [filename, filename + ".gz", "%s/%s.vocab.pkl" % (self.path, prefix)]:
+        if os.path.isfile(fn):
+          files.append(fn)
+    return files
+
   def _reverse_vocab(self, data_key):
     """
     Note that there might be multiple items in the vocabulary (e.g. "<S>" and "</S>")
@@ -1046,6 +1506,9 @@ class TranslationDataset(CachedDataset2):
     :return: 1D array
     :rtype: numpy.ndarray
     """
+    if self._packed_data is not None:
+      tokens, offsets = self._packed_data[key]
+      return tokens[offsets[line_nr]:offsets[line_nr + 1]].astype("int32")
     import time
     last_print_time = 0
     last_print_len = None
@@ -1125,8 +1588,12 @@ class TranslationDataset(CachedDataset2):
       self._num_seqs = len(self._seq_order)
     else:
       num_seqs = self._get_data_len()
+      if self._packed_data is not None:
+        get_seq_len = numpy.diff(self._packed_data["data"][1])
+      else:
+        get_seq_len = lambda i: len(self._get_data(key="data", line_nr=i))
       self._seq_order = self.get_seq_order_for_epoch(
-        epoch=epoch, num_seqs=num_seqs, get_seq_len=lambda i: len(self._get_data(key="data", line_nr=i)))
+        epoch=epoch, num_seqs=num_seqs, get_seq_len=get_seq_len, seq_lens_cache_key="data")
       self._num_seqs = num_seqs
     if self.partition_epoch:
       self._partition_epoch_num_seqs = [self._num_seqs // self.partition_epoch] * self.partition_epoch
@@ -2,18 +2,105 @@
 from __future__ import print_function
 
 from Dataset import Dataset, DatasetSeq, init_dataset, convert_data_dims
+from CachedDataset import CachedDataset
 from CachedDataset2 import CachedDataset2
 from Util import NumbersDict, load_json
 from Log import log
 from random import Random
+import array
+import bisect
+import os
+import time
 import numpy
 
 
+class _SubDatasetsLoader(object):
+  """
+  Calls load_seqs() on the sub datasets of MetaDataset or CombinedDataset,
+  maybe concurrently (thread pool with one worker per sub dataset),
+  and collects timing stats per sub dataset, so that we can see which one is the straggler.
+  """
+
+  def __init__(self, num_workers, parallel=True):
+    """
+    :param int num_workers: number of sub datasets
+    :param bool parallel:
+    """
+    self.num_workers = num_workers
+    self.parallel = parallel and num_workers > 1
+    self._pool = None
+    self.timing_stats = {}  # type: dict[str,list[float]]  # dataset-key -> [num calls, total time, max time]
+
+  @staticmethod
+  def _load(args):
+    """
+    :param (str,Dataset,int,int) args: dataset-key, dataset, start, end
+    :return: time in secs
+    :rtype: float
+    """
+    _, dataset, start, end = args
+    start_time = time.time()
+    dataset.load_seqs(start, end)
+    return time.time() - start_time
+
+  def load_seqs(self, loads):
+    """
+    Returns when all loads are finished. Exceptions in a worker are reraised here.
+
+    :param list[(str,Dataset,int,int)] loads: dataset-key, dataset, start, end
+    """
+    if self.parallel and len(loads) > 1:
+      if self._pool is None:
+        from multiprocessing.pool import ThreadPool
+        self._pool = ThreadPool(self.num_workers)
+      times = self._pool.map(self._load, loads)
+    else:
+      times = [self._load(args) for args in loads]
+    for (dataset_key, _, _, _), t in zip(loads, times):
+      stats = self.timing_stats.setdefault(dataset_key, [0, 0.0, 0.0])
+      stats[0] += 1
+      stats[1] += t
+      stats[2] = max(stats[2], t)
+
+  def report(self, name, epoch):
+    """
+    Prints the timing stats (if there are any) and resets them.
+
+    :param str name: e.g. the dataset class name
+    :param int|None epoch:
+    """
+    if not self.timing_stats:
+      return
+    print("%s: load_seqs timing stats for epoch %r (parallel: %r):" % (name, epoch, self.parallel), file=log.v4)
+    for dataset_key, (num_calls, total_time, max_time) in sorted(
+          self.timing_stats.items(), key=lambda item: -item[1][1]):
+      print("  %s: %i calls, total %.3f sec, avg %.3f sec, max %.3f sec" % (
+        dataset_key, num_calls, total_time, total_time / max(num_calls, 1), max_time), file=log.v4)
+    self.timing_stats.clear()
+
+  def close(self):
+    """
+    Stops the thread pool, if there is one. It will be recreated on demand.
+    """
+    if self._pool is not None:
+      self._pool.close()
+      self._pool.join()
+      self._pool = None
+
+  def __del__(self):
+    self.close()
+
+
 class MetaDataset(CachedDataset2):
   """
   This wraps around one or multiple datasets and might provide extra information.
   Every dataset is expected to provide the the same sequences, where the sequence list
   is given by a file.
+
+  The seq tags are resolved only once at initialization:
+  For each sub dataset which supports it (:class:`CachedDataset`, e.g. HDFDataset),
+  we build an array which maps our seq idx to the real seq idx of the sub dataset.
+  If seq_lens_cache_dir is set, these arrays are also cached on disk.
   """
 
   def __init__(self,
@@ -21,7 +108,7 @@ class MetaDataset(CachedDataset2):
                datasets,
                data_map, data_dims,
                data_dtypes=None,
-               window=1, **kwargs):
+               window=1, parallel_load_seqs=True, **kwargs):
     """
     :param str seq_list_file: filename. line-separated
     :param str seq_lens_file: filename. json. dict[str,dict[str,int]], seq-tag -> data-key -> len
@@ -30,20 +117,23 @@ class MetaDataset(CachedDataset2):
       Should contain 'data' as key. Also defines the target-list, which is all except 'data'.
     :param dict[str,(int,int)] data_dims: self-data-key -> data-dimension, len(shape) (1 ==> sparse repr).
     :param dict[str,str] data_dtypes: self-data-key -> dtype. automatic if not specified
+    :param bool parallel_load_seqs: call load_seqs() on the sub datasets concurrently, one thread per sub dataset
     """
     assert window == 1  # not implemented
     super(MetaDataset, self).__init__(**kwargs)
     assert self.shuffle_frames_of_nseqs == 0  # not implemented. anyway only for non-recurrent nets
 
     self.seq_list_original = open(seq_list_file).read().splitlines()
-    self.tag_idx = {tag: idx for (idx, tag) in enumerate(self.seq_list_original)}
     self._num_seqs = len(self.seq_list_original)
+    # Array-backed tag index, more compact than a dict. See _get_seq_idxs_by_tags().
+    self._seq_tags = self._tags_to_array(self.seq_list_original)
+    self._seq_tags_sort_order = numpy.argsort(self._seq_tags, kind="mergesort")
 
     self.data_map = data_map
     self.dataset_keys = set([m[0] for m in self.data_map.values()]); ":type: set[str]"
     self.data_keys = set(self.data_map.keys()); ":type: set[str]"
     assert "data" in self.data_keys
-    self.target_list = sorted(self.data_keys - ["data"])
+    self.target_list = sorted(self.data_keys - {"data"})
 
     data_dims = convert_data_dims(data_dims)
     self.data_dims = data_dims
@@ -70,30 +160,111 @@ class MetaDataset(CachedDataset2):
 
     # Will only init the needed datasets.
     self.datasets = {key: init_dataset(datasets[key]) for key in self.dataset_keys}
+    self._sub_datasets_loader = _SubDatasetsLoader(num_workers=len(self.datasets), parallel=parallel_load_seqs)
+    # dataset-key -> real seq idx in the sub dataset, for each of our original seq idx
+    self._sub_seq_idxs = {}  # type: dict[str,numpy.ndarray]
+    for key, dataset in sorted(self.datasets.items()):
+      if isinstance(dataset, CachedDataset):
+        self._sub_seq_idxs[key] = self._get_sub_seq_idxs(key, dataset)
+
+  @staticmethod
+  def _tags_to_array(tags):
+    """
+    :param list[str] tags:
+    :rtype: numpy.ndarray
+    """
+    return numpy.array([tag if isinstance(tag, bytes) else tag.encode("utf8") for tag in tags], dtype="S")
+
+  def _get_seq_idxs_by_tags(self, tags):
+    """
+    :param list[str] tags:
+    :return: our original seq idxs, via binary search in the sorted tags
+    :rtype: numpy.ndarray
+    """
+    tags = self._tags_to_array(tags)
+    if not len(tags):
+      return numpy.zeros((0,), dtype="int64")
+    pos = numpy.searchsorted(self._seq_tags, tags, sorter=self._seq_tags_sort_order)
+    idxs = self._seq_tags_sort_order[numpy.minimum(pos, len(self._seq_tags) - 1)]
+    not_found = self._seq_tags[idxs] != tags
+    if not_found.any():
+      raise KeyError("seq tag %r not found in %s" % (tags[numpy.argmax(not_found)], self))
+    return idxs
+
+  def _get_sub_seq_idxs(self, dataset_key, dataset):
+    """
+    :param str dataset_key:
+    :param CachedDataset dataset:
+    :return: for each of our original seq idx, the real seq idx in the sub dataset
+    :rtype: numpy.ndarray
+    """
+    num_seqs = len(self.seq_list_original)
+    cache_fn = self._get_seq_lens_cache_filename(("tag_index", dataset_key), num_seqs, postfix="tag_index")
+    if cache_fn and os.path.exists(cache_fn):
+      try:
+        sub_seq_idxs = numpy.load(cache_fn)
+        if sub_seq_idxs.shape == (num_seqs,):
+          print("%s: use tag index cache file %s" % (self, cache_fn), file=log.v4)
+          return sub_seq_idxs
+      except (IOError, OSError, ValueError) as exc:
+        print("%s: cannot read tag index cache file %s: %s" % (self, cache_fn, exc), file=log.v3)
+    sub_seq_idxs = numpy.array(
+      [dataset._get_real_seq_idx_by_tag(tag) for tag in self.seq_list_original], dtype="int32")
+    if cache_fn:
+      try:
+        if not os.path.exists(self.seq_lens_cache_dir):
+          os.makedirs(self.seq_lens_cache_dir)
+        # Write to a tmp file first, such that other processes never see a partially written file.
+        tmp_fn = "%s.tmp.%i" % (cache_fn, os.getpid())
+        with open(tmp_fn, "wb") as f:
+          numpy.save(f, sub_seq_idxs)
+        os.rename(tmp_fn, cache_fn)
+      except (IOError, OSError) as exc:
+        print("%s: cannot write tag index cache file %s: %s" % (self, cache_fn, exc), file=log.v3)
+    return sub_seq_idxs
 
   def init_seq_order(self, epoch=None, seq_list=None):
     need_reinit = self.epoch is None or self.epoch != epoch
+    if need_reinit:
+      self._sub_datasets_loader.report(name=self.__class__.__name__, epoch=self.epoch)
     super(MetaDataset, self).init_seq_order(epoch=epoch, seq_list=seq_list)
     if not need_reinit:
+      self._num_seqs = len(self.seq_list_ordered)  # was reset by the base class
       return False
 
     if seq_list:
-      seq_index = [self.tag_idx[tag] for tag in seq_list]
+      seq_index = self._get_seq_idxs_by_tags(seq_list)
     else:
       if self._seq_lens:
         get_seq_len = lambda s: self._seq_lens[self.seq_list_original[s]]["data"]
       else:
         get_seq_len = None
-      seq_index = self.get_seq_order_for_epoch(epoch, self.num_seqs, get_seq_len)
+      seq_index = self.get_seq_order_for_epoch(
+        epoch, len(self.seq_list_original), get_seq_len, seq_lens_cache_key="data")
+    seq_index = numpy.asarray(seq_index, dtype="int64")
     self.seq_list_ordered = [self.seq_list_original[s] for s in seq_index]
+    self._num_seqs = len(self.seq_list_ordered)  # was reset by the base class
 
-    for dataset in self.datasets.values():
-      dataset.init_seq_order(epoch=epoch, seq_list=self.seq_list_ordered)
+    for key, dataset in sorted(self.datasets.items()):
+      if key in self._sub_seq_idxs:
+        dataset.init_seq_order_by_real_seq_idxs(epoch=epoch, seq_index=self._sub_seq_idxs[key][seq_index].tolist())
+      else:
+        dataset.init_seq_order(epoch=epoch, seq_list=self.seq_list_ordered)
     return True
 
-  def _load_seqs(self, start, end):
+  def finish_epoch(self):
+    super(MetaDataset, self).finish_epoch()
+    self._sub_datasets_loader.report(name=self.__class__.__name__, epoch=self.epoch)
+    self._sub_datasets_loader.close()
     for dataset in self.datasets.values():
-      dataset.load_seqs(start, end)
+      dataset.finish_epoch()
+
+  def _load_seqs(self, start, end):
+    self._sub_datasets_loader.load_seqs(
+      [(key, dataset, start, end) for (key, dataset) in sorted(self.datasets.items())])
+    for key, dataset in self.datasets.items():
+      if key in self._sub_seq_idxs:
+        continue  # the tags were already resolved via the tag index
       for seq_idx in range(start, end):
         self._check_dataset_seq(dataset, seq_idx)
     super(MetaDataset, self)._load_seqs(start=start, end=end)
@@ -135,6 +306,12 @@ class MetaDataset(CachedDataset2):
   def get_tag(self, sorted_seq_idx):
     return self.seq_list_ordered[sorted_seq_idx]
 
+  def get_all_tags(self):
+    return list(self.seq_list_ordered)
+
+  def supports_seq_list(self):
+    return True
+
   def get_target_list(self):
     return self.target_list
 
@@ -205,6 +382,12 @@ class ClusteringDataset(CachedDataset2):
   def get_tag(self, seq_idx):
     return self.dataset.get_tag(seq_idx)
 
+  def get_all_tags(self):
+    return self.dataset.get_all_tags()
+
+  def supports_seq_list(self):
+    return self.dataset.supports_seq_list()
+
   def _collect_single_seq(self, seq_idx):
     seq_name = self.get_tag(seq_idx)
     #print >> log.v5, "ClusteringDataset: _collect_single_seq: seq_name", seq_name
@@ -258,7 +441,24 @@ class ClusteringDataset(CachedDataset2):
 class ConcatDataset(CachedDataset2):
   """
   This concatenates multiple datasets. They are expected to provide the same data-keys and data-dimensions.
-  It will go through the datasets always in order.
+  With seq_ordering "default", it will go through the datasets always in order.
+
+  With any other seq_ordering (e.g. "random" or "laplace:100"), the order is determined globally
+  over the seqs of all the datasets, i.e. the datasets are interleaved.
+  For that, the sub datasets must know their num_seqs, and their seq order (as of their own seq_ordering)
+  must be the same in every epoch. We then reorder each sub dataset such that
+  its seqs come in the same relative order as in the global order.
+  Thus every sub dataset is still read forward only, and it only needs to load
+  the seqs of the requested range which belong to it.
+
+  Limitations of the global order:
+  A sub dataset which is not a :class:`CachedDataset` is reordered by seq tags via init_seq_order(seq_list=...),
+  thus it must support that (see :func:`Dataset.supports_seq_list`), which we check at initialization.
+  E.g. :class:`LmDataset` or :class:`GeneratingDataset` do not.
+  To get its tags, we use :func:`Dataset.get_all_tags`, which is cheap for some datasets
+  (e.g. :class:`MetaDataset`, :class:`LibriSpeechCorpus`), but a full pass over the data for others.
+  For the "sorted" or "laplace" seq_ordering, we need the seq lens, which is a full pass over the data
+  of such a sub dataset, but only once: they are kept in memory, and also cached on disk (see seq_lens_cache_dir).
   """
 
   def __init__(self, datasets, **kwargs):
@@ -274,6 +474,16 @@ class ConcatDataset(CachedDataset2):
     for ds in self.datasets[1:]:
       assert ds.num_inputs == self.num_inputs
       assert ds.num_outputs == self.num_outputs
+    if self.seq_ordering != "default":
+      for ds in self.datasets:
+        if not isinstance(ds, CachedDataset) and not ds.supports_seq_list():
+          raise Exception(
+            "%s: seq_ordering %r needs to reorder the sub datasets by seq tags, but %s does not support seq_list" % (
+              self, self.seq_ordering, ds))
+    self.dataset_seq_starts = [0]  # dataset-idx -> seq-idx of its first seq, as far as we know
+    self._seq_dataset_idxs = None  # type: numpy.ndarray|None  # seq-idx -> dataset-idx. only for the global order
+    self._seq_sub_seq_idxs = None  # type: numpy.ndarray|None  # seq-idx -> dataset-seq-idx. likewise
+    self._sub_seq_tags_and_lens = {}  # type: dict[int,(list[str],numpy.ndarray)]  # see _get_sub_seq_tags_and_lens
 
   def init_seq_order(self, epoch=None, seq_list=None):
     """
@@ -282,44 +492,149 @@ class ConcatDataset(CachedDataset2):
     """
     need_reinit = self.epoch is None or self.epoch != epoch
     super(ConcatDataset, self).init_seq_order(epoch=epoch, seq_list=seq_list)
-    self.dataset_seq_idx_offsets = [0]
+    self.dataset_seq_starts = [0]
     if not need_reinit:
       return False
+    self._seq_dataset_idxs = None
+    self._seq_sub_seq_idxs = None
 
     if seq_list:  # reference order
       seq_lists = []
       for dataset in self.datasets:
         # This depends on the num_seqs of our childs.
-        seq_lists += seq_list[:dataset.num_seqs]
+        seq_lists.append(seq_list[:dataset.num_seqs])
         seq_list = seq_list[dataset.num_seqs:]
       assert len(seq_list) == 0  # we have consumed all
+    elif self.seq_ordering != "default":
+      self._init_global_seq_order(epoch=epoch)
+      return True
     else:
       seq_lists = [None] * len(self.datasets)
-      if self.seq_ordering != "default":
-        # Not sure about these cases (random / sorted). Maybe a separate implementation makes more sense.
-        raise NotImplementedError("seq_ordering %s" % self.seq_ordering)
 
     assert len(seq_lists) == len(self.datasets)
     for dataset, sub_list in zip(self.datasets, seq_lists):
       dataset.init_seq_order(epoch=epoch, seq_list=sub_list)
     return True
 
+  def _init_global_seq_order(self, epoch):
+    """
+    Determines the seq order over all the sub datasets, and reorders the sub datasets accordingly.
+
+    :param int|None epoch:
+    """
+    need_seq_lens = self.seq_ordering.startswith("sorted") or self.seq_ordering.startswith("laplace")
+    sub_seq_tags = []  # dataset-idx -> list of tags, or None if we can reorder it by seq idx
+    sub_seq_lens = []  # dataset-idx -> seq lens, if needed
+    for dataset_idx, dataset in enumerate(self.datasets):
+      # Init in the canonical order, which defines the (global) original seq idx.
+      if isinstance(dataset, CachedDataset):
+        dataset.init_seq_order_by_real_seq_idxs(epoch=epoch, seq_index=list(range(dataset.num_seqs)))
+      else:
+        dataset.init_seq_order(epoch=epoch)
+      if isinstance(dataset, CachedDataset):
+        sub_seq_tags.append(None)
+        if need_seq_lens:
+          sub_seq_lens.append(numpy.array(
+            [dataset.get_seq_length(i)["data"] for i in range(dataset.num_seqs)], dtype="int64"))
+        continue
+      if not need_seq_lens:
+        sub_seq_tags.append(dataset.get_all_tags())
+        continue
+      tags, seq_lens = self._get_sub_seq_tags_and_lens(dataset_idx)
+      sub_seq_tags.append(tags)
+      sub_seq_lens.append(seq_lens)
+    num_sub_seqs = [
+      dataset.num_seqs if tags is None else len(tags) for (dataset, tags) in zip(self.datasets, sub_seq_tags)]
+    offsets = numpy.cumsum([0] + num_sub_seqs)  # dataset-idx -> global original seq idx of its first seq
+    num_seqs = int(offsets[-1])
+    seq_index = numpy.array(
+      self.get_seq_order_for_epoch(
+        epoch=epoch, num_seqs=num_seqs, get_seq_len=numpy.concatenate(sub_seq_lens) if need_seq_lens else None),
+      dtype="int64")
+    # Binary search over the cumulative offsets.
+    seq_dataset_idxs = numpy.searchsorted(offsets, seq_index, side="right") - 1
+    sub_orig_seq_idxs = seq_index - offsets[seq_dataset_idxs]
+    self._seq_dataset_idxs = seq_dataset_idxs.astype("int32")
+    self._seq_sub_seq_idxs = numpy.zeros((num_seqs,), dtype="int64")
+    self._num_seqs = num_seqs  # was reset by the base class
+    for dataset_idx, dataset in enumerate(self.datasets):
+      mask = self._seq_dataset_idxs == dataset_idx
+      self._seq_sub_seq_idxs[mask] = numpy.arange(num_sub_seqs[dataset_idx])
+      sub_seq_index = sub_orig_seq_idxs[mask]
+      if sub_seq_tags[dataset_idx] is None:
+        dataset.init_seq_order_by_real_seq_idxs(epoch=epoch, seq_index=sub_seq_index.tolist())
+      else:
+        dataset.init_seq_order(epoch=epoch, seq_list=[sub_seq_tags[dataset_idx][i] for i in sub_seq_index])
+
+  def _get_sub_seq_tags_and_lens(self, dataset_idx):
+    """
+    The canonical order of a sub dataset is the same in every epoch, thus we keep the result in memory.
+    The seq lens are also cached on disk, via the seq lens cache of the sub dataset (see seq_lens_cache_dir).
+    Only if neither has them, this is a full pass over the data of the sub dataset.
+
+    :param int dataset_idx: sub dataset which is not a :class:`CachedDataset`, initialized in its canonical order
+    :return: tags, seq lens ("data"), in the canonical order
+    :rtype: (list[str], numpy.ndarray)
+    """
+    if dataset_idx in self._sub_seq_tags_and_lens:
+      return self._sub_seq_tags_and_lens[dataset_idx]
+    dataset = self.datasets[dataset_idx]
+    cache_key = (self.__class__.__name__, "data")
+    seq_lens = dataset._load_seq_lens_cache_file(cache_key, num_seqs=None)
+    tags = dataset.get_all_tags() if seq_lens is not None else None
+    if tags is None or len(tags) != len(seq_lens):
+      tags, seq_lens = [], []
+      i = 0
+      while dataset.is_less_than_num_seqs(i):
+        dataset.load_seqs(i, i + 1)
+        tags.append(dataset.get_tag(i))
+        seq_lens.append(dataset.get_seq_length(i)["data"])
+        i += 1
+      seq_lens = numpy.array(seq_lens, dtype="int64")
+      dataset._save_seq_lens_cache_file(cache_key, num_seqs=None, seq_lens=seq_lens)
+    self._sub_seq_tags_and_lens[dataset_idx] = (tags, seq_lens)
+    return tags, seq_lens
+
   def _get_dataset_for_seq_idx(self, seq_idx):
-    i = 0
-    while i < len(self.dataset_seq_idx_offsets):
-      if seq_idx + self.dataset_seq_idx_offsets[i] < 0:
-        return i - 1
-      i += 1
-    return i - 1
+    """
+    :param int seq_idx:
+    :return: dataset-idx. for the default order, this is only correct for the datasets which we have reached so far
+    :rtype: int
+    """
+    if self._seq_dataset_idxs is not None:
+      return int(self._seq_dataset_idxs[seq_idx])
+    return bisect.bisect_right(self.dataset_seq_starts, seq_idx) - 1
+
+  def _get_sub_seq_idx(self, seq_idx):
+    """
+    :param int seq_idx:
+    :return: (dataset-idx, dataset-seq-idx)
+    :rtype: (int,int)
+    """
+    dataset_idx = self._get_dataset_for_seq_idx(seq_idx)
+    if self._seq_sub_seq_idxs is not None:
+      return dataset_idx, int(self._seq_sub_seq_idxs[seq_idx])
+    return dataset_idx, seq_idx - self.dataset_seq_starts[dataset_idx]
 
   def _load_seqs(self, start, end):
+    if self._seq_dataset_idxs is not None:
+      # In the global order, the seqs of every sub dataset are in increasing order,
+      # so the range of each sub dataset is just from the first to the last of its seqs in our range.
+      end = min(end, len(self._seq_dataset_idxs))
+      seq_dataset_idxs = self._seq_dataset_idxs[start:end]
+      sub_seq_idxs = self._seq_sub_seq_idxs[start:end]
+      for dataset_idx in numpy.unique(seq_dataset_idxs):
+        dataset_sub_seq_idxs = sub_seq_idxs[seq_dataset_idxs == dataset_idx]
+        self.datasets[dataset_idx].load_seqs(int(dataset_sub_seq_idxs[0]), int(dataset_sub_seq_idxs[-1]) + 1)
+      super(ConcatDataset, self)._load_seqs(start=start, end=end)
+      return
     sub_start = start
     # We maybe need to call load_seqs on several of our datasets, thus we need this loop.
     while True:
       dataset_idx = self._get_dataset_for_seq_idx(sub_start)
       dataset = self.datasets[dataset_idx]
-      dataset_seq_idx_start = sub_start + self.dataset_seq_idx_offsets[dataset_idx]
-      dataset_seq_idx_end = end + self.dataset_seq_idx_offsets[dataset_idx]
+      dataset_seq_idx_start = sub_start - self.dataset_seq_starts[dataset_idx]
+      dataset_seq_idx_end = end - self.dataset_seq_starts[dataset_idx]
       dataset.load_seqs(dataset_seq_idx_start, dataset_seq_idx_end)
       if dataset.is_less_than_num_seqs(dataset_seq_idx_end):
         # We are still inside this dataset and have loaded everything.
@@ -330,15 +645,14 @@ class ConcatDataset(CachedDataset2):
         # We are at the last dataset.
         break
       # Continue with the next one.
-      self.dataset_seq_idx_offsets[dataset_idx + 1:dataset_idx + 2] = [
-        self.dataset_seq_idx_offsets[dataset_idx] - dataset.num_seqs]
-      sub_start = -self.dataset_seq_idx_offsets[dataset_idx + 1]
+      self.dataset_seq_starts[dataset_idx + 1:dataset_idx + 2] = [
+        self.dataset_seq_starts[dataset_idx] + dataset.num_seqs]
+      sub_start = self.dataset_seq_starts[dataset_idx + 1]
     super(ConcatDataset, self)._load_seqs(start=start, end=end)
 
   def _collect_single_seq(self, seq_idx):
-    dataset_idx = self._get_dataset_for_seq_idx(seq_idx)
+    dataset_idx, dataset_seq_idx = self._get_sub_seq_idx(seq_idx)
     dataset = self.datasets[dataset_idx]
-    dataset_seq_idx = seq_idx + self.dataset_seq_idx_offsets[dataset_idx]
     seq_tag = dataset.get_tag(dataset_seq_idx)
     features = dataset.get_input_data(dataset_seq_idx)
     targets = {k: dataset.get_targets(k, dataset_seq_idx) for k in dataset.get_target_list()}
@@ -346,12 +660,116 @@ class ConcatDataset(CachedDataset2):
 
   @property
   def num_seqs(self):
+    if self._num_seqs is not None:
+      return self._num_seqs
     return sum([ds.num_seqs for ds in self.datasets])
 
   def get_target_list(self):
     return self.datasets[0].get_target_list()
 
 
+class _WeightedStreamingSampler(object):
+  """
+  Draws (dataset-idx, dataset-seq-idx) pairs for CombinedDataset on demand.
+  The dataset is sampled with probability proportional to weight ** (1 / temperature),
+  and then we take the next seq of that dataset.
+  Datasets which have no more seqs are excluded, and the remaining probabilities are renormalized.
+  The random numbers come from a RNG seeded by the epoch, and are consumed in a fixed sequence
+  (one per draw; if a draw hits an exhausted dataset, it is excluded and we draw again with the next random number),
+  thus the result is deterministic per epoch, no matter in what chunks we sample.
+  Behaves like the list of pairs which we have sampled so far.
+  """
+
+  RandomBufferSize = 1024
+
+  def __init__(self, datasets, weights, temperature, epoch, max_num_seqs=None):
+    """
+    :param list[Dataset] datasets:
+    :param list[float] weights: per dataset
+    :param float temperature: 1 -> as the weights, >1 -> more uniform, <1 -> more peaked
+    :param int|None epoch:
+    :param int|None max_num_seqs: stop after this many seqs. otherwise only when all datasets are exhausted
+    """
+    assert len(datasets) == len(weights) > 0
+    assert temperature > 0
+    self.datasets = datasets
+    self.max_num_seqs = max_num_seqs
+    probs = numpy.array(weights, dtype="float64") ** (1.0 / temperature)
+    assert (probs >= 0).all() and probs.sum() > 0
+    self.probs = probs / probs.sum()
+    self._rnd = numpy.random.RandomState(epoch or 1)
+    self._random_buffer = numpy.zeros((0,))
+    self._random_buffer_pos = 0
+    self._active = [p > 0 for p in self.probs]
+    self._active_idxs = None  # type: list[int]|None  # see _get_active_cum_probs()
+    self._active_cum_probs = None  # type: numpy.ndarray|None
+    self._num_used_seqs = [0] * len(datasets)  # dataset-idx -> next dataset-seq-idx
+    self._dataset_idxs = array.array("i")  # seq-idx -> dataset-idx
+    self._dataset_seq_idxs = array.array("l")  # seq-idx -> dataset-seq-idx
+    self.finished = False
+
+  def _next_random(self):
+    """
+    :rtype: float
+    """
+    if self._random_buffer_pos >= len(self._random_buffer):
+      self._random_buffer = self._rnd.random_sample(self.RandomBufferSize)
+      self._random_buffer_pos = 0
+    self._random_buffer_pos += 1
+    return self._random_buffer[self._random_buffer_pos - 1]
+
+  def _get_active_cum_probs(self):
+    """
+    :return: active dataset idxs, cumulative probs (not normalized)
+    :rtype: (list[int], numpy.ndarray)
+    """
+    if self._active_idxs is None:
+      self._active_idxs = [i for (i, active) in enumerate(self._active) if active]
+      self._active_cum_probs = numpy.cumsum(self.probs[self._active_idxs])
+    return self._active_idxs, self._active_cum_probs
+
+  def sample_more(self, num_seqs):
+    """
+    :param int num_seqs:
+    :return: whether we could sample all of them
+    :rtype: bool
+    """
+    for _ in range(num_seqs):
+      if self.finished:
+        return False
+      if self.max_num_seqs is not None and len(self) >= self.max_num_seqs:
+        self.finished = True
+        return False
+      while True:
+        active_idxs, cum_probs = self._get_active_cum_probs()
+        if not active_idxs:
+          self.finished = True
+          return False
+        r = self._next_random() * cum_probs[-1]
+        dataset_idx = active_idxs[min(numpy.searchsorted(cum_probs, r, side="right"), len(active_idxs) - 1)]
+        if self.datasets[dataset_idx].is_less_than_num_seqs(self._num_used_seqs[dataset_idx]):
+          break
+        # This dataset is exhausted.
+        self._active[dataset_idx] = False
+        self._active_idxs = None
+      self._dataset_idxs.append(dataset_idx)
+      self._dataset_seq_idxs.append(self._num_used_seqs[dataset_idx])
+      self._num_used_seqs[dataset_idx] += 1
+    return True
+
+  def __len__(self):
+    return len(self._dataset_idxs)
+
+  def __getitem__(self, item):
+    """
+    :param int|slice item: seq-idx
+    :rtype: (int,int)|list[(int,int)]
+    """
+    if isinstance(item, slice):
+      return list(zip(self._dataset_idxs[item], self._dataset_seq_idxs[item]))
+    return self._dataset_idxs[item], self._dataset_seq_idxs[item]
+
+
 class CombinedDataset(CachedDataset2):
   """
   This combines multiple different datasets, which provide different data-sources.
@@ -362,19 +780,30 @@ class CombinedDataset(CachedDataset2):
   For each sequence idx, it will select one of the given datasets, fill in the data-keys of this dataset
   and will return empty sequences for the remaining datasets.
   The selection of the dataset will be random and equally distributed, over the sum of num-seqs.
+
+  Alternatively, with sampling_weights or sampling_temperature, the dataset for each seq-idx is sampled
+  on demand (see :class:`_WeightedStreamingSampler`) instead of building the whole mapping for the epoch up front.
   """
 
   def __init__(self,
                datasets,
                data_map, data_dims,
                data_dtypes=None,
-               window=1, **kwargs):
+               window=1, parallel_load_seqs=True,
+               sampling_weights=None, sampling_temperature=None, sampling_num_seqs=None,
+               **kwargs):
     """
     :param dict[str,dict[str]] datasets: dataset-key -> dataset-kwargs. including keyword 'class' and maybe 'files'
     :param dict[(str,str),str] data_map: (dataset-key, dataset-data-key) -> self-data-key.
       Should contain 'data' as key. Also defines the target-list, which is all except 'data'.
     :param dict[str,(int,int)] data_dims: self-data-key -> data-dimension, len(shape) (1 ==> sparse repr).
     :param dict[str,str] data_dtypes: self-data-key -> dtype. automatic if not specified
+    :param bool parallel_load_seqs: call load_seqs() on the sub datasets concurrently, one thread per sub dataset
+    :param dict[str,float]|None sampling_weights: dataset-key -> mixing weight. enables the streaming sampling.
+      if not given but sampling_temperature is, the num seqs (or estimated num seqs) of each dataset are used
+    :param float|None sampling_temperature: probs are proportional to weight ** (1 / temperature). default 1
+    :param int|None sampling_num_seqs: with sampling, the epoch ends after this many seqs,
+      or when all datasets are exhausted
     """
     assert window == 1  # not implemented
     super(CombinedDataset, self).__init__(**kwargs)
@@ -391,7 +820,7 @@ class CombinedDataset(CachedDataset2):
     # Build target lookup table
     target_lookup_table = {}
     for dataset_key in self.dataset_keys:
-      target_lookup_table[dataset_key] = {datamap_maps: datamap_keys[1] for datamap_keys,datamap_maps in data_map.iteritems() if datamap_keys[0]==dataset_key}
+      target_lookup_table[dataset_key] = {datamap_maps: datamap_keys[1] for datamap_keys,datamap_maps in data_map.items() if datamap_keys[0]==dataset_key}
       for key in self.data_keys:
         target_lookup_table[dataset_key].setdefault(key,None)
 
@@ -410,18 +839,42 @@ class CombinedDataset(CachedDataset2):
 
     # Will only init the needed datasets.
     self.datasets = {key: init_dataset(datasets[key]) for key in self.dataset_keys}
+    self._sub_datasets_loader = _SubDatasetsLoader(num_workers=len(self.datasets), parallel=parallel_load_seqs)
 
     try:
       self._num_seqs = sum([self.datasets[k].num_seqs for k in sorted(self.datasets.keys())])
       self.know_num_seqs_beforehand = True
 #      print "Dont need to set estimations for num_seqs. Currently is {s}".format(s=[ds.num_seqs for ds in self.datasets.values()])
     except Exception:
-      self._estimated_num_seqs = sum([self.datasets[k].estimated_num_seqs for k in sorted(self.datasets.keys())])
       self.estimated_num_seq_per_subset = [self.datasets[k].estimated_num_seqs for k in sorted(self.datasets.keys())]
+      if None not in self.estimated_num_seq_per_subset:
+        self._estimated_num_seqs = sum(self.estimated_num_seq_per_subset)
 #      TODO this estimate seems broken on a small test corpus; needs further testing
 #      print "Need to set estimations for num_seqs. Currently is {s}".format(s=[ds.estimated_num_seqs for ds in self.datasets.values()])
       self.know_num_seqs_beforehand = False
 
+    self.sampling = sampling_weights is not None or sampling_temperature is not None
+    if not self.sampling and not self.know_num_seqs_beforehand:
+      assert None not in self.estimated_num_seq_per_subset, (
+        "%s: need the (estimated) num seqs of all sub datasets, got %r" % (self, self.estimated_num_seq_per_subset))
+    self.sampling_temperature = sampling_temperature or 1.0
+    self.sampling_num_seqs = sampling_num_seqs
+    if self.sampling:
+      if sampling_weights is None:
+        sampling_weights = {k: self.datasets[k].estimated_num_seqs for k in self.dataset_keys}
+        for k, weight in sorted(sampling_weights.items()):
+          assert weight is not None, (
+            "%s: sub dataset %r does not know its (estimated) num seqs, which is the default sampling weight. "
+            "Please set sampling_weights." % (self, k))
+      assert set(sampling_weights.keys()) == self.dataset_keys
+      self.sampling_weights = [sampling_weights[self.dataset_idxs[i]] for i in range(len(self.datasets))]
+      if self.know_num_seqs_beforehand:
+        self._estimated_num_seqs = self._num_seqs
+        self._num_seqs = None
+      if sampling_num_seqs is not None:
+        self._estimated_num_seqs = sampling_num_seqs
+      self.know_num_seqs_beforehand = False
+
   def _canonical_seqs_dataset_idxs(self):
     """
     :returns: list of dataset-idx, via self.dataset_idxs, so that we cover the sum of num-seqs
@@ -449,11 +902,21 @@ class CombinedDataset(CachedDataset2):
   def init_seq_order(self, epoch=None, seq_list=None):
     assert seq_list is None, "seq_list not supported for %s" % self.__class__
     need_reinit = self.epoch is None or self.epoch != epoch
+    if need_reinit:
+      self._sub_datasets_loader.report(name=self.__class__.__name__, epoch=self.epoch)
     super(CombinedDataset, self).init_seq_order(epoch=epoch, seq_list=seq_list)
     if not need_reinit:
+      if self.know_num_seqs_beforehand and not self.sampling:
+        self._num_seqs = len(self.dataset_seq_idxs)  # was reset by the base class
       return False
 
-    if self.know_num_seqs_beforehand:
+    if self.sampling:
+      self.dataset_seq_idxs = _WeightedStreamingSampler(
+        datasets=[self.datasets[self.dataset_idxs[i]] for i in range(len(self.datasets))],
+        weights=self.sampling_weights, temperature=self.sampling_temperature,
+        epoch=epoch, max_num_seqs=self.sampling_num_seqs)
+    elif self.know_num_seqs_beforehand:
+      self._num_seqs = sum([self.datasets[k].num_seqs for k in sorted(self.datasets.keys())])  # reset by base class
       # We just select for which seq-idx we will use which dataset.
       # The ordering of the seqs in the datasets will not be set here
       # (do that in the config for the specific dataset).
@@ -479,12 +942,21 @@ class CombinedDataset(CachedDataset2):
       dataset.init_seq_order(epoch=epoch)
     return True
 
+  def finish_epoch(self):
+    super(CombinedDataset, self).finish_epoch()
+    self._sub_datasets_loader.report(name=self.__class__.__name__, epoch=self.epoch)
+    self._sub_datasets_loader.close()
+    for dataset in self.datasets.values():
+      dataset.finish_epoch()
+
   def _expand_dataset_sec_idxs(self, num_values):
     """
 
     :param num_values: int Add num_values entries to the dataset-segment-idx mapping table
     :return:
     """
+    if self.sampling:
+      return self.dataset_seq_idxs.sample_more(num_values)
     for i in range(num_values):
       if self.seq_ordering in ("default", "random"):  # default is random. this is different from base class!
         while True:
@@ -547,13 +1019,15 @@ class CombinedDataset(CachedDataset2):
 
     requested_seqs = self.dataset_seq_idxs[start:end]
 
+    loads = []
     for i in range(len(self.datasets)):
       dataset = self.datasets[self.dataset_idxs[i]]
       sub_requested_seqs = [s[1] for s in requested_seqs if s[0]==i]
       if sub_requested_seqs == []:
         continue
       sub_start, sub_end = min(sub_requested_seqs), max(sub_requested_seqs)
-      dataset.load_seqs(sub_start, sub_end+1)
+      loads.append((self.dataset_idxs[i], dataset, sub_start, sub_end+1))
+    self._sub_datasets_loader.load_seqs(loads)
     super(CombinedDataset, self)._load_seqs(start=start, end=end)
 
   def _check_dataset_seq(self, dataset, seq_idx): # TODO this check makes no sense here
@@ -622,7 +1096,13 @@ class CombinedDataset(CachedDataset2):
 
 class ChunkShuffleDataset(CachedDataset2):
   """
-  This goes through a dataset, caches some recent chunks
+  This goes through a dataset, caches some recent chunks, and returns them in shuffled order.
+
+  The cache is a shuffle buffer with a fixed number of chunk slots (chunk_shuffle_cache).
+  Once it is full, every new chunk replaces a randomly selected slot, and the chunk from that slot is returned next.
+  The slots are preallocated NumPy arrays per data-key, shape (slot, time, ...),
+  where the time dim is the max chunk length so far.
+  Thus this is meant for chunked (e.g. frame-level) data, not for whole seqs of very different lengths.
   """
 
   def __init__(self, dataset,
@@ -632,6 +1112,7 @@ class ChunkShuffleDataset(CachedDataset2):
                **kwargs):
     """
     :param dict[str] dataset: kwargs for init_dataset
+    :param int chunk_shuffle_cache: num of chunk slots in the shuffle buffer. 0 disables the shuffling
     """
     super(ChunkShuffleDataset, self).__init__(**kwargs)
     self.dataset = init_dataset(dataset)
@@ -646,7 +1127,12 @@ class ChunkShuffleDataset(CachedDataset2):
     self.num_outputs = self.dataset.num_outputs
     self.labels = self.dataset.labels
     self.rng = Random(0)
-    self.load_seqs_end = None
+    self.next_seq_idx = None
+    # The shuffle buffer. Allocated on the first chunk, and reused over epochs.
+    self._buffer_data = {}  # type: dict[str,numpy.ndarray]  # data-key -> (slot, time, ...)
+    self._buffer_lens = {}  # type: dict[str,numpy.ndarray]  # data-key -> (slot,) len, -1 if the chunk has no such data
+    self._buffer_tags = [None] * chunk_shuffle_cache  # type: list[str|None]  # slot -> original tag
+    self._buffer_num_filled = 0
 
   def init_seq_order(self, epoch=None, seq_list=None):
     """
@@ -655,8 +1141,9 @@ class ChunkShuffleDataset(CachedDataset2):
     """
     need_reinit = self.epoch is None or self.epoch != epoch
     super(ChunkShuffleDataset, self).init_seq_order(epoch=epoch, seq_list=seq_list)
-    self.load_seqs_end = 0
+    self.next_seq_idx = 0
     self.dataset_last_load_seq_end = 0
+    self._buffer_num_filled = 0
     self.rng.seed(epoch or 1)
     if not need_reinit:
       return False
@@ -674,35 +1161,93 @@ class ChunkShuffleDataset(CachedDataset2):
 
   def _add_data(self, data, original_tag):
     """
+    Adds the next seq which we return.
+
     :type data: dict[str,numpy.ndarray]
     :type original_tag: str
     """
-    features = data["data"]
-    if not self.added_data:
-      seq_idx = 0
-      assert self.expected_load_seq_start == 0
-    else:
-      seq_idx = self.added_data[-1].seq_idx + 1
+    seq_idx = self.next_seq_idx
+    self.next_seq_idx += 1
     tag = "%s.%i" % (original_tag, seq_idx)
-    seq = DatasetSeq(seq_idx=seq_idx, features=features, targets=data, seq_tag=tag)
+    seq = DatasetSeq(seq_idx=seq_idx, features=data, seq_tag=tag)
     self._num_timesteps_accumulated += seq.num_frames
     self.added_data += [seq]
 
-  def _shuffle(self):
-    start_seq_idx = self.added_data[0].seq_idx
-    end_seq_idx = self.added_data[-1].seq_idx
-    assert start_seq_idx < self.load_seqs_end < end_seq_idx
-    start_idx = 0
-    if start_seq_idx < self.load_seqs_end:
-      start_idx = self.load_seqs_end - start_seq_idx
-      assert self.added_data[start_idx].seq_idx == self.load_seqs_end
-      start_seq_idx = self.load_seqs_end
-    sublist = self.added_data[start_idx:]
-    self.rng.shuffle(sublist)
-    for i, seq in enumerate(sublist):
-      seq.seq_idx = i + start_seq_idx
-    assert sublist[-1].seq_idx == end_seq_idx
-    self.added_data[start_idx:] = sublist
+  def _alloc_buffer(self, key, value):
+    """
+    (Re)allocates the buffer of this data-key, such that a chunk like value fits into a slot.
+
+    :param str key:
+    :param numpy.ndarray value: chunk
+    """
+    old = self._buffer_data.get(key)
+    max_len = len(value)
+    if old is not None:
+      assert old.shape[2:] == value.shape[1:] and old.dtype == value.dtype, "%r: chunk shape/dtype changed" % key
+      max_len = max(max_len, old.shape[1] * 2)  # amortized growth
+    buffer = numpy.zeros((self.chunk_shuffle_cache, max_len) + value.shape[1:], dtype=value.dtype)
+    if old is not None:
+      buffer[:, :old.shape[1]] = old
+    else:
+      self._buffer_lens[key] = numpy.full((self.chunk_shuffle_cache,), -1, dtype="int32")
+    self._buffer_data[key] = buffer
+
+  def _set_buffer_slot(self, slot, data, original_tag):
+    """
+    :param int slot:
+    :param dict[str,numpy.ndarray] data: chunk. copied into the slot
+    :param str original_tag:
+    """
+    for key, value in data.items():
+      buffer = self._buffer_data.get(key)
+      if buffer is None or buffer.shape[1] < len(value):
+        self._alloc_buffer(key, value)
+        buffer = self._buffer_data[key]
+      buffer[slot, :len(value)] = value
+      self._buffer_lens[key][slot] = len(value)
+    for key, lens in self._buffer_lens.items():
+      if key not in data:
+        lens[slot] = -1
+    self._buffer_tags[slot] = original_tag
+
+  def _pop_buffer_slot(self, slot):
+    """
+    Adds the chunk of this slot via :func:`_add_data`. The slot can be reused afterwards.
+
+    :param int slot:
+    """
+    data = {key: self._buffer_data[key][slot, :self._buffer_lens[key][slot]].copy()
+            for key in self._buffer_data.keys() if self._buffer_lens[key][slot] >= 0}
+    self._add_data(data=data, original_tag=self._buffer_tags[slot])
+    self._buffer_tags[slot] = None
+
+  def _add_chunk(self, data, original_tag):
+    """
+    Puts the chunk into the shuffle buffer, and maybe gets out another one via :func:`_add_data`.
+
+    :type data: dict[str,numpy.ndarray]
+    :type original_tag: str
+    """
+    if self.chunk_shuffle_cache <= 0:
+      self._add_data(data=data, original_tag=original_tag)
+      return
+    if self._buffer_num_filled < self.chunk_shuffle_cache:
+      slot = self._buffer_num_filled
+      self._buffer_num_filled += 1
+    else:
+      slot = self.rng.randrange(self.chunk_shuffle_cache)
+      self._pop_buffer_slot(slot)
+    self._set_buffer_slot(slot, data=data, original_tag=original_tag)
+
+  def _flush_buffer(self):
+    """
+    At the end of the dataset, gets out all the remaining chunks from the shuffle buffer, in random order.
+    """
+    slots = list(range(self._buffer_num_filled))
+    self.rng.shuffle(slots)
+    for slot in slots:
+      self._pop_buffer_slot(slot)
+    self._buffer_num_filled = 0
 
   def _add_more(self):
     """
@@ -718,7 +1263,7 @@ class ChunkShuffleDataset(CachedDataset2):
         self.dataset.load_seqs(batch.start_seq, batch.end_seq)
         self.dataset_last_load_seq_end = batch.end_seq
 
-      used_data_keys = self.get_data_keys()
+      used_data_keys = self.dataset.get_data_keys()
       for seq in batch.seqs:
         res_data = {}
         for k in used_data_keys:
@@ -726,25 +1271,28 @@ class ChunkShuffleDataset(CachedDataset2):
           if data is not None:
             res_data[k] = data[seq.seq_start_frame[k]:seq.seq_end_frame[k]]
         original_tag = self.dataset.get_tag(seq.seq_idx)
-        self._add_data(data=res_data, original_tag=original_tag)
+        self._add_chunk(data=res_data, original_tag=original_tag)
 
     self.batch_gen.advance(len(batches))
     return True
 
-  def _add_more_until(self, end, shuffle=False):
-    if self.added_data and end <= self.added_data[-1].seq_idx: return True
+  def _add_more_until(self, end):
+    """
+    :param int end: seq idx
+    :returns whether we have added the seq with seq idx end
+    :rtype: bool
+    """
+    if end < self.next_seq_idx: return True
     while self._add_more():
-      assert self.added_data
-      if end <= self.added_data[-1].seq_idx:
-        if shuffle:
-          self._shuffle()
+      if end < self.next_seq_idx:
         return True
-    # We have reached the end.
-    if not self.added_data:
-      self._num_seqs = 0
+    # We have reached the end of the dataset.
+    self._flush_buffer()
+    if end < self.next_seq_idx:
+      return True
+    if self.next_seq_idx == 0:
       print("warning: empty dataset", file=log.v3)
-    else:
-      self._num_seqs = self.added_data[-1].seq_idx + 1
+    self._num_seqs = self.next_seq_idx
     self.reached_final_seq = True
     return False
 
@@ -757,7 +1305,6 @@ class ChunkShuffleDataset(CachedDataset2):
     """
     if self._num_seqs is not None: return seq_idx < self._num_seqs
     if seq_idx < self.expected_load_seq_start: return True
-    if self.added_data and seq_idx <= self.added_data[-1].seq_idx: return True
     return self._add_more_until(seq_idx)
 
   def _load_seqs(self, start, end):
@@ -773,8 +1320,8 @@ class ChunkShuffleDataset(CachedDataset2):
       # Cleanup old data.
       self._cleanup_old_seqs(start)
       self.expected_load_seq_start = start
-    self.load_seqs_end = end
-    self._add_more_until(end + self.chunk_shuffle_cache, shuffle=True)
+    if end > start:
+      self._add_more_until(end - 1)
 
   def _collect_single_seq(self, seq_idx):
     """
@@ -213,7 +213,8 @@ class RawWavDataset(CachedDataset2):
     if seq_list:
       raise NotImplementedError('init_seq_order of RawWavDataset does not support a predefined seq_list yet.')
     else:
-      seq_index = self.get_seq_order_for_epoch(epoch, self.num_seqs, lambda s: self.get_seq_length(s).get('data', None))
+      seq_index = self.get_seq_order_for_epoch(
+        epoch, self.num_seqs, lambda s: self.get_seq_length(s).get('data', None), seq_lens_cache_key='data')
 
     self._seq_index_list = seq_index
     if epoch is not None:
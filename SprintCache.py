@@ -11,7 +11,7 @@ from __future__ import print_function
 import sys
 import os
 import array
-from struct import pack, unpack
+from struct import pack, unpack, unpack_from
 import numpy
 import zlib
 import mmap
@@ -80,6 +80,8 @@ class FileArchive:
 
   # write routines
   def write_str(self, s):
+    if not isinstance(s, bytes):
+      s = s.encode("ascii")
     return self.f.write(pack("%ds" % len(s), s))
 
   def write_char(self, i):
@@ -107,6 +109,7 @@ class FileArchive:
   def __init__(self, filename, must_exists=True):
 
     self.ft = {}  # type: dict[str,FileInfo]
+    self._mmap = None  # type: mmap.mmap|None  # see _get_mmap()
     if os.path.exists(filename):
       self.allophones = []
       self.f = open(filename, 'rb')
@@ -125,10 +128,7 @@ class FileArchive:
       self.write_str(self.SprintCacheHeader)
       self.write_char(1)
 
-    self._short_seg_names = {os.path.basename(n): n for n in self.ft.keys()}
-    if len(self._short_seg_names) < len(self.ft):
-      # We don't have a unique mapping, so we cannot use this.
-      self._short_seg_names.clear()
+    self._short_seg_names = _get_short_seg_names(self.ft.keys())
 
   def __del__(self):
     self.f.close()
@@ -143,14 +143,16 @@ class FileArchive:
     self.f.seek(-8, 2)
     pos_count = self.read_u64()
     self.f.seek(pos_count)
-    count = self.read_u32()
+    # Read the whole table at once and parse it from memory.
+    buf = self.f.read()
+    count, = unpack_from("i", buf, 0)
     if not count > 0: return
+    p = 4
     for i in range(count):
-      l    = self.read_u32()
-      name = self.read_str(l)
-      pos  = self.read_u64()
-      size = self.read_u32()
-      comp = self.read_u32()
+      l, = unpack_from("i", buf, p)
+      name = buf[p + 4:p + 4 + l].decode("ascii")
+      pos, size, comp = unpack_from("=qii", buf, p + 4 + l)
+      p += 4 + l + 16
       self.ft[name] = FileInfo(name, pos, size, comp, i)
       # TODO: read empty files
 
@@ -302,11 +304,8 @@ class FileArchive:
       return None
 
     if comp > 0:
-      # read compressed bytes into memory as 'bytearray'
-      a = array.array('b')
-      a.fromfile(self.f, comp)
-      # unpack
-      b = zlib.decompress(a.tostring(), 15+32)
+      # read compressed bytes into memory and unpack
+      b = zlib.decompress(self.f.read(comp), 15+32)
       # substitute self.f by an anonymous memmap file object
       # restore original file handle after we're done
       backup_f = self.f
@@ -320,6 +319,130 @@ class FileArchive:
 
     return self._raw_read(size=fi.size, typ=typ)
 
+  def _get_mmap(self):
+    """
+    :return: read-only memory map of the whole archive, created lazily
+    :rtype: mmap.mmap
+    """
+    if self._mmap is None:
+      assert "r" in self.f.mode, "archive is opened for writing"
+      self._mmap = mmap.mmap(self.f.fileno(), 0, access=mmap.ACCESS_READ)
+    return self._mmap
+
+  def read_np(self, filename, typ):
+    """
+    Like :func:`read`, but parses the entry via NumPy directly from a memory map of the archive
+    (or from the decompressed bytes), without per-element unpacking.
+
+    :param str filename: the entry-name in the archive
+    :param str typ: "str", "feat", "align" or "align_raw"
+    :return: depending on typ, "str" -> string, "feat" -> (times, data), "align"/"align_raw" -> align,
+      where times is a float64 array of shape (time,2) with (start-time,end-time) in millisecs,
+        data is a float32 array of shape (time,dim),
+      align is an int32 array of shape (time,3) with columns (time, allophone, state) for "align",
+        or of shape (time,2) with columns (time, mix) for "align_raw",
+        where mix is the allophone-state index as stored in the archive (see :func:`getState`).
+    :rtype: str|(numpy.ndarray,numpy.ndarray)|numpy.ndarray|None
+    """
+    if filename not in self.ft:
+      if filename in self._short_seg_names:
+        filename = self._short_seg_names[filename]
+
+    fi = self.ft[filename]
+    buf = self._get_mmap()
+    size, comp, chk = unpack_from("III", buf, fi.pos)
+    if size == 0:
+      return None
+    pos = fi.pos + 12
+    if comp > 0:
+      buf = zlib.decompress(buf[pos:pos + comp], 15+32)
+      pos = 0
+
+    if typ == "str":
+      return buf[pos:pos + fi.size].decode("ascii")
+
+    type_len, = unpack_from("I", buf, pos)
+    pos += 4
+    data_type = buf[pos:pos + type_len].decode("ascii")
+    pos += type_len
+
+    if typ == "feat":
+      assert data_type == "vector-f32"
+      count, = unpack_from("I", buf, pos)
+      pos += 4
+      if count == 0:
+        return numpy.zeros((0, 2), dtype="float64"), numpy.zeros((0, 0), dtype="float32")
+      dim, = unpack_from("I", buf, pos)
+      # Each record: size (u32), data (size x f32), time (2 x f64). We expect the same size for all records.
+      rec_dtype = numpy.dtype([("size", "uint32"), ("data", "float32", (dim,)), ("time", "float64", (2,))])
+      recs = numpy.frombuffer(buf, dtype=rec_dtype, count=count, offset=pos)
+      assert (recs["size"] == dim).all(), "%r: varying feature dimension not supported" % filename
+      return recs["time"].copy(), recs["data"].copy()
+
+    elif typ in ["align", "align_raw"]:
+      assert data_type == "flow-alignment"
+      pos += 4  # flag
+      align_type = buf[pos:pos + 8].decode("ascii")
+      pos += 8
+      if align_type not in ["ALIGNRLE", "AALPHRLE"]:
+        raise Exception("No valid alignment header found (found: %r). Wrong cache?" % align_type)
+      # In case of AALPHRLE, after the alignment, we include the alphabet of the used labels.
+      # We ignore this at the moment.
+      size, = unpack_from("I", buf, pos)
+      pos += 4
+      if size >= (1 << 31):
+        raise NotImplementedError("No support for weighted alignments yet.")
+      # RLE scheme. We loop over the runs, not over the frames.
+      mix_runs = []
+      run_start_times = []
+      run_lens = []
+      time = 0
+      num_frames = 0
+      while num_frames < size:
+        n, = unpack_from("b", buf, pos)
+        pos += 1
+        if n > 0:
+          mix_runs.append(numpy.frombuffer(buf, dtype="int32", count=n, offset=pos))
+          pos += 4 * n
+        elif n < 0:
+          n = -n
+          mix, = unpack_from("i", buf, pos)
+          pos += 4
+          mix_runs.append(numpy.full((n,), mix, dtype="int32"))
+        else:
+          time, = unpack_from("i", buf, pos)
+          pos += 4
+          continue
+        run_start_times.append(time)
+        run_lens.append(n)
+        time += n
+        num_frames += n
+      if not mix_runs:
+        return numpy.zeros((0, 2 if typ == "align_raw" else 3), dtype="int32")
+      mixes = numpy.concatenate(mix_runs)
+      run_lens = numpy.array(run_lens, dtype="int64")
+      run_offsets = numpy.cumsum(run_lens) - run_lens
+      times = (
+        numpy.arange(num_frames, dtype="int64") +
+        numpy.repeat(numpy.array(run_start_times, dtype="int64") - run_offsets, run_lens))
+      if typ == "align_raw":
+        return numpy.stack([times.astype("int32"), mixes], axis=1)
+      # Vectorized variant of getState().
+      assert self.allophones
+      max_states = 6
+      states = numpy.zeros_like(mixes)
+      for state in range(max_states):
+        mask = mixes >= len(self.allophones)
+        if not mask.any():
+          break
+        mixes[mask] -= (1 << 26)
+        states[mask] = min(state + 1, max_states - 1)
+      assert (mixes >= 0).all()
+      return numpy.stack([times.astype("int32"), mixes, states], axis=1)
+
+    else:
+      raise NotImplementedError("typ: %r" % typ)
+
   def getState(self, mix):
     # See src/Tools/Archiver/Archiver.cc:getStateInfo() from Sprint source code.
     assert self.allophones
@@ -389,22 +512,149 @@ class FileArchive:
     self.ft[filename] = FileInfo(filename, pos, size, 0, len(self.ft))
 
 
+def _get_short_seg_names(names):
+  """
+  :param list[str]|typing.Iterable[str] names: content-filenames, e.g. "corpus/recording/1"
+  :return: basename -> name, or empty if the basenames are not unique
+  :rtype: dict[str,str]
+  """
+  names = list(names)
+  short_seg_names = {os.path.basename(n): n for n in names}
+  if len(short_seg_names) < len(names):
+    # We don't have a unique mapping, so we cannot use this.
+    return {}
+  return short_seg_names
+
+
 class FileArchiveBundle():
 
-  def __init__(self, filename):
+  IndexFileVersion = 1
+
+  def __init__(self, filename, num_threads=None, index_file=None):
     """
-    :param str filename: .bundle file 
+    :param str filename: .bundle file
+    :param int|None num_threads: for the initial scan of the archives. None -> number of CPUs (at most 16)
+    :param str|bool|None index_file: the merged content-filename -> archive index is persisted here.
+      None -> "<filename>.index" (sidecar). False -> disabled.
+      If the index is valid (same archives, same mtime and size), we do not scan the archives at startup,
+      and they will be opened lazily on first access.
     """
-    # filename -> FileArchive
-    self.archives = {}  # type: dict[str,FileArchive]
-    # archive content file -> FileArchive
-    self.files = {}  # type: dict[str,FileArchive]
+    self.filename = filename
+    self.archive_filenames = [l for l in open(filename).read().splitlines() if l]
+    # filename -> FileArchive, or None if not yet opened. see _get_archive()
+    self.archives = {}  # type: dict[str,FileArchive|None]
+    # archive content file -> archive filename
+    self.files = {}  # type: dict[str,str]
     self._short_seg_names = {}
-    for l in open(filename).read().splitlines():
-      self.archives[l] = a = FileArchive(l, must_exists=True)
-      for f in a.ft.keys():
-        self.files[f] = a
-      self._short_seg_names.update(a._short_seg_names)
+    self._allophone_file = None
+    if index_file is None:
+      index_file = "%s.index" % filename
+    self.index_file = index_file
+    archive_contents = None
+    if index_file:
+      archive_contents = self._load_index()
+    if archive_contents is None:
+      archive_contents = self._scan_archives(num_threads=num_threads)
+      if index_file:
+        self._save_index(archive_contents)
+    for archive_filename, content_files in archive_contents:
+      self.archives.setdefault(archive_filename, None)
+      for f in content_files:
+        self.files[f] = archive_filename
+      self._short_seg_names.update(_get_short_seg_names(content_files))
+
+  def _scan_archives(self, num_threads=None):
+    """
+    Opens all archives and reads their file info tables, in parallel via a thread pool.
+
+    :param int|None num_threads:
+    :return: list of (archive filename, content-filenames)
+    :rtype: list[(str,list[str])]
+    """
+    if num_threads is None:
+      import multiprocessing
+      num_threads = min(multiprocessing.cpu_count(), 16)
+    num_threads = min(num_threads, len(self.archive_filenames))
+    if num_threads > 1:
+      from multiprocessing.pool import ThreadPool
+      pool = ThreadPool(num_threads)
+      try:
+        archives = pool.map(FileArchive, self.archive_filenames)
+      finally:
+        pool.close()
+        pool.join()
+    else:
+      archives = [FileArchive(fn) for fn in self.archive_filenames]
+    self.archives.update(zip(self.archive_filenames, archives))
+    return [(fn, list(a.ft.keys())) for (fn, a) in zip(self.archive_filenames, archives)]
+
+  @staticmethod
+  def _get_archive_stat(archive_filename):
+    """
+    :param str archive_filename:
+    :return: (mtime, size), to check whether the index is still valid
+    :rtype: (float,int)
+    """
+    st = os.stat(archive_filename)
+    return st.st_mtime, st.st_size
+
+  def _load_index(self):
+    """
+    :return: list of (archive filename, content-filenames), or None if the index does not exist or is outdated
+    :rtype: list[(str,list[str])]|None
+    """
+    import json
+    if not os.path.exists(self.index_file):
+      return None
+    try:
+      with open(self.index_file) as f:
+        index = json.load(f)
+    except (IOError, OSError, ValueError) as exc:
+      print("FileArchiveBundle: cannot load index file %r: %s" % (self.index_file, exc), file=sys.stderr)
+      return None
+    if index.get("version") != self.IndexFileVersion:
+      return None
+    if [a["filename"] for a in index["archives"]] != self.archive_filenames:
+      return None
+    for a in index["archives"]:
+      if not os.path.exists(a["filename"]):
+        return None
+      if list(self._get_archive_stat(a["filename"])) != [a["mtime"], a["size"]]:
+        return None
+    return [(a["filename"], a["files"]) for a in index["archives"]]
+
+  def _save_index(self, archive_contents):
+    """
+    :param list[(str,list[str])] archive_contents:
+    """
+    import json
+    index = {
+      "version": self.IndexFileVersion,
+      "archives": [
+        {"filename": fn, "mtime": self._get_archive_stat(fn)[0], "size": self._get_archive_stat(fn)[1],
+         "files": content_files}
+        for (fn, content_files) in archive_contents]}
+    tmp_filename = "%s.tmp.%i" % (self.index_file, os.getpid())
+    try:
+      with open(tmp_filename, "w") as f:
+        json.dump(index, f)
+      os.rename(tmp_filename, self.index_file)
+    except (IOError, OSError) as exc:
+      print("FileArchiveBundle: cannot write index file %r: %s" % (self.index_file, exc), file=sys.stderr)
+
+  def _get_archive(self, archive_filename):
+    """
+    :param str archive_filename:
+    :return: archive, opened on first access
+    :rtype: FileArchive
+    """
+    a = self.archives[archive_filename]
+    if a is None:
+      a = FileArchive(archive_filename, must_exists=True)
+      if self._allophone_file:
+        a.setAllophones(self._allophone_file)
+      self.archives[archive_filename] = a
+    return a
 
   def file_list(self):
     """
@@ -437,14 +687,28 @@ class FileArchiveBundle():
     if filename not in self.files:
       if filename in self._short_seg_names:
         filename = self._short_seg_names[filename]
-    return self.files[filename].read(filename, typ)
+    return self._get_archive(self.files[filename]).read(filename, typ)
+
+  def read_np(self, filename, typ):
+    """
+    :param str filename: the entry-name in the archive
+    :param str typ: "str", "feat", "align" or "align_raw"
+    :return: see FileArchive.read_np()
+    :rtype: str|(numpy.ndarray,numpy.ndarray)|numpy.ndarray|None
+    """
+    if filename not in self.files:
+      if filename in self._short_seg_names:
+        filename = self._short_seg_names[filename]
+    return self._get_archive(self.files[filename]).read_np(filename, typ)
 
   def setAllophones(self, filename):
     """
-    :param str filename: allophone filename 
+    :param str filename: allophone filename. also used for archives which are opened later
     """
+    self._allophone_file = filename
     for a in self.archives.values():
-      a.setAllophones(filename)
+      if a is not None:
+        a.setAllophones(filename)
 
 
 def open_file_archive(archive_filename, must_exists=True):
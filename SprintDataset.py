@@ -16,6 +16,7 @@ except ImportError:
   import _thread as thread
 from threading import Condition, currentThread, Thread
 import math
+import struct
 import time
 import numpy
 
@@ -462,18 +463,28 @@ class ExternSprintDataset(SprintDatasetBase):
   This class is like SprintDatasetBase, except that we will start an external Sprint instance ourselves
   which will forward the data to us over a pipe.
   The Sprint subprocess will use SprintExternInterface to communicate with us.
+  The features are passed via a shared memory ring buffer (see shmRingBufferSize),
+  and only small descriptors and the targets are pickled over the pipe.
   """
 
-  def __init__(self, sprintTrainerExecPath, sprintConfigStr, partitionEpoch=1, **kwargs):
+  def __init__(self, sprintTrainerExecPath, sprintConfigStr, partitionEpoch=1,
+               shmRingBufferSize=32 * 1024 * 1024, **kwargs):
     """
     :param str|list[str] sprintTrainerExecPath:
     :param str | list[str] | ()->str | list[()->str] | ()->list[str] | ()->list[()->str] sprintConfigStr: via eval_shell_str
+    :param int partitionEpoch:
+    :param int shmRingBufferSize: in bytes. the child writes the features into this shared memory ring buffer.
+      The child blocks if the buffer is full until we have copied the data out of it.
+      0 to disable, i.e. to pickle the features over the pipe.
     """
     super(ExternSprintDataset, self).__init__(**kwargs)
     self.add_data_thread_id = None
     self.sprintTrainerExecPath = sprintTrainerExecPath
     self.sprintConfig = sprintConfigStr
     self.partitionEpoch = partitionEpoch
+    self.shmRingBufferSize = shmRingBufferSize
+    self.ring_buffer = None  # type: mmap.mmap|None
+    self.ring_buffer_fd = None  # type: int|None
     self._num_seqs = None
     self.child_pid = None  # type: int|None
     self.parent_pid = os.getpid()
@@ -513,6 +524,7 @@ class ExternSprintDataset(SprintDatasetBase):
     assert self.child_pid is None
     self.pipe_c2p = self._pipe_open()
     self.pipe_p2c = self._pipe_open()
+    self._ring_buffer_open()
     args = self._build_sprint_args()
     print("ExternSprintDataset: epoch", epoch, "exec", args, file=log.v5)
 
@@ -541,6 +553,9 @@ class ExternSprintDataset(SprintDatasetBase):
     # parent
     self.pipe_c2p[1].close()
     self.pipe_p2c[0].close()
+    if self.ring_buffer_fd is not None:
+      os.close(self.ring_buffer_fd)  # we keep our mmap
+      self.ring_buffer_fd = None
     self.child_pid = pid
 
     try:
@@ -571,6 +586,52 @@ class ExternSprintDataset(SprintDatasetBase):
     writeend = os.fdopen(writeend, "wb", 0)
     return readend, writeend
 
+  def _ring_buffer_open(self):
+    """
+    Creates a new shared memory ring buffer for the child, via an unlinked file (in /dev/shm if possible).
+    The child gets the file descriptor. If this fails, we fall back to pickling the features.
+    """
+    import mmap
+    import tempfile
+    self.ring_buffer = None
+    self.ring_buffer_fd = None
+    if not self.shmRingBufferSize:
+      return
+    fd, filename = tempfile.mkstemp(
+      prefix="crnn-sprint-ring-buffer-", dir="/dev/shm" if os.path.isdir("/dev/shm") else None)
+    try:
+      os.unlink(filename)
+      if hasattr(os, "posix_fallocate"):
+        # Reserve the space now. Otherwise a full tmpfs would cause SIGBUS on access.
+        os.posix_fallocate(fd, 0, self.shmRingBufferSize)
+      else:
+        os.ftruncate(fd, self.shmRingBufferSize)
+      if hasattr(os, "set_inheritable"):
+        os.set_inheritable(fd, True)
+      self.ring_buffer = mmap.mmap(fd, self.shmRingBufferSize)
+    except (IOError, OSError) as exc:
+      print("ExternSprintDataset: cannot create shared memory ring buffer, will pickle the data instead: %s" % exc,
+            file=log.v3)
+      os.close(fd)
+      return
+    self.ring_buffer_fd = fd
+
+  def _ring_buffer_read(self, descriptor):
+    """
+    :param (int,tuple[int],str,int) descriptor: offset, shape, dtype, end pos, as sent by the child
+    :return: copy of the array. the child can reuse the memory afterwards
+    :rtype: numpy.ndarray
+    """
+    offset, shape, dtype, end_pos = descriptor
+    assert self.ring_buffer is not None
+    res = numpy.ndarray(shape=shape, dtype=dtype, buffer=self.ring_buffer, offset=offset).copy()
+    try:
+      # Acknowledge. This frees the memory up to end_pos for the child.
+      self.pipe_p2c[1].write(struct.pack("q", end_pos))
+    except (IOError, OSError):
+      pass  # child has exited. we will see that on the next read
+    return res
+
   @property
   def _my_python_mod_path(self):
     return os.path.dirname(os.path.abspath(__file__))
@@ -580,6 +641,8 @@ class ExternSprintDataset(SprintDatasetBase):
       self.pipe_c2p[1].fileno(), self.pipe_p2c[0].fileno())
     if TaskSystem.SharedMemNumpyConfig["enabled"]:
       config_str += ",EnableAutoNumpySharedMemPickling:True"
+    if self.ring_buffer_fd is not None:
+      config_str += ",ring_buffer_fd:%i,ring_buffer_size:%i" % (self.ring_buffer_fd, self.shmRingBufferSize)
     epoch = self.crnnEpoch or 1
     if isinstance(self.sprintTrainerExecPath, (list, tuple)):
       args = list(self.sprintTrainerExecPath)
@@ -655,6 +718,10 @@ class ExternSprintDataset(SprintDatasetBase):
           if dataType == "data":
             segmentName, features, targets = args
             self.addNewData(numpy_copy_and_set_unused(features), numpy_copy_and_set_unused(targets), segmentName=segmentName)
+          elif dataType == "data_shm":
+            segmentName, features_descriptor, targets = args
+            features = self._ring_buffer_read(features_descriptor)
+            self.addNewData(features, numpy_copy_and_set_unused(targets), segmentName=segmentName)
           elif dataType == "exit":
             haveSeenTheWhole = True
             break
@@ -781,12 +848,11 @@ class SprintCacheDataset(CachedDataset2):
     def _get_feature_dim(self):
       assert self.type == "feat"
       assert self.content_keys
-      times, feats = self.sprint_cache.read(self.content_keys[0], "feat")
+      times, feats = self.sprint_cache.read_np(self.content_keys[0], "feat")
       assert len(times) == len(feats) > 0
-      feat = feats[0]
-      assert isinstance(feat, numpy.ndarray)
-      assert feat.ndim == 1
-      return feat.shape[0]
+      assert isinstance(feats, numpy.ndarray)
+      assert feats.ndim == 2
+      return feats.shape[1]
 
     def read(self, name):
       """
@@ -794,19 +860,21 @@ class SprintCacheDataset(CachedDataset2):
       :return: numpy array of shape (time, [num_labels])
       :rtype: numpy.ndarray
       """
-      res = self.sprint_cache.read(name, typ=self.type)
+      res = self.sprint_cache.read_np(name, typ=self.type)
       if self.type == "align":
-        label_seq = numpy.array([self.allophone_labeling.get_label_idx(a, s) for (t, a, s) in res], dtype=self.dtype)
+        label_seq = numpy.array(
+          [self.allophone_labeling.get_label_idx(a, s) for (a, s) in res[:, 1:].tolist()], dtype=self.dtype)
         assert label_seq.shape == (len(res),)
         return label_seq
       elif self.type == "align_raw":
-        label_seq = numpy.array([self.allophone_labeling.state_tying_by_allo_state_idx[a] for (t, a, s) in res], dtype=self.dtype)
+        label_seq = numpy.array(
+          [self.allophone_labeling.state_tying_by_allo_state_idx[a] for a in res[:, 1].tolist()], dtype=self.dtype)
         assert label_seq.shape == (len(res),)
         return label_seq
       elif self.type == "feat":
-        times, feats = res
-        assert len(times) == len(feats) > 0
-        feat_mat = numpy.array(feats, dtype=self.dtype)
+        times, feat_mat = res
+        assert len(times) == len(feat_mat) > 0
+        feat_mat = feat_mat.astype(self.dtype, copy=False)
         assert feat_mat.shape == (len(times), self.num_labels)
         return feat_mat
       else:
@@ -851,7 +919,8 @@ class SprintCacheDataset(CachedDataset2):
     data0 = self.data["data"]
     assert isinstance(data0, self.SprintCacheReader)
     get_seq_size = lambda s: data0.sprint_cache.ft[self.seq_list_original[s]].size
-    seq_index = self.get_seq_order_for_epoch(epoch, self.num_seqs, get_seq_len=get_seq_size)
+    seq_index = self.get_seq_order_for_epoch(
+      epoch, self.num_seqs, get_seq_len=get_seq_size, seq_lens_cache_key="data")
     self.seq_list_ordered = [self.seq_list_original[s] for s in seq_index]
     return True
 
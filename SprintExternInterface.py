@@ -110,8 +110,11 @@ def _init_global_sprintDataset(inputDim, outputDim, config):
   global sprintDataset
   if sprintDataset: return
   numSegments = len(segmentOrderList) if segmentOrderList is not None else None
+  ring_buffer_fd = int(config["ring_buffer_fd"]) if "ring_buffer_fd" in config else None
+  ring_buffer_size = int(config["ring_buffer_size"]) if "ring_buffer_size" in config else None
   sprintDataset = ExternSprintDatasetSource(c2p_fd=int(config["c2p_fd"]), p2c_fd=int(config["p2c_fd"]),
-                                            inputDim=inputDim, outputDim=outputDim, numSegments=numSegments)
+                                            inputDim=inputDim, outputDim=outputDim, numSegments=numSegments,
+                                            ring_buffer_fd=ring_buffer_fd, ring_buffer_size=ring_buffer_size)
 
 
 def exit():
@@ -196,9 +199,16 @@ class ExternSprintDatasetSource:
   This will send data to ExternSprintDataset over a pipe.
   We expect that we are child process and the parent process has spawned us via ExternSprintDataset
   and is waiting for our data.
+
+  If we get a shared memory ring buffer, the features are written into it,
+  and we only send a small descriptor over the pipe.
+  The parent acknowledges each seq by sending the end position (int64) back over the p2c pipe.
+  If the ring buffer is full, we block until the parent has copied enough data out of it.
   """
 
-  def __init__(self, c2p_fd, p2c_fd, inputDim, outputDim, numSegments):
+  RingBufferAlignment = 64
+
+  def __init__(self, c2p_fd, p2c_fd, inputDim, outputDim, numSegments, ring_buffer_fd=None, ring_buffer_size=None):
     """
     :param int c2p_fd: child-to-parent file descriptor
     :param int p2c_fd: parent-to-child file descriptor
@@ -206,20 +216,87 @@ class ExternSprintDatasetSource:
     :type outputDim: int
     :type numSegments: int | None
     :param numSegments: can be None if not known in advance
+    :param int|None ring_buffer_fd: file descriptor of the shared memory ring buffer
+    :param int|None ring_buffer_size: in bytes
     """
     self.pipe_c2p = os.fdopen(c2p_fd, "wb")
     self.pipe_p2c = os.fdopen(p2c_fd, "rb")
+    self.ring_buffer = None
+    self.ring_buffer_size = ring_buffer_size
+    # Both are absolute byte positions, i.e. they are not wrapped around.
+    self.ring_buffer_write_pos = 0
+    self.ring_buffer_read_pos = 0  # what the parent has acknowledged
+    self._ack_bytes = b""
+    if ring_buffer_fd is not None:
+      import mmap
+      assert ring_buffer_size > 0
+      self.ring_buffer = mmap.mmap(ring_buffer_fd, ring_buffer_size)
+      os.close(ring_buffer_fd)
     self._send("init", (inputDim, outputDim, numSegments))
 
   def _send(self, dataType, args=None):
     Pickler(self.pipe_c2p).dump((dataType, args))
     self.pipe_c2p.flush()
 
+  def _read_acks(self, block):
+    """
+    Reads the acknowledgements of the parent and updates self.ring_buffer_read_pos.
+
+    :param bool block: if True, wait until we got at least one ack. otherwise only read what is available
+    """
+    import select
+    import struct
+    fd = self.pipe_p2c.fileno()
+    while True:
+      if not block:
+        readable, _, _ = select.select([fd], [], [], 0)
+        if not readable:
+          return
+      data = os.read(fd, 4096)
+      if not data:
+        raise EOFError("SprintExternInterface: parent closed the pipe")
+      self._ack_bytes += data
+      num_acks = len(self._ack_bytes) // 8
+      if num_acks:
+        acks = struct.unpack("%iq" % num_acks, self._ack_bytes[:num_acks * 8])
+        self._ack_bytes = self._ack_bytes[num_acks * 8:]
+        self.ring_buffer_read_pos = max(self.ring_buffer_read_pos, max(acks))
+        if block:
+          return
+
+  def _ring_buffer_alloc(self, nbytes):
+    """
+    :param int nbytes: must fit into the ring buffer
+    :return: offset in the ring buffer. blocks until the parent has freed enough memory
+    :rtype: int
+    """
+    size = self.ring_buffer_size
+    align = self.RingBufferAlignment
+    nbytes = (nbytes + align - 1) // align * align
+    assert 0 < nbytes <= size
+    pos = self.ring_buffer_write_pos
+    if pos % size + nbytes > size:
+      pos += size - pos % size  # does not fit at the end, so wrap around
+    end_pos = pos + nbytes
+    self._read_acks(block=False)
+    # We must not overwrite data which the parent has not acknowledged yet.
+    while self.ring_buffer_read_pos < self.ring_buffer_write_pos and end_pos - self.ring_buffer_read_pos > size:
+      self._read_acks(block=True)  # buffer is full, wait for the parent
+    self.ring_buffer_write_pos = end_pos
+    return pos % size
+
   def addNewData(self, segmentName, features, targets):
     """
     :param numpy.ndarray features: 2D array, (feature,time)
     :param dict[str,numpy.ndarray] targets: each target is either 1D (time->idx) or 2D (time,class)
     """
+    if self.ring_buffer is not None and 0 < features.nbytes <= self.ring_buffer_size - self.RingBufferAlignment:
+      import numpy
+      offset = self._ring_buffer_alloc(features.nbytes)
+      numpy.ndarray(shape=features.shape, dtype=features.dtype, buffer=self.ring_buffer, offset=offset)[...] = features
+      descriptor = (offset, features.shape, features.dtype.str, self.ring_buffer_write_pos)
+      self._send("data_shm", (segmentName, descriptor, targets))
+      return
     self._send("data", (segmentName, features, targets))
 
   def close(self):
@@ -117,6 +117,7 @@ It depends on whether the full network is recurrent or not.
 from __future__ import print_function
 
 import sys
+import time
 try:
   # noinspection PyCompatibility
   from Queue import Queue
@@ -826,6 +827,49 @@ class DataProviderBase(object):
     raise NotImplementedError
 
 
+class BatchBuffers(object):
+  """
+  Preallocated numpy arrays per data key, which are reused over the batches.
+  We keep several buffer sets and rotate through them, such that an earlier batch
+  is not overwritten while it is potentially still used somewhere else (e.g. in some queue).
+  The arrays are only reallocated if some batch needs more space than we have.
+  """
+
+  def __init__(self, num_buffer_sets=2):
+    """
+    :param int num_buffer_sets: how many batches can be alive at the same time
+    """
+    assert num_buffer_sets >= 1
+    self.buffer_sets = [{} for _ in range(num_buffer_sets)]  # type: list[dict[str,numpy.ndarray]]
+    self.cur_buffer_set_idx = 0
+
+  def next_buffer_set(self):
+    """
+    Switches to the next buffer set. Call this once per batch.
+    """
+    self.cur_buffer_set_idx = (self.cur_buffer_set_idx + 1) % len(self.buffer_sets)
+
+  def get_zeros(self, key, shape, dtype):
+    """
+    Like numpy.zeros(shape, dtype), but as a view into some buffer of the current buffer set.
+
+    :param str key:
+    :param tuple[int]|list[int] shape:
+    :param str|numpy.dtype dtype:
+    :rtype: numpy.ndarray
+    """
+    shape = tuple(shape)
+    buffers = self.buffer_sets[self.cur_buffer_set_idx]
+    buf = buffers.get(key)
+    if buf is None or buf.dtype != numpy.dtype(dtype) or buf.ndim != len(shape):
+      buf = buffers[key] = numpy.zeros(shape, dtype=dtype)
+    elif any([n > m for (n, m) in zip(shape, buf.shape)]):
+      buf = buffers[key] = numpy.zeros([max(n, m) for (n, m) in zip(shape, buf.shape)], dtype=dtype)
+    v = buf[tuple([slice(0, n) for n in shape])]
+    v.fill(0)
+    return v
+
+
 class FeedDictDataProvider(DataProviderBase):
   """
   This class will fill all the placeholders used for training or forwarding or evaluation etc.
@@ -833,7 +877,8 @@ class FeedDictDataProvider(DataProviderBase):
   It will run a background thread which reads the data from a dataset and puts it into a queue.
   """
 
-  def __init__(self, tf_session, dataset, batches, enforce_min_len1=False, capacity=10, tf_queue=None, **kwargs):
+  def __init__(self, tf_session, dataset, batches, enforce_min_len1=False, capacity=10, tf_queue=None,
+               profile_hook=None, **kwargs):
     """
     :param tf.Session|tf.InteractiveSession tf_session:
     :param Dataset dataset:
@@ -843,6 +888,8 @@ class FeedDictDataProvider(DataProviderBase):
     :param set(str)|None data_keys:
     :param int capacity:
     :param TFDataQueues|None tf_queue:
+    :param ((EngineBatch.Batch,float)->None)|None profile_hook: called with the batch
+      and the time in secs it took to assemble it
     """
     super(FeedDictDataProvider, self).__init__(**kwargs)
     self.tf_session = tf_session
@@ -854,6 +901,15 @@ class FeedDictDataProvider(DataProviderBase):
     self.tf_queue = tf_queue
     if not self.tf_queue:
       self.queue = Queue(maxsize=capacity)
+      # The queue holds references to up to `capacity` batches,
+      # one more is being used by the consumer and one more is being filled by us.
+      self.batch_buffers = BatchBuffers(num_buffer_sets=capacity + 2)
+    else:
+      # The TF queue copies the data in enqueue(), thus double buffering is enough.
+      self.batch_buffers = BatchBuffers(num_buffer_sets=2)
+    self.profile_hook = profile_hook
+    self.num_batches_assembled = 0
+    self.total_batch_assembly_time = 0.0
     self.thread = None  # type: Thread
     self.thread_finished = False
     self.reached_end = False
@@ -877,56 +933,98 @@ class FeedDictDataProvider(DataProviderBase):
     :rtype: (dict[str,numpy.ndarray], dict[str,numpy.ndarray])
     """
     # See EngineUtil.assign_dev_data() for reference.
+    start_time = time.time()
     batch, = self.batches.peek_next_n(1)
     from Dataset import Batch, shapes_for_batches
-    assert isinstance(batch, Batch)
+    from EngineBatch import CompactBatch
+    assert isinstance(batch, (Batch, CompactBatch))
     # In Returnn with Theano, we usually have the shape (time,batch,feature).
     # In TensorFlow, the default is (batch,time,feature).
     # This is also what we use here, i.e. batch_dim_first=True.
     # This must match the Data specification in TFNetwork.ExternData.init_from_config().
     shapes = shapes_for_batches(
       [batch], data_keys=self.data_keys, extern_data=self.extern_data, enforce_min_len1=self.enforce_min_len1)
-    data = {k: numpy.zeros(shape=shapes[k], dtype=self.extern_data.data[k].dtype)
+    buffers = self.batch_buffers
+    buffers.next_buffer_set()
+    data = {k: buffers.get_zeros(key=k, shape=shapes[k], dtype=self.extern_data.data[k].dtype)
             for k in self.data_keys if self.extern_data.data[k].dtype != "string"}
     # Numpy cannot handle "string" dtype. Just make it a list[str], which is what TF can handle.
     data.update({k: [""] * batch.num_slices
                  for k in self.data_keys if self.extern_data.data[k].dtype == "string"})
     data.update({"seq_idx": [-1] * batch.num_slices, "seq_tag": [""] * batch.num_slices})
-    seq_lens = {k: numpy.zeros(shape=(shapes[k][0],), dtype=self.extern_data.data[k].size_dtype)
+    seq_lens = {k: buffers.get_zeros(
+                  key="%s_seq_lens" % k, shape=(shapes[k][0],), dtype=self.extern_data.data[k].size_dtype)
                 for k in self.data_keys if self.extern_data.data[k].have_time_axis()}
     self.dataset.load_seqs(batch.start_seq, batch.end_seq)
-    from Util import slice_pad_zeros
+    seq_idxs, batch_slices = batch.get_seq_idxs_and_batch_slices()
     with self.dataset.lock:
-      for seq in batch.seqs:
-        o = seq.batch_frame_offset
-        q = seq.batch_slice
-        l = seq.frame_length
-        # input-data, input-index will also be set in this loop. That is data-key "data".
-        for k in self.data_keys:
-          # Some special cases first, such as "seq_idx" and "seq_tag".
-          # See also :func:`TFNetwork.get_extern_data`.
-          if k in ["seq_idx", "seq_tag"]:
-            continue  # handled below. will always be added
-          if k in self.extern_data.extra_added_keys:
-            continue
-          if self.extern_data.data[k].have_time_axis():
-            if l.get(k) in [0, None]:
-              continue
-          v = self.dataset.get_data(seq.seq_idx, k)
-          if self.extern_data.data[k].have_time_axis():
-            v = slice_pad_zeros(v, begin=seq.seq_start_frame[k], end=seq.seq_end_frame[k])
-            ls = v.shape[0]
-            if ls != l[k]:
-              raise Exception("got shape[0]: %i, expected: %i, start/end: %r/%r, seq_idx: %i, seq len: %r" % (
-                ls, l[k], seq.seq_start_frame, seq.seq_end_frame, seq.seq_idx, self.dataset.get_seq_length(seq.seq_idx)))
-            data[k][q, o[k]:o[k] + ls] = v
-            seq_lens[k][q] = max(seq_lens[k][q], o[k] + ls)
-          else:  # no time-axis
-            data[k][q] = v
-        data["seq_idx"][q] = seq.seq_idx
-        data["seq_tag"][q] = self.dataset.get_tag(seq.seq_idx)
+      # input-data, input-index will also be set in this loop. That is data-key "data".
+      for k in self.data_keys:
+        # Some special cases first, such as "seq_idx" and "seq_tag".
+        # See also :func:`TFNetwork.get_extern_data`.
+        if k in ["seq_idx", "seq_tag"]:
+          continue  # handled below. will always be added
+        if k in self.extern_data.extra_added_keys:
+          continue
+        if self.extern_data.data[k].have_time_axis():
+          self._gather_time_axis_data(
+            batch=batch, seq_idxs=seq_idxs, batch_slices=batch_slices, key=k, out=data[k], out_seq_lens=seq_lens[k])
+        else:  # no time-axis
+          for seq_idx, q in zip(seq_idxs, batch_slices):
+            data[k][q] = self.dataset.get_data(seq_idx, k)
+      for seq_idx, q in zip(seq_idxs, batch_slices):
+        data["seq_idx"][q] = seq_idx
+        data["seq_tag"][q] = self.dataset.get_tag(seq_idx)
+    elapsed = time.time() - start_time
+    self.num_batches_assembled += 1
+    self.total_batch_assembly_time += elapsed
+    if self.profile_hook:
+      self.profile_hook(batch, elapsed)
     return data, seq_lens
 
+  def _gather_time_axis_data(self, batch, seq_idxs, batch_slices, key, out, out_seq_lens):
+    """
+    Copies the data of all seqs of the batch for the given key into `out`, with a single numpy assignment.
+
+    :param EngineBatch.Batch|EngineBatch.CompactBatch batch:
+    :param list[int] seq_idxs: per part, via batch.get_seq_idxs_and_batch_slices()
+    :param list[int] batch_slices: per part, likewise
+    :param str key:
+    :param numpy.ndarray out: shape (batch,time,...), expected to be zero-initialized
+    :param numpy.ndarray out_seq_lens: shape (batch,), expected to be zero-initialized
+    """
+    from Util import slice_pad_zeros
+    values = []
+    lens = []
+    offsets = []
+    used_batch_slices = []
+    for i, info in enumerate(batch.get_key_frame_infos(key)):
+      if info is None:
+        continue
+      start, l, offset = info
+      v = self.dataset.get_data(seq_idxs[i], key)
+      v = slice_pad_zeros(v, begin=start, end=start + l)
+      if v.shape[0] != l:
+        seq = batch.seqs[i]
+        raise Exception("got shape[0]: %i, expected: %i, start/end: %r/%r, seq_idx: %i, seq len: %r" % (
+          v.shape[0], l, seq.seq_start_frame, seq.seq_end_frame, seq_idxs[i],
+          self.dataset.get_seq_length(seq_idxs[i])))
+      values.append(v)
+      lens.append(l)
+      offsets.append(offset)
+      used_batch_slices.append(batch_slices[i])
+    if not values:
+      return
+    lens = numpy.array(lens, dtype="int64")
+    offsets = numpy.array(offsets, dtype="int64")
+    batch_slices = numpy.array(used_batch_slices, dtype="int64")
+    # For every frame of the concatenated values, the batch idx and the time idx in `out`.
+    concat_starts = numpy.cumsum(lens) - lens
+    batch_idxs = numpy.repeat(batch_slices, lens)
+    time_idxs = numpy.arange(numpy.sum(lens)) + numpy.repeat(offsets - concat_starts, lens)
+    out[batch_idxs, time_idxs] = numpy.concatenate(values, axis=0)
+    numpy.maximum.at(out_seq_lens, batch_slices, offsets + lens)
+
   def get_next_batch(self):
     data, seq_lens = self._get_next_batch()
     enqueue_args = data.copy()
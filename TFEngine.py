@@ -1024,6 +1024,11 @@ class Engine(object):
 
       self.init_train_epoch()
       self.train_epoch()
+      for batches in self.dataset_batches.values():
+        batches.stop()  # the prefetch thread must not run while the datasets are reinitialized
+      self.train_data.finish_epoch()
+      for dataset in self.get_eval_datasets().values():
+        dataset.finish_epoch()
       epoch += 1
 
     if self.start_epoch <= self.final_epoch:  # We did train at least one epoch.
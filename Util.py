@@ -7,6 +7,7 @@ from subprocess import CalledProcessError
 import h5py
 from collections import deque
 import inspect
+import operator
 import os
 import sys
 import shlex
@@ -731,9 +732,12 @@ def slice_pad_zeros(x, begin, end, axis=0):
   :param int axis:
   :return: basically x[begin:end] (with axis==0) but if begin < 0 or end > x.shape[0],
    it will not discard these frames but pad zeros, such that the resulting shape[0] == end - begin.
+   If no padding is needed, this is a view on x, not a copy.
   :rtype: numpy.ndarray
   """
   assert axis == 0, "not yet fully implemented otherwise"
+  if 0 <= begin <= end <= x.shape[axis]:
+    return x[begin:end]
   pad_left, pad_right = 0, 0
   if begin < 0:
     pad_left = -begin
@@ -981,12 +985,40 @@ def load_json(filename=None, content=None):
   return json_content
 
 
-class NumbersDict:
+class _NumbersDictClassOnlyMethod(object):
+  """
+  Like classmethod, but for an instance, it returns a function which raises an exception.
+  We use this for NumbersDict.max, to be sure that we don't confuse it with NumbersDict.max_value.
+  """
+
+  def __init__(self, func, error_msg):
+    self.func = func
+    self.error_msg = error_msg
+
+  def _error(self, *args, **kwargs):
+    raise Exception(self.error_msg)
+
+  def __get__(self, instance, owner):
+    if instance is not None:
+      return self._error
+    return self.func.__get__(owner, type(owner))
+
+
+class NumbersDict(object):
   """
   It's mostly like dict[str,float|int] & some optional broadcast default value.
   It implements the standard math bin ops in a straight-forward way.
+
+  This is used a lot in the batch generation loop (Dataset._generate_batches, Batch),
+  thus it is optimized a bit: we use __slots__ and the bin ops work directly on the underlying dicts.
+  We do not share a key tuple across instances (with the values in a list or array):
+  instances can get new keys (__setitem__), and there are usually only a few keys (e.g. "data" and "classes"),
+  where a dict lookup is not slower than an index lookup, and the key set check would cost extra for every bin op.
+  See demos/demo-batch-generation-benchmark.py.
   """
 
+  __slots__ = ("dict", "value")
+
   def __init__(self, auto_convert=None, numbers_dict=None, broadcast_value=None):
     if auto_convert is not None:
       assert broadcast_value is None
@@ -1005,15 +1037,34 @@ class NumbersDict:
 
     self.dict = numbers_dict
     self.value = broadcast_value
-    self.max = self.__max_error
+
+  @classmethod
+  def _new(cls, numbers_dict, broadcast_value):
+    """
+    Fast path for the constructor, which does not copy numbers_dict.
+
+    :param dict[str] numbers_dict: will be used as-is
+    :param broadcast_value:
+    :rtype: NumbersDict
+    """
+    res = cls.__new__(cls)
+    res.dict = numbers_dict
+    res.value = broadcast_value
+    return res
+
+  def __getstate__(self):
+    return self.dict, self.value
+
+  def __setstate__(self, state):
+    self.dict, self.value = state
 
   def copy(self):
-    return NumbersDict(self)
+    return NumbersDict._new(dict(self.dict), self.value)
 
   def constant_like(self, number):
-    return NumbersDict(
+    return NumbersDict._new(
       broadcast_value=number if (self.value is not None) else None,
-      numbers_dict={k: number for k in self.dict.keys()})
+      numbers_dict={k: number for k in self.dict})
 
   @property
   def keys_set(self):
@@ -1060,12 +1111,9 @@ class NumbersDict:
     return bool(self.dict) or self.value is not None
 
   def unary_op(self, op):
-    res = NumbersDict()
-    if self.value is not None:
-      res.value = op(self.value)
-    for k, v in self.dict.items():
-      res.dict[k] = op(v)
-    return res
+    return NumbersDict._new(
+      numbers_dict={k: op(v) for (k, v) in self.dict.items()},
+      broadcast_value=op(self.value) if self.value is not None else None)
 
   @classmethod
   def bin_op_scalar_optional(cls, self, other, zero, op):
@@ -1079,45 +1127,76 @@ class NumbersDict:
 
   @classmethod
   def bin_op(cls, self, other, op, zero, result=None):
+    """
+    :param NumbersDict|int|float self:
+    :param NumbersDict|int|float other:
+    :param ((object,object)->object) op:
+    :param zero: used in place of a missing value (None), if the other value is not missing
+    :param NumbersDict|None result: if given, will write the result into it (for the inplace ops)
+    :rtype: NumbersDict
+    """
     if not isinstance(self, NumbersDict):
       if isinstance(other, NumbersDict):
         self = other.constant_like(self)
       else:
         self = NumbersDict(self)
-    if not isinstance(other, NumbersDict):
-      other = self.constant_like(other)
+    self_dict, self_value = self.dict, self.value
+    if isinstance(other, NumbersDict):
+      other_dict, other_value = other.dict, other.value
+      res_dict = {}
+      for k, a in self_dict.items():
+        b = other_dict.get(k, other_value)
+        if a is None and b is None:
+          res_dict[k] = None
+        else:
+          res_dict[k] = op(zero if a is None else a, zero if b is None else b)
+      for k, b in other_dict.items():
+        if k in self_dict:
+          continue
+        a = self_value
+        if a is None and b is None:
+          res_dict[k] = None
+        else:
+          res_dict[k] = op(zero if a is None else a, zero if b is None else b)
+    else:
+      # Fast path for a scalar. Same as with other = self.constant_like(other).
+      other_value = other if self_value is not None else None
+      if other is None:
+        res_dict = {k: (None if a is None else op(a, zero)) for (k, a) in self_dict.items()}
+      else:
+        res_dict = {k: op(zero if a is None else a, other) for (k, a) in self_dict.items()}
+    res_value = cls.bin_op_scalar_optional(self_value, other_value, zero=zero, op=op)
     if result is None:
-      result = NumbersDict()
+      return NumbersDict._new(res_dict, res_value)
     assert isinstance(result, NumbersDict)
-    for k in self.keys_set | other.keys_set:
-      result[k] = cls.bin_op_scalar_optional(self.get(k, None), other.get(k, None), zero=zero, op=op)
-    result.value = cls.bin_op_scalar_optional(self.value, other.value, zero=zero, op=op)
+    result.dict.update(res_dict)
+    result.value = res_value
     return result
 
   def __add__(self, other):
-    return self.bin_op(self, other, op=lambda a, b: a + b, zero=0)
+    return self.bin_op(self, other, op=operator.add, zero=0)
 
   __radd__ = __add__
 
   def __iadd__(self, other):
-    return self.bin_op(self, other, op=lambda a, b: a + b, zero=0, result=self)
+    return self.bin_op(self, other, op=operator.add, zero=0, result=self)
 
   def __sub__(self, other):
-    return self.bin_op(self, other, op=lambda a, b: a - b, zero=0)
+    return self.bin_op(self, other, op=operator.sub, zero=0)
 
   def __rsub__(self, other):
     return self.bin_op(self, other, op=lambda a, b: b - a, zero=0)
 
   def __isub__(self, other):
-    return self.bin_op(self, other, op=lambda a, b: a - b, zero=0, result=self)
+    return self.bin_op(self, other, op=operator.sub, zero=0, result=self)
 
   def __mul__(self, other):
-    return self.bin_op(self, other, op=lambda a, b: a * b, zero=1)
+    return self.bin_op(self, other, op=operator.mul, zero=1)
 
   __rmul__ = __mul__
 
   def __imul__(self, other):
-    return self.bin_op(self, other, op=lambda a, b: a * b, zero=1, result=self)
+    return self.bin_op(self, other, op=operator.mul, zero=1, result=self)
 
   def __div__(self, other):
     return self.bin_op(self, other, op=lambda a, b: a / b, zero=1)
@@ -1131,10 +1210,10 @@ class NumbersDict:
   __itruediv__ = __idiv__
 
   def __floordiv__(self, other):
-    return self.bin_op(self, other, op=lambda a, b: a // b, zero=1)
+    return self.bin_op(self, other, op=operator.floordiv, zero=1)
 
   def __ifloordiv__(self, other):
-    return self.bin_op(self, other, op=lambda a, b: a // b, zero=1, result=self)
+    return self.bin_op(self, other, op=operator.floordiv, zero=1, result=self)
 
   def __neg__(self):
     return self.unary_op(op=lambda a: -a)
@@ -1195,25 +1274,22 @@ class NumbersDict:
     return False
 
   @staticmethod
-  def _max(*args):
-    args = [a for a in args if a is not None]
-    if not args:
-      return None
-    if len(args) == 1:
-      return args[0]
-    return max(*args)
+  def _max(a, b):
+    if a is None:
+      return b
+    if b is None:
+      return a
+    return b if b > a else a
 
   @staticmethod
-  def _min(*args):
-    args = [a for a in args if a is not None]
-    if not args:
-      return None
-    if len(args) == 1:
-      return args[0]
-    return min(*args)
-
-  @classmethod
-  def max(cls, items):
+  def _min(a, b):
+    if a is None:
+      return b
+    if b is None:
+      return a
+    return b if b < a else a
+
+  def _max_classmethod(cls, items):
     """
     Element-wise maximum for item in items.
     :param list[NumbersDict|int|float] items:
@@ -1226,6 +1302,9 @@ class NumbersDict:
       return cls.bin_op(items[0], items[1], op=cls._max, zero=None)
     return cls.max([items[0], cls.max(items[1:])])
 
+  # Use max_value for the max of the values of an instance.
+  max = _NumbersDictClassOnlyMethod(_max_classmethod, error_msg="Use max_value instead.")
+
   @classmethod
   def min(cls, items):
     """
@@ -1240,16 +1319,15 @@ class NumbersDict:
       return cls.bin_op(items[0], items[1], op=cls._min, zero=None)
     return cls.min([items[0], cls.min(items[1:])])
 
-  @staticmethod
-  def __max_error():
-    # Will replace self.max for each instance. To be sure that we don't confuse it with self.max_value.
-    raise Exception("Use max_value instead.")
-
   def max_value(self):
     """
     Maximum of our values.
     """
-    return max(self.values())
+    if self.value is None:
+      return max(self.dict.values())
+    if not self.dict:
+      return self.value
+    return max(max(self.dict.values()), self.value)
 
   def __repr__(self):
     if self.value is None and not self.dict:
@@ -0,0 +1,107 @@
+#!/usr/bin/env python3
+
+"""
+Micro-benchmarks for the batch generation loop, i.e. Dataset._generate_batches(),
+which makes heavy use of NumbersDict and EngineBatch.Batch.
+No Theano or TensorFlow computation is involved here.
+
+Usage, e.g.:
+
+  demos/demo-batch-generation-benchmark.py num_seqs=100000 chunking=50:25
+"""
+
+from __future__ import print_function
+
+import sys
+import os
+import time
+import timeit
+from argparse import ArgumentParser
+from pprint import pprint
+
+sys.path += [os.path.dirname(os.path.dirname(os.path.abspath(__file__)))]
+
+import better_exchook
+from Log import log
+from Util import NumbersDict, hms_fraction
+from GeneratingDataset import DummyDataset
+from EngineBatch import CompactBatch
+
+
+# You can play around with these. E.g. use "chunking=0", "max_seqs=20" as command-line args.
+base_settings = {
+  "num_seqs": 20000,  # for the dataset generation
+  "seq_len": 20,
+  "batch_size": 5000,  # upper limit for n_seqs * max_seq_len in a batch
+  "max_seqs": 100,  # upper limit for n_seqs in a batch
+  "chunking": "0",  # e.g. "50:25"
+  "num_numbers_dict_ops": 100000,
+}
+
+
+def benchmark_numbers_dict_ops():
+  """
+  The typical NumbersDict ops as they are used in Dataset.iterate_seqs() and Batch.
+  """
+  num_ops = base_settings["num_numbers_dict_ops"]
+  a = NumbersDict({"data": 17, "classes": 13})
+  b = NumbersDict({"data": 3, "classes": 2})
+  for name, stmt in [
+        ("add", lambda: a + b),
+        ("sub scalar", lambda: a - 5),
+        ("iadd", lambda: NumbersDict(a).__iadd__(b)),
+        ("max", lambda: NumbersDict.max([a, b])),
+        ("min", lambda: NumbersDict.min([a, b, 10])),
+        ("max_value", lambda: a.max_value()),
+        ("constant_like", lambda: a.constant_like(0)),
+        ("any_compare", lambda: a.any_compare(b, (lambda x, y: x > y)))]:
+    runtime = timeit.timeit(stmt, number=num_ops)
+    print("NumbersDict %s: %.3f usec per op" % (name, runtime * 1e6 / num_ops))
+
+
+def benchmark_generate_batches(recurrent_net):
+  """
+  :param bool recurrent_net:
+  :return: runtime in seconds
+  :rtype: float
+  """
+  dataset = DummyDataset(
+    input_dim=2, output_dim=3, num_seqs=base_settings["num_seqs"], seq_len=base_settings["seq_len"],
+    chunking=base_settings["chunking"])
+  dataset.init_seq_order(epoch=1)
+  start_time = time.time()
+  batches = list(dataset._generate_batches(
+    recurrent_net=recurrent_net, batch_size=base_settings["batch_size"], max_seqs=base_settings["max_seqs"]))
+  runtime = time.time() - start_time
+  print("Generate batches, recurrent_net=%r: %i batches, %s" % (recurrent_net, len(batches), hms_fraction(runtime)))
+  start_time = time.time()
+  compact_batches = [CompactBatch.from_batch(batch) for batch in batches]
+  print("Convert to CompactBatch: %s" % hms_fraction(time.time() - start_time))
+  assert len(compact_batches) == len(batches)
+  return runtime
+
+
+def main():
+  print("Benchmarking batch generation.")
+  better_exchook.install()
+  print("Args:", " ".join(sys.argv))
+  arg_parser = ArgumentParser()
+  arg_parser.add_argument("cfg", nargs="*", help="opt=value, opt in %r" % sorted(base_settings.keys()))
+  args = arg_parser.parse_args()
+  for opt in args.cfg:
+    key, value = opt.split("=", 1)
+    assert key in base_settings
+    value_type = type(base_settings[key])
+    base_settings[key] = value_type(value)
+  print("Settings:")
+  pprint(base_settings)
+  log.initialize(verbosity=[3])
+  print("Python:", sys.version.replace("\n", ""), sys.platform)
+
+  benchmark_numbers_dict_ops()
+  benchmark_generate_batches(recurrent_net=True)
+  benchmark_generate_batches(recurrent_net=False)
+
+
+if __name__ == '__main__':
+  main()
@@ -0,0 +1,119 @@
+#!/usr/bin/env python3
+
+"""
+Benchmarks the orthography -> label conversion of LmDataset,
+i.e. the generic code path via parse_orthography() vs. the precompiled LmDataset.OrthToLabelConverter.
+The corpus is randomly generated.
+
+Usage, e.g.:
+
+  demos/demo-lm-orth-converter-benchmark.py num_seqs=100000 word_based=1
+"""
+
+from __future__ import print_function
+
+import sys
+import os
+import time
+import shutil
+import tempfile
+from argparse import ArgumentParser
+from pprint import pprint
+from random import Random
+
+sys.path += [os.path.dirname(os.path.dirname(os.path.abspath(__file__)))]
+
+import better_exchook
+from Log import log
+from Util import hms_fraction
+from LmDataset import LmDataset
+
+
+# You can play around with these. E.g. use "word_based=1", "batch_size=1" as command-line args.
+base_settings = {
+  "num_seqs": 20000,  # for the corpus generation
+  "num_words_per_seq": 20,
+  "vocab_size": 1000,
+  "word_based": 0,
+  "batch_size": 1000,  # num of orths per call to the converter
+}
+
+
+def generate_files(tmp_dir):
+  """
+  :param str tmp_dir:
+  :return: corpus_file, orth_symbols_file
+  :rtype: (str, str)
+  """
+  rnd = Random(42)
+  chars = "abcdefghijklmnopqrstuvwxyz'"
+  vocab = set()
+  while len(vocab) < base_settings["vocab_size"]:
+    vocab.add("".join([rnd.choice(chars) for _ in range(rnd.randint(1, 10))]))
+  vocab = sorted(vocab)
+  corpus_file = os.path.join(tmp_dir, "corpus.txt")
+  with open(corpus_file, "w") as f:
+    for _ in range(base_settings["num_seqs"]):
+      f.write(" ".join([rnd.choice(vocab) for _ in range(base_settings["num_words_per_seq"])]) + "\n")
+  orth_symbols_file = os.path.join(tmp_dir, "orth_symbols.txt")
+  with open(orth_symbols_file, "w") as f:
+    symbols = vocab if base_settings["word_based"] else sorted(chars + " ")
+    f.write("\n".join(["[END]", "[UNKNOWN]"] + symbols) + "\n")
+  return corpus_file, orth_symbols_file
+
+
+def benchmark(corpus_file, orth_symbols_file, use_compiled_orth_converter):
+  """
+  :param str corpus_file:
+  :param str orth_symbols_file:
+  :param bool use_compiled_orth_converter:
+  :return: label seqs
+  :rtype: list[numpy.ndarray]
+  """
+  dataset = LmDataset(
+    corpus_file=corpus_file, orth_symbols_file=orth_symbols_file, word_based=bool(base_settings["word_based"]),
+    use_compiled_orth_converter=use_compiled_orth_converter)
+  dataset.num_unknown = 0
+  batch_size = base_settings["batch_size"]
+  start_time = time.time()
+  res = []
+  for i in range(0, len(dataset.orths), batch_size):
+    res.extend(dataset._orths_to_data(dataset.orths[i:i + batch_size]))
+  runtime = time.time() - start_time
+  print("use_compiled_orth_converter=%r: %i seqs, %s, %.2f usec per seq" % (
+    use_compiled_orth_converter, len(res), hms_fraction(runtime), runtime * 1e6 / max(len(res), 1)))
+  return res
+
+
+def main():
+  print("Benchmarking LmDataset orth -> label conversion.")
+  better_exchook.install()
+  print("Args:", " ".join(sys.argv))
+  arg_parser = ArgumentParser()
+  arg_parser.add_argument("cfg", nargs="*", help="opt=value, opt in %r" % sorted(base_settings.keys()))
+  args = arg_parser.parse_args()
+  for opt in args.cfg:
+    key, value = opt.split("=", 1)
+    assert key in base_settings
+    value_type = type(base_settings[key])
+    base_settings[key] = value_type(value)
+  print("Settings:")
+  pprint(base_settings)
+  log.initialize(verbosity=[3])
+  print("Python:", sys.version.replace("\n", ""), sys.platform)
+
+  tmp_dir = tempfile.mkdtemp()
+  try:
+    corpus_file, orth_symbols_file = generate_files(tmp_dir)
+    ref = benchmark(corpus_file, orth_symbols_file, use_compiled_orth_converter=False)
+    res = benchmark(corpus_file, orth_symbols_file, use_compiled_orth_converter=True)
+    assert len(ref) == len(res)
+    for a, b in zip(ref, res):
+      assert a.tolist() == b.tolist()
+    print("Results are the same.")
+  finally:
+    shutil.rmtree(tmp_dir)
+
+
+if __name__ == '__main__':
+  main()
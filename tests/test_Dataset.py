@@ -305,3 +305,336 @@ def test_task12ax_window():
   assert_equal(list(data2a[1, 1]), list(data1[1]))
   assert_equal(list(data2a[1, 2]), list(data1[2]))
   assert_equal(list(data2a[-1, 2]), [0] * input_dim)  # zero-padded right
+
+
+def test_CachedDataset2_num_workers():
+  from CachedDataset2 import CachedDataset2
+
+  class _RandomCachedDataset2(CachedDataset2):
+    def __init__(self, **kwargs):
+      super(_RandomCachedDataset2, self).__init__(**kwargs)
+      self.num_inputs = 3
+      self.num_outputs = {"data": (3, 2), "classes": (5, 1)}
+      self._total_num_seqs = 11
+
+    def init_seq_order(self, epoch=None, seq_list=None):
+      super(_RandomCachedDataset2, self).init_seq_order(epoch=epoch, seq_list=seq_list)
+      self._num_seqs = self._total_num_seqs
+      return True
+
+    def _collect_single_seq(self, seq_idx):
+      if seq_idx >= self._total_num_seqs:
+        return None
+      rnd = np.random.RandomState(self.epoch * 1000 + seq_idx)
+      seq_len = rnd.randint(1, 10)
+      return DatasetSeq(
+        seq_idx=seq_idx,
+        features=rnd.uniform(-1., 1., (seq_len, 3)).astype("float32"),
+        targets=rnd.randint(0, 5, (seq_len,)).astype("int32"))
+
+  serial = _RandomCachedDataset2()
+  parallel = _RandomCachedDataset2(num_workers=2)
+  for epoch in [1, 2]:
+    for dataset in [serial, parallel]:
+      dataset.init_seq_order(epoch=epoch)
+    seq_idx = 0
+    while parallel.is_less_than_num_seqs(seq_idx):
+      assert_true(serial.is_less_than_num_seqs(seq_idx))
+      serial.load_seqs(seq_idx, seq_idx + 1)
+      parallel.load_seqs(seq_idx, seq_idx + 1)
+      for key in ["data", "classes"]:
+        assert_equal(parallel.get_data(seq_idx, key).tolist(), serial.get_data(seq_idx, key).tolist())
+      seq_idx += 1
+    assert_false(serial.is_less_than_num_seqs(seq_idx))
+    assert_equal(seq_idx, 11)
+    workers = parallel._seq_collector.workers
+    parallel.finish_epoch()
+    assert_equal(parallel._seq_collector, None)
+    assert_false(any([worker.is_alive() for worker in workers]))
+
+
+def test_get_seq_order_for_epoch():
+  from Dataset import Dataset
+  from random import Random
+  seq_lens = [3, 1, 4, 1, 5, 9, 2, 6, 5, 3, 5]
+  num_seqs = len(seq_lens)
+  calls = []
+
+  def get_seq_len(i):
+    calls.append(i)
+    return seq_lens[i]
+
+  dataset = Dataset(seq_ordering="sorted")
+  assert_equal(
+    dataset.get_seq_order_for_epoch(1, num_seqs, get_seq_len),
+    sorted(range(num_seqs), key=seq_lens.__getitem__))
+  dataset.seq_ordering = "sorted_reverse"
+  assert_equal(
+    dataset.get_seq_order_for_epoch(1, num_seqs, np.array(seq_lens)),
+    sorted(range(num_seqs), key=seq_lens.__getitem__, reverse=True))
+  dataset.seq_ordering = "laplace:3"
+  for epoch in [1, 2]:
+    # Reference, as this was implemented via list.sort().
+    ref_index = list(range(num_seqs))
+    Random(epoch).shuffle(ref_index)
+    ref_out = []
+    for i in range(3):
+      part = ref_index[i * num_seqs // 3:(i + 1) * num_seqs // 3]
+      part.sort(key=seq_lens.__getitem__, reverse=(i % 2 == 1))
+      ref_out += part
+    del calls[:]
+    assert_equal(dataset.get_seq_order_for_epoch(epoch, num_seqs, get_seq_len, seq_lens_cache_key="data"), ref_out)
+    assert_equal(len(calls), num_seqs if epoch == 1 else 0)
+
+
+def test_generate_batches_bucketed():
+  from GeneratingDataset import StaticDataset
+  seq_lens = [3, 11, 4, 12, 2, 13, 5, 10, 3, 12, 4, 11]
+  data = [{"data": np.zeros((seq_len, 2), dtype="float32")} for seq_len in seq_lens]
+  for boundaries in [[5], 2]:
+    dataset = StaticDataset(data=data, output_dim={"data": (2, 2)}, bucket_boundaries=boundaries)
+    dataset.init_seq_order(epoch=1)
+    batch_gen = dataset.generate_batches(recurrent_net=True, max_seqs=3, batch_size=100)
+    seq_idxs = []
+    last_start_seq = 0
+    while batch_gen.has_more():
+      batch, = batch_gen.peek_next_n(1)
+      assert_is_instance(batch, Batch)
+      lens = [seq_lens[seq.seq_idx] for seq in batch.seqs]
+      # Either all short or all long seqs.
+      assert_true(max(lens) <= 5 or min(lens) >= 10)
+      assert_true(len(batch.seqs) <= 3)
+      assert_true(batch.start_seq >= last_start_seq)
+      last_start_seq = batch.start_seq
+      seq_idxs.extend([seq.seq_idx for seq in batch.seqs])
+      batch_gen.advance(1)
+    assert_equal(sorted(seq_idxs), list(range(len(seq_lens))))
+
+
+def test_seq_lens_cache_dir():
+  import os
+  import tempfile
+  import shutil
+  from Dataset import Dataset
+  from GeneratingDataset import StaticDataset
+  cache_dir = tempfile.mkdtemp()
+  try:
+    seq_lens = [3, 11, 4, 12, 2, 13, 5, 10]
+    calls = []
+
+    def get_seq_len(i):
+      calls.append(i)
+      return seq_lens[i]
+
+    for _ in range(2):
+      dataset = Dataset(seq_ordering="sorted", seq_lens_cache_dir=cache_dir)
+      seq_order = dataset.get_seq_order_for_epoch(1, len(seq_lens), get_seq_len, seq_lens_cache_key="data")
+      assert_equal(seq_order, list(np.argsort(seq_lens, kind="mergesort")))
+    assert_equal(len(calls), len(seq_lens))  # second dataset instance used the cache file
+    assert_equal(len(os.listdir(cache_dir)), 1)
+
+    data = [{"data": np.zeros((seq_len, 2), dtype="float32")} for seq_len in seq_lens]
+    for _ in range(2):
+      dataset = StaticDataset(
+        data=data, output_dim={"data": (2, 2)}, bucket_boundaries=2, seq_lens_cache_dir=cache_dir)
+      dataset.init_seq_order(epoch=1)
+      batches = list(dataset._generate_batches(recurrent_net=True, max_seqs=3, batch_size=100))
+      assert_equal(sorted([seq.seq_idx for batch in batches for seq in batch.seqs]), list(range(len(seq_lens))))
+    assert_equal(len(os.listdir(cache_dir)), 2)
+    # Different data, different cache file.
+    dataset = StaticDataset(
+      data=data[:-1], output_dim={"data": (2, 2)}, bucket_boundaries=2, seq_lens_cache_dir=cache_dir)
+    dataset.init_seq_order(epoch=1)
+    list(dataset._generate_batches(recurrent_net=True, max_seqs=3, batch_size=100))
+    assert_equal(len(os.listdir(cache_dir)), 3)
+  finally:
+    shutil.rmtree(cache_dir)
+
+
+def test_LmDataset_token_cache_file():
+  import os
+  import tempfile
+  import shutil
+  from LmDataset import LmDataset
+  tmp_dir = tempfile.mkdtemp()
+  try:
+    corpus_file = os.path.join(tmp_dir, "corpus.txt")
+    symbols_file = os.path.join(tmp_dir, "symbols.txt")
+    with open(corpus_file, "w") as f:
+      f.write("hello world\nab\n</s>\nbad!\nworld\n")
+    with open(symbols_file, "w") as f:
+      f.write("\n".join(["[END]", " "] + sorted(set("helloworldab"))) + "\n")
+    opts = dict(corpus_file=corpus_file, orth_symbols_file=symbols_file, error_on_invalid_seq=False)
+    dataset = LmDataset(**opts)
+    dataset.init_seq_order(epoch=1)
+    ref_seqs = []
+    while dataset.is_less_than_num_seqs(len(ref_seqs)):
+      dataset.load_seqs(len(ref_seqs), len(ref_seqs) + 1)
+      ref_seqs.append(dataset.get_data(len(ref_seqs), "data").tolist())
+    assert_equal(len(ref_seqs), 3)
+    for _ in range(2):  # first creates the cache file, second uses it
+      dataset = LmDataset(token_cache_file=os.path.join(tmp_dir, "corpus.tokens"), **opts)
+      assert_equal(dataset._token_offsets.tolist(), [0] + list(np.cumsum([len(seq) for seq in ref_seqs])))
+      dataset.init_seq_order(epoch=1)
+      assert_equal(dataset.num_seqs, len(ref_seqs))
+      dataset.load_seqs(0, dataset.num_seqs)
+      assert_equal([dataset.get_data(i, "data").tolist() for i in range(dataset.num_seqs)], ref_seqs)
+      assert_equal(dataset.get_data(0, "data").dtype, np.dtype(dataset.dtype))
+    # Other options, e.g. no seq end symbol, must not reuse the cache.
+    opts["seq_end_symbol"] = None
+    dataset = LmDataset(token_cache_file=os.path.join(tmp_dir, "corpus.tokens"), **opts)
+    assert_equal(dataset._token_offsets.tolist(), [0] + list(np.cumsum([len(seq) - 1 for seq in ref_seqs])))
+  finally:
+    shutil.rmtree(tmp_dir)
+
+
+def test_OrthToLabelConverter():
+  from LmDataset import OrthToLabelConverter
+  from Util import parse_orthography
+  orths = [
+    "hello world", " (hello)  wörld ", "", "ab [noise] ba", "hello unknown", "hola", "ab\tba"]
+  for word_based in [False, True]:
+    symbols = ["[END]", "[NOISE]", "[UNKNOWN]", " "] + (
+      ["hello", "world", "ab", "ba", "hola"] if word_based else sorted(set("helowrdab")))
+    orth_symbols_map = {sym: i for (i, sym) in enumerate(symbols)}
+    orth_replace_map = {"wörld": ["world"], "ö": ["o"], "hola": ["hello", "world"], "a": ["b", "a"]}
+    parse_orth_opts = {"word_based": word_based}
+    converter = OrthToLabelConverter(
+      orth_symbols_map=orth_symbols_map, orth_replace_map=orth_replace_map, parse_orth_opts=parse_orth_opts)
+    res = converter.convert(orths)
+    assert_equal(len(res), len(orths))
+    num_handled = 0
+    for orth, labels in zip(orths, res):
+      if labels is None:
+        continue
+      num_handled += 1
+      syms = sum([orth_replace_map.get(sym, [sym]) for sym in parse_orthography(orth, **parse_orth_opts)], [])
+      assert_equal(labels.tolist(), [orth_symbols_map[sym] for sym in syms])
+    assert_true(num_handled >= 3)
+    assert_true(res[3] is None)  # special symbol
+
+
+def test_TranslationDataset_packed_data():
+  import os
+  import tempfile
+  import shutil
+  import pickle
+  from LmDataset import TranslationDataset
+  tmp_dir = tempfile.mkdtemp()
+  try:
+    for prefix, lines in [("source", ["a b c", "b", "c a"]), ("target", ["x y", "y y y", "x"])]:
+      with open("%s/%s.train" % (tmp_dir, prefix), "w") as f:
+        f.write("\n".join(lines) + "\n")
+      vocab = {w: i for (i, w) in enumerate(sorted(set(" ".join(lines).split()) | {"</S>"}))}
+      with open("%s/%s.vocab.pkl" % (tmp_dir, prefix), "wb") as f:
+        pickle.dump(vocab, f)
+    opts = dict(path=tmp_dir, file_postfix="train", target_postfix=" </S>")
+
+    def get_seqs(dataset):
+      dataset.init_seq_order(epoch=1)
+      dataset.load_seqs(0, dataset.num_seqs)
+      return [
+        (dataset.get_data(i, "data").tolist(), dataset.get_data(i, "classes").tolist())
+        for i in range(dataset.num_seqs)]
+
+    ref_seqs = get_seqs(TranslationDataset(**opts))
+    assert_equal(len(ref_seqs), 3)
+    for _ in range(2):  # first creates the packed data, second uses it
+      dataset = TranslationDataset(use_packed_data=True, **opts)
+      assert_equal(get_seqs(dataset), ref_seqs)
+      assert_equal(dataset.get_data(0, "data").dtype, np.dtype("int32"))
+    assert_true(os.path.exists("%s/target.train.packed.json" % tmp_dir))
+    # The seq lens cache must become invalid when the data changes.
+    assert_equal(
+      sorted([os.path.basename(fn) for fn in dataset._get_seq_lens_cache_input_files()]),
+      ["source.train", "source.vocab.pkl", "target.train", "target.vocab.pkl"])
+  finally:
+    shutil.rmtree(tmp_dir)
+
+
+def test_CompactBatch():
+  from EngineBatch import CompactBatch
+  dataset = DummyDataset(input_dim=2, output_dim=3, num_seqs=5, seq_len=7)
+  dataset.init_seq_order(1)
+  dataset.chunk_size = 3
+  dataset.chunk_step = 2
+  batch_gen = dataset.generate_batches(recurrent_net=True, max_seqs=4, batch_size=20)
+  while batch_gen.has_more():
+    batch, = batch_gen.peek_next_n(1)
+    batch_gen.advance(1)
+    compact = CompactBatch.from_batch(batch)
+    assert_is_instance(compact, CompactBatch)
+    assert_equal(compact.start_seq, batch.start_seq)
+    assert_equal(compact.end_seq, batch.end_seq)
+    assert_equal(compact.num_slices, batch.num_slices)
+    assert_equal(compact.get_all_slices_num_frames(), batch.get_all_slices_num_frames())
+    assert_equal(len(compact.seqs), len(batch.seqs))
+    for seq, compact_seq in zip(batch.seqs, compact.seqs):
+      assert_equal(compact_seq.seq_idx, seq.seq_idx)
+      assert_equal(compact_seq.batch_slice, seq.batch_slice)
+      for attrib in ["seq_start_frame", "seq_end_frame", "batch_frame_offset"]:
+        assert_equal(getattr(compact_seq, attrib).dict, getattr(seq, attrib).dict)
+        assert_equal(getattr(compact_seq, attrib).value, getattr(seq, attrib).value)
+    lens, valid = compact.get_frame_lengths("data")
+    assert_true(all(valid))
+    assert_equal(lens.tolist(), [seq.frame_length["data"] for seq in batch.seqs])
+    assert_equal(compact.get_seq_idxs_and_batch_slices(), batch.get_seq_idxs_and_batch_slices())
+    for key in ["data", "classes", "unknown"]:
+      assert_equal(compact.get_key_frame_infos(key), batch.get_key_frame_infos(key))
+
+
+def test_generate_batches_prefetch():
+  def get_batches(prefetch_num_batches):
+    dataset = DummyDataset(input_dim=2, output_dim=3, num_seqs=20, seq_len=4)
+    dataset.init_seq_order(1)
+    batch_gen = dataset.generate_batches(
+      recurrent_net=True, max_seqs=3, batch_size=10, prefetch_num_batches=prefetch_num_batches)
+    if prefetch_num_batches:
+      assert batch_gen.prefetch_thread
+    res = []
+    last_frac = 0.
+    while batch_gen.has_more():
+      batch, = batch_gen.peek_next_n(1)
+      dataset.load_seqs(batch.start_seq, batch.end_seq)
+      res.append([(seq.seq_idx, seq.seq_start_frame["data"], seq.seq_end_frame["data"]) for seq in batch.seqs])
+      batch_gen.advance(1)
+      frac = batch_gen.completed_frac()
+      assert_true(last_frac <= frac <= 1.)
+      last_frac = frac
+    if prefetch_num_batches:
+      assert_false(batch_gen.prefetch_thread.thread.is_alive())  # joined at the end
+    return res
+
+  assert_equal(get_batches(prefetch_num_batches=0), get_batches(prefetch_num_batches=2))
+
+
+def test_generate_batches_prefetch_stop_and_exception():
+  import traceback
+  from EngineBatch import BatchSetGenerator
+
+  def generator():
+    dataset = DummyDataset(input_dim=2, output_dim=3, num_seqs=20, seq_len=4)
+    dataset.init_seq_order(1)
+    for i, batch in enumerate(dataset._generate_batches(recurrent_net=True, max_seqs=3, batch_size=10)):
+      if i == 2:
+        raise ValueError("generator failure")
+      yield batch
+
+  dataset = DummyDataset(input_dim=2, output_dim=3, num_seqs=20, seq_len=4)
+  batch_gen = BatchSetGenerator(dataset=dataset, generator=generator(), prefetch_num_batches=1)
+  try:
+    while batch_gen.has_more():
+      batch_gen.advance(1)
+  except ValueError:
+    tb = traceback.extract_tb(sys.exc_info()[2])
+    assert_in("generator", [frame[2] for frame in tb])  # the traceback of the worker
+  else:
+    assert False, "ValueError expected"
+  batch_gen.stop()
+  assert_false(batch_gen.prefetch_thread.thread.is_alive())
+
+  dataset.init_seq_order(1)
+  batch_gen = dataset.generate_batches(recurrent_net=True, max_seqs=3, batch_size=10, prefetch_num_batches=1)
+  batch_gen.advance(1)
+  batch_gen.stop()
+  assert_false(batch_gen.prefetch_thread.thread.is_alive())
@@ -78,3 +78,114 @@ def test_StaticDataset_custom_keys_with_dims():
   dataset.load_seqs(0, 1)
   assert_equal(list(dataset.get_data(0, "source")), [1, 2, 3])
   assert_equal(list(dataset.get_data(0, "target")), [3, 4, 5, 6, 7])
+
+
+def test_BytePairEncoding():
+  import tempfile
+  import shutil
+  tmp_dir = tempfile.mkdtemp()
+  try:
+    bpe_file = os.path.join(tmp_dir, "bpe.codes")
+    with open(bpe_file, "w") as f:
+      f.write("#version: 0.2\na b\nab a\nc d</w>\na b</w>\n")
+    vocab_file = os.path.join(tmp_dir, "bpe.vocab")
+    labels = ["UNK", "aba", "ab@@", "a@@", "b", "cd", "c@@", "d", "ab", "a", "aba@@"]
+    with open(vocab_file, "w") as f:
+      f.write(repr({label: i for (i, label) in enumerate(labels)}))
+    bpe = BytePairEncoding(vocab_file=vocab_file, bpe_file=bpe_file, encode_cache_size=2)
+    # All occurrences of (a, b) first, and only then (ab, a).
+    assert_equal(bpe._merge_word(("a", "b", "a", "b", "a", "b</w>")), ("ab", "aba", "b</w>"))
+    assert_equal(bpe._segment_sentence("abab cd a"), ["aba@@", "b", "cd", "a"])
+    sentences = ["abab cd a", "cd abab", "x"]
+    assert_equal(bpe.get_seqs(sentences), [bpe.get_seq(s) for s in sentences])
+    assert_equal(bpe.get_seq("x"), [labels.index("UNK")])
+    assert_true(len(bpe._bpe_encode_cache) <= 2)
+    bpe2 = BytePairEncoding(vocab_file=vocab_file, bpe_file=bpe_file)
+    assert_true(bpe2._bpe_encode_cache is bpe._bpe_encode_cache)
+  finally:
+    shutil.rmtree(tmp_dir)
+
+
+def test_ExtractAudioFeatures_feature_cache_dir():
+  import tempfile
+  import shutil
+
+  class DummyExtractAudioFeatures(ExtractAudioFeatures):
+    # Does not need librosa.
+    def _get_audio_features_unnormalized(self, audio, sample_rate):
+      return audio.reshape((-1, self.get_feature_dimension())).astype("float32")
+
+  tmp_dir = tempfile.mkdtemp()
+  try:
+    num_loads = [0]
+
+    def load_audio():
+      num_loads[0] += 1
+      return np.arange(12, dtype="float32"), 16000
+
+    for _ in range(2):
+      extractor = DummyExtractAudioFeatures(
+        num_feature_filters=3, norm_mean=np.ones((3,), dtype="float32"), feature_cache_dir=tmp_dir)
+      features = extractor.get_audio_features_cached(seq_tag="seq-1", load_audio=load_audio, namespace="test")
+      assert_equal(features.tolist(), (np.arange(12).reshape((4, 3)) - 1).tolist())
+    assert_equal(num_loads[0], 1)
+    # Other feature options, thus not cached.
+    extractor = DummyExtractAudioFeatures(num_feature_filters=4, feature_cache_dir=tmp_dir)
+    assert_equal(extractor.get_audio_features_cached(seq_tag="seq-1", load_audio=load_audio).shape, (3, 4))
+    assert_equal(num_loads[0], 2)
+  finally:
+    shutil.rmtree(tmp_dir)
+
+
+def test_ExtractAudioFeatures_numpy_backend():
+  rnd = np.random.RandomState(42)
+  audios = [rnd.uniform(-1., 1., size=(8000 + 123 * i,)) for i in range(3)]
+  for features in ["mfcc", "log_mel_filterbank", "log_log_mel_filterbank"]:
+    extractor = ExtractAudioFeatures(
+      features=features, num_feature_filters=20, with_delta=1, backend="numpy",
+      norm_mean=np.full((40,), 0.5, dtype="float32"), norm_std_dev=np.full((40,), 2., dtype="float32"))
+    batch = extractor.get_audio_features_batch([audio.copy() for audio in audios], sample_rate=16000)
+    assert_equal(len(batch), len(audios))
+    for audio, features_batch in zip(audios, batch):
+      features_single = extractor.get_audio_features(audio.copy(), sample_rate=16000)
+      assert_equal(features_single.shape, (1 + len(audio) // 160, 40))
+      assert_equal(features_single.dtype, np.float32)
+      assert_true(np.allclose(features_batch, features_single, atol=1e-4))
+
+
+def test_get_dct_matrix():
+  import scipy.fftpack
+  from GeneratingDataset import _get_dct_matrix
+  x = np.random.RandomState(42).normal(size=(16, 3))
+  assert_true(np.allclose(
+    np.dot(_get_dct_matrix(num_input=16, num_output=5), x),
+    scipy.fftpack.dct(x, type=2, norm="ortho", axis=0)[:5]))
+
+
+def test_open_zip_member():
+  import tempfile
+  import shutil
+  import zipfile
+  import mmap
+  from GeneratingDataset import open_zip_member, _MemoryViewFile
+  from Util import PY3
+  tmp_dir = tempfile.mkdtemp()
+  try:
+    zip_fn = os.path.join(tmp_dir, "test.zip")
+    contents = {"stored.bin": os.urandom(1000), "deflated.bin": b"abc" * 1000}
+    with zipfile.ZipFile(zip_fn, "w") as zip_file:
+      zip_file.writestr("stored.bin", contents["stored.bin"], compress_type=zipfile.ZIP_STORED)
+      zip_file.writestr("deflated.bin", contents["deflated.bin"], compress_type=zipfile.ZIP_DEFLATED)
+    with open(zip_fn, "rb") as f:
+      zip_mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+      zip_file = zipfile.ZipFile(f)
+      for name, content in contents.items():
+        member = open_zip_member(zip_file, name, zip_mmap=zip_mmap)
+        assert_equal(isinstance(member, _MemoryViewFile), PY3 and name == "stored.bin")  # zero-copy only on Py3
+        assert_equal(member.read(), content)
+        member.seek(10)
+        assert_equal(member.read(5), content[10:15])
+        member.seek(-3, os.SEEK_END)
+        assert_equal(member.read(), content[-3:])
+  finally:
+    shutil.rmtree(tmp_dir)
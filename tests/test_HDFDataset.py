@@ -2,12 +2,15 @@
 import sys
 sys.path += ["."]  # Python 3 hack
 
-from HDFDataset import HDFDataset
+from HDFDataset import HDFDataset, HDFSeqIndex
 from nose.tools import assert_equal
 from nose.tools import assert_not_equal
 from nose.tools import assert_raises
 from nose.tools import raises
 import os
+from Log import log
+
+log.initialize()
 
 
 class TestHDFDataset(object):
@@ -54,3 +57,97 @@ class TestHDFDataset(object):
     toy_dataset = self.test_init()
     # TODO: auto-generate file, then use here
     #toy_dataset.add_file("/u/kulikov/develop/crnn/tests/toy_set.hdf")
+
+
+def generate_hdf_from_dummy(num_seqs=4, seq_len=3):
+  """
+  Creates a HDF file in the format as expected by HDFDataset, like tools/hdf_dump.py,
+  with the same content as DummyDataset.
+
+  :param int num_seqs:
+  :param int seq_len:
+  :return: filename of the created HDF file
+  :rtype: str
+  """
+  import tempfile
+  import h5py
+  import numpy
+  from GeneratingDataset import DummyDataset
+  dataset = DummyDataset(input_dim=2, output_dim=3, num_seqs=num_seqs, seq_len=seq_len)
+  dataset.init_seq_order(epoch=1)
+  dataset.load_seqs(0, num_seqs)
+  hdf_filename = tempfile.mktemp(suffix=".hdf", prefix="nose-hdf-dataset")
+  f = h5py.File(hdf_filename, "w")
+  f.create_dataset("seqTags", data=numpy.array([dataset.get_tag(i) for i in range(num_seqs)], dtype="S"))
+  f.create_dataset("seqLengths", data=numpy.array([[seq_len, seq_len]] * num_seqs, dtype="int32"))
+  f.create_dataset("inputs", data=numpy.concatenate([dataset.get_data(i, "data") for i in range(num_seqs)]))
+  f.create_dataset(
+    "targets/data/classes", data=numpy.concatenate([dataset.get_data(i, "classes") for i in range(num_seqs)]))
+  f.create_group("targets/size").attrs["classes"] = dataset.num_outputs["classes"][0]
+  f.create_dataset("targets/labels/classes", data=numpy.array(["a", "b", "c"], dtype="S"))
+  f.attrs["inputPattSize"] = dataset.num_inputs
+  f.attrs["numLabels"] = dataset.num_outputs["classes"][0]
+  f.close()
+  return hdf_filename
+
+
+def test_hdf_seq_index():
+  hdf_filename = generate_hdf_from_dummy(num_seqs=4, seq_len=3)
+  dataset = HDFDataset()
+  dataset.add_file(hdf_filename)
+  dataset.add_file(hdf_filename)
+  dataset.initialize()
+  assert_equal(dataset.num_seqs, 8)
+  assert_equal(dataset.file_start, [0, 4, 8])
+  assert_equal(dataset.get_num_timesteps(), 8 * 3)
+  assert_equal(dataset.get_tag(5), "seq-1")
+  assert_equal(dataset._get_real_seq_idx_by_tag("seq-3"), 7)  # the tags are there twice, the last one wins
+  assert_equal(list(dataset._get_file_index([0, 3, 4, 7])), [0, 0, 1, 1])
+  dataset.load_seqs(0, 8)
+  assert_equal(dataset.get_data(5, "data").shape, (3, 2))
+  assert_equal(dataset.get_data(5, "data").tolist(), dataset.get_data(1, "data").tolist())
+  os.remove(hdf_filename)
+
+
+def test_hdf_seq_index_cache_file():
+  hdf_filename = generate_hdf_from_dummy(num_seqs=5, seq_len=2)
+  dataset1 = HDFDataset(use_seq_index_cache=True)
+  dataset1.add_file(hdf_filename)
+  cache_filename = "%s.seq_index.tags.npy" % hdf_filename
+  assert os.path.exists(cache_filename)
+  dataset2 = HDFDataset(use_seq_index_cache=True)
+  dataset2.add_file(hdf_filename)
+  assert_equal(dataset1._seq_lengths.tolist(), dataset2._seq_lengths.tolist())
+  dataset2.initialize()
+  dataset2.init_seq_order(epoch=1, seq_list=["seq-4", "seq-0", "seq-3", "seq-1", "seq-2"])
+  assert_equal(dataset2.num_seqs, 5)
+  assert_equal(dataset2.get_tag(0), "seq-4")
+  assert_equal(dataset2.get_tag(1), "seq-0")
+  for name in HDFSeqIndex.cache_file_names:
+    os.remove("%s.seq_index.%s.npy" % (hdf_filename, name))
+  os.remove(hdf_filename)
+
+
+def test_hdf_load_seqs_file_handles():
+  from GeneratingDataset import DummyDataset
+  hdf_filename1 = generate_hdf_from_dummy(num_seqs=5, seq_len=3)
+  hdf_filename2 = generate_hdf_from_dummy(num_seqs=3, seq_len=3)
+  dummy = DummyDataset(input_dim=2, output_dim=3, num_seqs=5, seq_len=3)
+  dummy.init_seq_order(epoch=1)
+  dummy.load_seqs(0, 5)
+  dataset = HDFDataset(max_open_files=1, seq_ordering="random")
+  dataset.add_file(hdf_filename1)
+  dataset.add_file(hdf_filename2)
+  dataset.initialize()
+  dataset.init_seq_order(epoch=3)
+  dataset.load_seqs(0, 8)
+  assert_equal(len(dataset._file_handles), 1)
+  for seq_idx in range(8):
+    tag = dataset.get_tag(seq_idx)
+    dummy_seq_idx = int(tag[len("seq-"):])
+    assert_equal(dataset.get_data(seq_idx, "data").tolist(), dummy.get_data(dummy_seq_idx, "data").tolist())
+    assert_equal(dataset.get_data(seq_idx, "classes").tolist(), dummy.get_data(dummy_seq_idx, "classes").tolist())
+  dataset.finish_epoch()  # closes the files
+  assert_equal(len(dataset._file_handles), 0)
+  os.remove(hdf_filename1)
+  os.remove(hdf_filename2)
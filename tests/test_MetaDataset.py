@@ -0,0 +1,287 @@
+import sys
+sys.path += ["."]  # Python 3 hack
+
+from nose.tools import assert_equal, assert_in, assert_true
+import os
+import tempfile
+from MetaDataset import MetaDataset, CombinedDataset, ConcatDataset
+from test_HDFDataset import generate_hdf_from_dummy
+from Log import log
+import better_exchook
+better_exchook.install()
+better_exchook.replace_traceback_format_tb()
+
+log.initialize()
+
+
+def _load_all(dataset, epoch=1):
+  """
+  :param Dataset.Dataset dataset:
+  :param int epoch:
+  :return: list of (tag, data per key)
+  :rtype: list[(str,dict[str,list])]
+  """
+  dataset.init_seq_order(epoch=epoch)
+  res = []
+  seq_idx = 0
+  while dataset.is_less_than_num_seqs(seq_idx):
+    dataset.load_seqs(seq_idx, seq_idx + 1)
+    res.append((
+      dataset.get_tag(seq_idx),
+      {key: dataset.get_data(seq_idx, key).tolist() for key in dataset.get_data_keys()}))
+    seq_idx += 1
+  return res
+
+
+def test_MetaDataset_parallel_load_seqs():
+  hdf_filename1 = generate_hdf_from_dummy(num_seqs=5, seq_len=3)
+  hdf_filename2 = generate_hdf_from_dummy(num_seqs=5, seq_len=3)
+  seq_list_file = tempfile.mktemp(prefix="nose-meta-dataset-seq-list")
+  with open(seq_list_file, "w") as f:
+    f.write("".join(["seq-%i\n" % i for i in range(5)]))
+  try:
+    kwargs = dict(
+      seq_list_file=seq_list_file, seq_lens_file=None,
+      datasets={
+        "audio": {"class": "HDFDataset", "files": [hdf_filename1]},
+        "align": {"class": "HDFDataset", "files": [hdf_filename2]}},
+      data_map={"data": ("audio", "data"), "classes": ("align", "classes")},
+      data_dims={"data": (2, 2), "classes": (3, 1)})
+    ref = _load_all(MetaDataset(parallel_load_seqs=False, **kwargs))
+    dataset = MetaDataset(**kwargs)
+    assert_true(dataset._sub_datasets_loader.parallel)
+    assert_equal(_load_all(dataset), ref)
+    assert_equal([tag for (tag, _) in ref], ["seq-%i" % i for i in range(5)])
+    assert_equal(sorted(dataset._sub_datasets_loader.timing_stats.keys()), ["align", "audio"])
+    assert_equal(dataset._sub_datasets_loader.timing_stats["audio"][0], 5)
+    dataset.init_seq_order(epoch=2)  # reports and resets the stats
+    assert_equal(dataset._sub_datasets_loader.timing_stats, {})
+    assert_equal(_load_all(dataset, epoch=2), ref)
+    pool = dataset._sub_datasets_loader._pool
+    assert_true(pool is not None)
+    dataset.finish_epoch()  # reports the stats of the last epoch, and stops the thread pool
+    assert_equal(dataset._sub_datasets_loader.timing_stats, {})
+    assert_true(dataset._sub_datasets_loader._pool is None)
+    assert_true(not any(thread.is_alive() for thread in pool._pool))
+  finally:
+    os.remove(seq_list_file)
+    os.remove(hdf_filename1)
+    os.remove(hdf_filename2)
+
+
+def test_CombinedDataset_parallel_load_seqs():
+  hdf_filename1 = generate_hdf_from_dummy(num_seqs=4, seq_len=3)
+  hdf_filename2 = generate_hdf_from_dummy(num_seqs=3, seq_len=2)
+  try:
+    kwargs = dict(
+      datasets={
+        "am": {"class": "HDFDataset", "files": [hdf_filename1]},
+        "lm": {"class": "HDFDataset", "files": [hdf_filename2]}},
+      data_map={("am", "data"): "data", ("am", "classes"): "classes", ("lm", "classes"): "lm_classes"},
+      data_dims={"data": (2, 2), "classes": (3, 1), "lm_classes": (3, 1)},
+      seq_ordering="in-order")
+    ref = _load_all(CombinedDataset(parallel_load_seqs=False, **kwargs))
+    assert_equal(len(ref), 7)
+    dataset = CombinedDataset(**kwargs)
+    assert_equal(_load_all(dataset), ref)
+    assert_in("am", dataset._sub_datasets_loader.timing_stats)
+    dataset.finish_epoch()
+    assert_equal(dataset._sub_datasets_loader.timing_stats, {})
+    assert_true(dataset._sub_datasets_loader._pool is None)
+  finally:
+    os.remove(hdf_filename1)
+    os.remove(hdf_filename2)
+
+
+def test_MetaDataset_tag_index():
+  import shutil
+  hdf_filename1 = generate_hdf_from_dummy(num_seqs=5, seq_len=3)
+  hdf_filename2 = generate_hdf_from_dummy(num_seqs=5, seq_len=3)
+  tmp_dir = tempfile.mkdtemp()
+  seq_list_file = "%s/seq-list" % tmp_dir
+  with open(seq_list_file, "w") as f:
+    f.write("seq-3\nseq-1\nseq-4\nseq-0\nseq-2\n")
+  try:
+    kwargs = dict(
+      seq_list_file=seq_list_file, seq_lens_file=None,
+      datasets={
+        "audio": {"class": "HDFDataset", "files": [hdf_filename1]},
+        "align": {"class": "HDFDataset", "files": [hdf_filename2]}},
+      data_map={"data": ("audio", "data"), "classes": ("align", "classes")},
+      data_dims={"data": (2, 2), "classes": (3, 1)},
+      seq_lens_cache_dir=tmp_dir)
+    dataset = MetaDataset(**kwargs)
+    assert_equal(sorted(dataset._sub_seq_idxs.keys()), ["align", "audio"])
+    assert_equal(dataset._sub_seq_idxs["audio"].tolist(), [3, 1, 4, 0, 2])
+    assert_equal(dataset._get_seq_idxs_by_tags(["seq-4", "seq-3"]).tolist(), [2, 0])
+    try:
+      dataset._get_seq_idxs_by_tags(["seq-5"])
+    except KeyError:
+      pass
+    else:
+      assert False, "KeyError expected"
+    assert_equal(len([fn for fn in os.listdir(tmp_dir) if fn.endswith(".tag_index.npy")]), 2)
+    res = _load_all(dataset)
+    assert_equal([tag for (tag, _) in res], ["seq-3", "seq-1", "seq-4", "seq-0", "seq-2"])
+    for key in ["audio", "align"]:
+      sub_dataset = dataset.datasets[key]
+      assert_equal([sub_dataset.get_tag(i) for i in range(5)], ["seq-3", "seq-1", "seq-4", "seq-0", "seq-2"])
+    # Now via the cache.
+    dataset = MetaDataset(**kwargs)
+    assert_equal(dataset._sub_seq_idxs["align"].tolist(), [3, 1, 4, 0, 2])
+    seq_list = ["seq-4", "seq-3", "seq-2", "seq-1", "seq-0"]
+    dataset.init_seq_order(epoch=1, seq_list=seq_list)
+    assert_equal([dataset.datasets["align"].get_tag(i) for i in range(5)], seq_list)
+    assert_equal(_load_all(dataset, epoch=2), res)
+  finally:
+    shutil.rmtree(tmp_dir)
+    os.remove(hdf_filename1)
+    os.remove(hdf_filename2)
+
+
+def test_CombinedDataset_sampling():
+  hdf_filename1 = generate_hdf_from_dummy(num_seqs=20, seq_len=3)
+  hdf_filename2 = generate_hdf_from_dummy(num_seqs=5, seq_len=2)
+  try:
+    kwargs = dict(
+      datasets={
+        "am": {"class": "HDFDataset", "files": [hdf_filename1]},
+        "lm": {"class": "HDFDataset", "files": [hdf_filename2]}},
+      data_map={("am", "data"): "data", ("am", "classes"): "classes", ("lm", "classes"): "lm_classes"},
+      data_dims={"data": (2, 2), "classes": (3, 1), "lm_classes": (3, 1)})
+    dataset = CombinedDataset(sampling_weights={"am": 1., "lm": 1.}, **kwargs)
+    assert_true(dataset.sampling)
+    res = _load_all(dataset)
+    assert_equal(len(res), 25)  # until all datasets are exhausted
+    # Deterministic per epoch, independent of how much we sample per step.
+    dataset.init_seq_order(epoch=2)
+    dataset.init_seq_order(epoch=1)
+    assert_true(dataset.is_less_than_num_seqs(24))
+    assert_equal(_load_all(CombinedDataset(sampling_weights={"am": 1., "lm": 1.}, **kwargs)), res)
+    dataset_seq_idxs = dataset.dataset_seq_idxs[:]
+    assert_equal(len(dataset_seq_idxs), 25)
+    # Each sub dataset is read in order.
+    for i in range(2):
+      assert_equal([s for (d, s) in dataset_seq_idxs if d == i], list(range([20, 5][i])))
+    # With equal weights, the small dataset is exhausted early.
+    assert_true(sum([d for (d, s) in dataset_seq_idxs[:15]]) >= 4)
+    # Via the default weights (num seqs), with a limited epoch size.
+    dataset = CombinedDataset(sampling_temperature=1., sampling_num_seqs=10, **kwargs)
+    assert_equal(dataset.estimated_num_seqs, 10)
+    res = _load_all(dataset, epoch=3)
+    assert_equal(len(res), 10)
+    for tag, data in res:
+      assert_in(tag, ["seq-%i" % i for i in range(20)])
+    assert_true(_load_all(dataset, epoch=4) != res)
+  finally:
+    os.remove(hdf_filename1)
+    os.remove(hdf_filename2)
+
+
+def test_ConcatDataset_global_seq_ordering():
+  hdf_filename1 = generate_hdf_from_dummy(num_seqs=6, seq_len=3)
+  hdf_filename2 = generate_hdf_from_dummy(num_seqs=4, seq_len=2)
+  try:
+    datasets = [{"class": "HDFDataset", "files": [hdf_filename1]}, {"class": "HDFDataset", "files": [hdf_filename2]}]
+    ref = _load_all(ConcatDataset(datasets=datasets))
+    assert_equal(len(ref), 10)
+    assert_equal([len(data["data"]) for (_, data) in ref], [3] * 6 + [2] * 4)
+    ref_sorted = sorted([(tag, repr(data)) for (tag, data) in ref])
+
+    dataset = ConcatDataset(datasets=datasets, seq_ordering="sorted")
+    res = _load_all(dataset)
+    assert_equal([len(data["data"]) for (_, data) in res], [2] * 4 + [3] * 6)
+    assert_equal(sorted([(tag, repr(data)) for (tag, data) in res]), ref_sorted)
+
+    dataset = ConcatDataset(datasets=datasets, seq_ordering="random")
+    res = _load_all(dataset)
+    assert_equal(sorted([(tag, repr(data)) for (tag, data) in res]), ref_sorted)
+    seq_dataset_idxs = dataset._seq_dataset_idxs.tolist()
+    assert_equal(sorted(seq_dataset_idxs), [0] * 6 + [1] * 4)
+    assert_true(seq_dataset_idxs != sorted(seq_dataset_idxs))  # interleaved
+    for i in range(2):
+      assert_equal([j for (d, j) in zip(seq_dataset_idxs, dataset._seq_sub_seq_idxs.tolist()) if d == i],
+                   list(range([6, 4][i])))
+    assert_equal(_load_all(dataset), res)  # same epoch, same order
+    assert_true(_load_all(dataset, epoch=2) != res)
+  finally:
+    os.remove(hdf_filename1)
+    os.remove(hdf_filename2)
+
+
+def test_ConcatDataset_global_seq_ordering_generic_sub_dataset():
+  import shutil
+  hdf_filename1 = generate_hdf_from_dummy(num_seqs=5, seq_len=3)
+  hdf_filename2 = generate_hdf_from_dummy(num_seqs=3, seq_len=2)
+  seq_list_file = tempfile.mktemp(prefix="nose-meta-dataset-seq-list")
+  with open(seq_list_file, "w") as f:
+    f.write("".join(["seq-%i\n" % i for i in range(3)]))
+  cache_dir = tempfile.mkdtemp()
+  try:
+    datasets = [
+      {"class": "HDFDataset", "files": [hdf_filename1]},
+      {"class": "MetaDataset", "seq_list_file": seq_list_file, "seq_lens_file": None,
+       "datasets": {"d": {"class": "HDFDataset", "files": [hdf_filename2]}},
+       "data_map": {"data": ("d", "data"), "classes": ("d", "classes")},
+       "data_dims": {"data": [2, 2], "classes": [3, 1]},  # same as the HDFDataset
+       "seq_lens_cache_dir": cache_dir}]
+    for _ in range(2):  # the second instance uses the seq lens cache file
+      dataset = ConcatDataset(datasets=datasets, seq_ordering="sorted")
+      for epoch in [1, 2]:
+        res = _load_all(dataset, epoch=epoch)
+        assert_equal(dataset.num_seqs, 8)
+        assert_equal([len(data["data"]) for (_, data) in res], [2] * 3 + [3] * 5)
+        assert_equal(dataset._seq_dataset_idxs.tolist(), [1] * 3 + [0] * 5)
+      assert_equal(sorted(dataset._sub_seq_tags_and_lens.keys()), [1])
+      assert_equal(len([fn for fn in os.listdir(cache_dir) if fn.endswith(".seq_lens.npy")]), 1)
+  finally:
+    os.remove(seq_list_file)
+    os.remove(hdf_filename1)
+    os.remove(hdf_filename2)
+    shutil.rmtree(cache_dir)
+
+
+def test_ConcatDataset_global_seq_ordering_no_seq_list_support():
+  hdf_filename = generate_hdf_from_dummy(num_seqs=4, seq_len=2)
+  try:
+    datasets = [
+      {"class": "HDFDataset", "files": [hdf_filename]},
+      {"class": "DummyDataset", "input_dim": 2, "output_dim": 3, "num_seqs": 4}]
+    assert_equal(len(_load_all(ConcatDataset(datasets=datasets))), 8)  # default order works
+    try:
+      ConcatDataset(datasets=datasets, seq_ordering="random")
+    except Exception as exc:
+      assert_in("DummyDataset", str(exc))
+      assert_in("seq_list", str(exc))
+    else:
+      assert False, "expected an exception"
+  finally:
+    os.remove(hdf_filename)
+
+
+def test_ChunkShuffleDataset():
+  from MetaDataset import ChunkShuffleDataset
+  hdf_filename = generate_hdf_from_dummy(num_seqs=20, seq_len=3)
+  try:
+    sub_dataset = {"class": "HDFDataset", "files": [hdf_filename]}
+    ref = _load_all(ChunkShuffleDataset(dataset=sub_dataset, chunk_shuffle_cache=0))
+    assert_equal(len(ref), 20)
+    assert_equal([tag for (tag, _) in ref], ["seq-%i.%i" % (i, i) for i in range(20)])
+    ref_sorted = sorted([(tag.split(".")[0], repr(data)) for (tag, data) in ref])
+
+    dataset = ChunkShuffleDataset(dataset=sub_dataset, chunk_shuffle_cache=5)
+    res = _load_all(dataset)
+    assert_equal(sorted([(tag.split(".")[0], repr(data)) for (tag, data) in res]), ref_sorted)
+    assert_true([tag for (tag, _) in res] != [tag for (tag, _) in ref])
+    assert_equal(dataset._buffer_data["data"].shape, (5, 3, 2))
+    assert_equal(_load_all(ChunkShuffleDataset(dataset=sub_dataset, chunk_shuffle_cache=5)), res)  # deterministic
+    assert_true(_load_all(dataset, epoch=2) != res)
+
+    # Chunks of different lengths. The buffer grows.
+    dataset = ChunkShuffleDataset(dataset=dict(sub_dataset, chunking="2:2"), chunk_shuffle_cache=50)
+    res = _load_all(dataset)
+    assert_equal(len(res), 40)
+    assert_equal(sorted([len(data["data"]) for (_, data) in res]), [1] * 20 + [2] * 20)
+    assert_equal(sum([sum(data["classes"]) for (_, data) in res]), sum([sum(data["classes"]) for (_, data) in ref]))
+  finally:
+    os.remove(hdf_filename)
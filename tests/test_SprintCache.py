@@ -0,0 +1,145 @@
+import sys
+sys.path += ["."]  # Python 3 hack
+
+from nose.tools import assert_equal, assert_is_instance, assert_in, assert_not_in, assert_true, assert_false
+import os
+import shutil
+import tempfile
+import zlib
+from struct import pack
+import numpy
+from SprintCache import FileArchive, FileArchiveBundle, FileInfo
+import better_exchook
+better_exchook.install()
+better_exchook.replace_traceback_format_tb()
+
+
+def _add_raw_entry(archive, filename, data, compress=False):
+  """
+  :param FileArchive archive: opened for writing
+  :param str filename: entry-name
+  :param bytes data: uncompressed content
+  :param bool compress:
+  """
+  archive.write_U32(archive.start_recovery_tag)
+  archive.write_u32(len(filename))
+  archive.write_str(filename)
+  pos = archive.f.tell()
+  comp_data = zlib.compress(data) if compress else b""
+  archive.write_u32(len(data))
+  archive.write_u32(len(comp_data))
+  archive.write_u32(0)
+  archive.f.write(comp_data or data)
+  archive.ft[filename] = FileInfo(filename, pos, len(data), len(comp_data), len(archive.ft))
+  archive.write_U32(archive.end_recovery_tag)
+
+
+def _make_rle_alignment(mixes):
+  """
+  :param list[int] mixes: allophone-state idx per frame
+  :return: flow-alignment in the ALIGNRLE scheme, using all of the run types
+  :rtype: bytes
+  """
+  data = b"".join([pack("I", 14), b"flow-alignment", pack("i", 0), b"ALIGNRLE", pack("I", len(mixes))])
+  data += pack("b", 0) + pack("i", 0)  # explicit time
+  t = 0
+  while t < len(mixes):
+    n = 1
+    while t + n < len(mixes) and mixes[t + n] == mixes[t]:
+      n += 1
+    if n > 1:
+      data += pack("b", -n) + pack("i", mixes[t])
+    else:
+      n = min(3, len(mixes) - t)
+      data += pack("b", n) + b"".join([pack("i", m) for m in mixes[t:t + n]])
+    t += n
+  return data
+
+
+def test_FileArchive_read_np():
+  tmp_dir = tempfile.mkdtemp()
+  try:
+    allophone_file = "%s/allophones" % tmp_dir
+    with open(allophone_file, "w") as f:
+      f.write("# comment\nsi{#+#}@i@f\na{#+#}\nb{#+#}\n")
+    archive_file = "%s/test.cache" % tmp_dir
+    rnd = numpy.random.RandomState(42)
+    feats = rnd.normal(size=(7, 5)).astype("float32")
+    times = [(10.0 * i, 10.0 * i + 25.0) for i in range(len(feats))]
+    mixes = [0, 0, 0, 1 + (1 << 26), 2 + 2 * (1 << 26), 2 + 2 * (1 << 26), 1, 2 + 7 * (1 << 26), 0, 0]
+    archive = FileArchive(archive_file, must_exists=False)
+    archive.addFeatureCache("corpus/seq-feat/1", feats, times)
+    _add_raw_entry(archive, "corpus/seq-align/1", _make_rle_alignment(mixes))
+    _add_raw_entry(archive, "corpus/seq-align-comp/1", _make_rle_alignment(mixes), compress=True)
+    archive.finalize()
+    del archive
+
+    archive = FileArchive(archive_file)
+    archive.setAllophones(allophone_file)
+    ref_times, ref_feats = archive.read("corpus/seq-feat/1", "feat")
+    res_times, res_feats = archive.read_np("corpus/seq-feat/1", "feat")
+    assert_equal(res_feats.dtype, numpy.float32)
+    assert_equal(res_feats.shape, feats.shape)
+    assert_equal(res_feats.tolist(), feats.tolist())
+    assert_equal(res_feats.tolist(), numpy.array(ref_feats).tolist())
+    assert_equal(res_times.tolist(), numpy.array(ref_times).tolist())
+    assert_equal(archive.read_np("corpus/seq-feat/1.attribs", "str"), archive.read("corpus/seq-feat/1.attribs", "str"))
+    for name in ["corpus/seq-align/1", "corpus/seq-align-comp/1"]:
+      ref = archive.read(name, "align")
+      res = archive.read_np(name, "align")
+      assert_equal(res.dtype, numpy.int32)
+      assert_equal(res.tolist(), [list(x) for x in ref])
+      assert_equal(res[:, 2].tolist(), [0, 0, 0, 1, 2, 2, 0, 5, 0, 0])
+      res_raw = archive.read_np(name, "align_raw")
+      assert_equal(res_raw.tolist(), [[t, m] for (t, m) in enumerate(mixes)])
+  finally:
+    shutil.rmtree(tmp_dir)
+
+
+def test_FileArchiveBundle_index():
+  tmp_dir = tempfile.mkdtemp()
+  try:
+    archive_files = []
+    for i in range(5):
+      archive_file = "%s/test.cache.%i" % (tmp_dir, i)
+      archive = FileArchive(archive_file, must_exists=False)
+      for j in range(3):
+        archive.addFeatureCache(
+          "corpus/seq-%i-%i/1" % (i, j), numpy.full((2, 3), i * 10 + j, dtype="float32"), [(0., 10.), (10., 20.)])
+      archive.finalize()
+      del archive
+      archive_files.append(archive_file)
+    bundle_file = "%s/test.bundle" % tmp_dir
+    with open(bundle_file, "w") as f:
+      f.write("".join(["%s\n" % fn for fn in archive_files]))
+
+    def check(bundle):
+      """
+      :param FileArchiveBundle bundle:
+      """
+      assert_equal(len(bundle.file_list()), 5 * 3 * 2)  # with .attribs
+      times, feats = bundle.read_np("corpus/seq-3-2/1", "feat")
+      assert_equal(feats.tolist(), [[32.] * 3] * 2)
+      times, feats = bundle.read("corpus/seq-1-0/1", "feat")
+      assert_equal([f.tolist() for f in feats], [[10.] * 3] * 2)
+
+    for num_threads in [1, 3]:
+      index_file = "%s/test.index.%i" % (tmp_dir, num_threads)
+      bundle = FileArchiveBundle(bundle_file, num_threads=num_threads, index_file=index_file)
+      assert_true(all([a is not None for a in bundle.archives.values()]))
+      check(bundle)
+      assert_true(os.path.exists(index_file))
+    # Now load via the default sidecar index. All archives are opened lazily.
+    FileArchiveBundle(bundle_file)
+    assert_true(os.path.exists("%s.index" % bundle_file))
+    bundle = FileArchiveBundle(bundle_file)
+    assert_equal(list(bundle.archives.values()), [None] * 5)
+    check(bundle)
+    assert_equal(sum([a is not None for a in bundle.archives.values()]), 2)
+    # Outdated index.
+    os.utime(archive_files[0], (0, 0))
+    bundle = FileArchiveBundle(bundle_file)
+    assert_true(all([a is not None for a in bundle.archives.values()]))
+    check(bundle)
+  finally:
+    shutil.rmtree(tmp_dir)
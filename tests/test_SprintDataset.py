@@ -119,5 +119,34 @@ def test_window():
     dataset2.exit_handler()
 
 
+def test_shm_ring_buffer():
+  dataset_kwargs = dict(
+    sprintTrainerExecPath=[sys.executable, sprintExecPath],
+    sprintConfigStr=" ".join([
+      "--*.feature-dimension=7",
+      "--*.trainer-output-dimension=3",
+      "--*.crnn-dataset=DummyDataset(input_dim=7,output_dim=3,num_seqs=20,seq_len=30)"]))
+
+  def load_all(**kwargs):
+    dataset = ExternSprintDataset(**dict(dataset_kwargs, **kwargs))
+    try:
+      dataset.init_seq_order(epoch=1)
+      res = []
+      seq_idx = 0
+      while dataset.is_less_than_num_seqs(seq_idx):
+        dataset.load_seqs(seq_idx, seq_idx + 1)
+        res.append((dataset.get_data(seq_idx, "data").tolist(), dataset.get_data(seq_idx, "classes").tolist()))
+        seq_idx += 1
+      return res
+    finally:
+      dataset.exit_handler()
+
+  ref = load_all(shmRingBufferSize=0)
+  assert_equal(len(ref), 20)
+  assert_equal(load_all(), ref)
+  # Small buffer (a few seqs), such that we wrap around and the child has to wait for us.
+  assert_equal(load_all(shmRingBufferSize=4 * 30 * 7 * 4), ref)
+
+
 if __name__ == "__main__":
   test_assign_dev_data()
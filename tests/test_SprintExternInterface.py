@@ -0,0 +1,110 @@
+
+from __future__ import print_function
+
+import sys
+sys.path += ["."]  # Python 3 hack
+
+from nose.tools import assert_equal, assert_true
+import os
+import struct
+import tempfile
+import threading
+import time
+import numpy
+from SprintExternInterface import ExternSprintDatasetSource
+from TaskSystem import Unpickler
+import better_exchook
+better_exchook.replace_traceback_format_tb()
+
+
+class _RingBufferSetup:
+  """
+  The child side (ExternSprintDatasetSource) with a ring buffer, and our end of the pipes, like the parent.
+  """
+
+  def __init__(self, ring_buffer_size):
+    c2p_r, c2p_w = os.pipe()
+    p2c_r, p2c_w = os.pipe()
+    self.ring_buffer_file = tempfile.TemporaryFile()
+    self.ring_buffer_file.truncate(ring_buffer_size)
+    self.source = ExternSprintDatasetSource(
+      c2p_fd=c2p_w, p2c_fd=p2c_r, inputDim=2, outputDim=3, numSegments=None,
+      ring_buffer_fd=os.dup(self.ring_buffer_file.fileno()), ring_buffer_size=ring_buffer_size)
+    self.pipe_c2p = os.fdopen(c2p_r, "rb")
+    self.p2c_fd = p2c_w
+    assert_equal(self.read_msg(), ("init", (2, 3, None)))
+
+  def read_msg(self):
+    return Unpickler(self.pipe_c2p).load()
+
+  def ack(self, end_pos):
+    os.write(self.p2c_fd, struct.pack("q", end_pos))
+
+  def close(self):
+    self.source.close()
+    assert_equal(self.read_msg(), ("exit", None))
+    self.pipe_c2p.close()
+    os.close(self.p2c_fd)
+    self.ring_buffer_file.close()
+
+
+def test_ring_buffer_alloc():
+  setup = _RingBufferSetup(ring_buffer_size=256)
+  source = setup.source
+  try:
+    assert_equal(source._ring_buffer_alloc(10), 0)  # aligned to 64
+    assert_equal(source.ring_buffer_write_pos, 64)
+    assert_equal(source._ring_buffer_alloc(100), 64)
+    assert_equal(source.ring_buffer_write_pos, 192)
+    # An ack can arrive in pieces.
+    ack_bytes = struct.pack("q", 64)
+    os.write(setup.p2c_fd, ack_bytes[:3])
+    source._read_acks(block=False)
+    assert_equal(source.ring_buffer_read_pos, 0)
+    os.write(setup.p2c_fd, ack_bytes[3:])
+    source._read_acks(block=False)
+    assert_equal(source.ring_buffer_read_pos, 64)
+    # This does not fit at the end, so it wraps around to offset 0,
+    # but the parent has not acknowledged the second seq yet, so we must wait for it.
+    acked = []
+
+    def delayed_ack():
+      time.sleep(0.1)
+      acked.append(True)
+      setup.ack(192)
+
+    thread = threading.Thread(target=delayed_ack)
+    thread.start()
+    assert_equal(source._ring_buffer_alloc(100), 0)
+    assert_true(acked)
+    thread.join()
+    assert_equal(source.ring_buffer_read_pos, 192)
+    assert_equal(source.ring_buffer_write_pos, 256 + 128)
+  finally:
+    setup.close()
+
+
+def test_ring_buffer_addNewData():
+  import mmap
+  setup = _RingBufferSetup(ring_buffer_size=256)
+  ring_buffer = mmap.mmap(setup.ring_buffer_file.fileno(), 256, access=mmap.ACCESS_READ)
+  try:
+    for i in range(5):
+      features = numpy.arange(2 * 6, dtype="float32").reshape(2, 6) + i  # 48 bytes
+      setup.source.addNewData("seq-%i" % i, features, {"classes": numpy.array([i], dtype="int32")})
+      msg_type, (seq_name, (offset, shape, dtype, end_pos), targets) = setup.read_msg()
+      assert_equal((msg_type, seq_name), ("data_shm", "seq-%i" % i))
+      assert_equal(offset, (i * 64) % 256)
+      data = numpy.ndarray(shape=shape, dtype=dtype, buffer=ring_buffer, offset=offset).copy()
+      assert_equal(data.tolist(), features.tolist())
+      assert_equal(targets["classes"].tolist(), [i])
+      setup.ack(end_pos)
+    # Too big for the ring buffer, so this goes over the pipe.
+    features = numpy.zeros((2, 100), dtype="float32")
+    setup.source.addNewData("seq-big", features, {})
+    msg_type, (seq_name, data, _) = setup.read_msg()
+    assert_equal((msg_type, seq_name), ("data", "seq-big"))
+    assert_equal(data.shape, (2, 100))
+  finally:
+    ring_buffer.close()
+    setup.close()
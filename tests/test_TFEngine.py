@@ -87,6 +87,46 @@ def test_DataProvider():
   assert_equal(classes.tolist(), [[1, 2, 0, 1, 2]])
 
 
+def test_DataProvider_multiple_batches():
+  from GeneratingDataset import DummyDataset
+  dataset = DummyDataset(input_dim=2, output_dim=3, num_seqs=6, seq_len=5)
+  dataset.init_seq_order(epoch=1)
+  dataset.load_seqs(0, 6)
+  extern_data = ExternData()
+  extern_data.init_from_dataset(dataset)
+  # First batch is bigger than the following ones, thus the buffers will be reused with padding.
+  batch_list = []
+  batch = Batch()
+  for seq_idx in range(4):
+    batch.add_sequence_as_slice(seq_idx=seq_idx, seq_start_frame=0, length=dataset.get_seq_length(seq_idx))
+  batch_list.append(batch)
+  for seq_idx in [4, 5]:
+    batch = Batch()
+    batch.add_sequence_as_slice(seq_idx=seq_idx, seq_start_frame=1, length=3)
+    batch_list.append(batch)
+  batches = BatchSetGenerator(dataset, generator=iter(batch_list))
+  from TFDataPipeline import FeedDictDataProvider
+  times = []
+  data_provider = FeedDictDataProvider(
+    tf_session=session, extern_data=extern_data,
+    data_keys=["data", "classes"],
+    dataset=dataset, batches=batches, capacity=1,
+    profile_hook=lambda batch, t: times.append(t))
+  outputs = []
+  while batches.has_more():
+    outputs.append(data_provider.get_next_batch())
+    batches.advance(1)
+  assert_equal(len(times), 3)
+  assert_equal(data_provider.num_batches_assembled, 3)
+  assert_equal(outputs[0]["data"].shape, (4, 5, 2))
+  assert_equal(outputs[0]["classes"].tolist(), [dataset.get_data(i, "classes").tolist() for i in range(4)])
+  for seq_idx, output in zip([4, 5], outputs[1:]):
+    assert_equal(output["data"].shape, (1, 3, 2))
+    assert_equal(list(output["data_seq_lens"]), [3])
+    numpy.testing.assert_almost_equal(output["data"][0], dataset.get_data(seq_idx, "data")[1:4])
+    assert_equal(output["classes"][0].tolist(), dataset.get_data(seq_idx, "classes")[1:4].tolist())
+
+
 def test_engine_train():
   from GeneratingDataset import DummyDataset
   seq_len = 5
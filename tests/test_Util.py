@@ -125,6 +125,29 @@ def test_NumbersDict_int_floordiv():
   assert_equal(b.dict["classes"], 1)
 
 
+def test_NumbersDict_max_min():
+  a = NumbersDict({"data": 3, "classes": 5})
+  b = NumbersDict(numbers_dict={"data": 4}, broadcast_value=1)
+  assert_equal(NumbersDict.max([a, b]).dict, {"data": 4, "classes": 5})
+  assert_equal(NumbersDict.min([a, b, 2]).dict, {"data": 2, "classes": 1})
+  assert_equal(a.max_value(), 5)
+  assert_equal(b.max_value(), 4)
+  try:
+    a.max([a, b])
+  except Exception as exc:
+    assert_true("max_value" in str(exc))
+  else:
+    assert False, "expected exception"
+
+
+def test_NumbersDict_pickle():
+  import pickle
+  a = NumbersDict(numbers_dict={"data": 3, "classes": 2}, broadcast_value=1)
+  b = pickle.loads(pickle.dumps(a))
+  assert_equal(b.dict, a.dict)
+  assert_equal(b.value, a.value)
+
+
 def test_collect_class_init_kwargs():
   class A(object):
     def __init__(self, a):